@@ -1,11 +1,27 @@
 import os
+import html
+import argparse
 import datetime
+import numpy as np
 import pandas as pd
 
 from pathlib import Path
+from typing import Dict, List, Optional
 
 _DIR = Path(os.path.dirname(os.path.abspath(__file__)))
 
+IMPLEMENTATIONS = {
+    'js': _DIR / 'javascript/benches/.benchmark.csv',
+    'py': _DIR / 'python/benches/.benchmark.csv',
+    'rs': _DIR / 'rust/benches/.benchmark.csv',
+}
+
+HISTOGRAM_BINS_MS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, np.inf]
+
+# arrival differences (us) written to .benchmark.csv, as the columns of the first version of the file
+PAIRS = [('py', 'rs'), ('js', 'rs'), ('py', 'js')]
+
+
 def df_fmt(df: pd.DataFrame, name: str) -> pd.DataFrame:
     df.columns = ['tx_hash', name]
     df['tx_hash'] = df['tx_hash'].apply(lambda x: x.lower())
@@ -13,15 +29,217 @@ def df_fmt(df: pd.DataFrame, name: str) -> pd.DataFrame:
     return df
 
 
+def load_arrivals(files: Dict[str, Path]) -> pd.DataFrame:
+    """
+    One row per tx_hash seen by any implementation, one column of arrival times (us) per implementation.
+    A hash missing from an implementation is NaN, a hash seen twice keeps its first arrival.
+    """
+    frames = []
+    for name, path in files.items():
+        if not os.path.exists(path):
+            print(f'{name}: {path} not found, skipped')
+            continue
+        df = df_fmt(pd.read_csv(path, header=None, usecols=[0, 1]), name)
+        frames.append(df.groupby('tx_hash', as_index=False)[name].min())
+
+    if not frames:
+        raise FileNotFoundError('No benchmark files found')
+
+    arrivals = frames[0]
+    for df in frames[1:]:
+        arrivals = arrivals.merge(df, on='tx_hash', how='outer')
+    return arrivals.set_index('tx_hash')
+
+
+def estimate_offsets(arrivals: pd.DataFrame, reference: str, quantile: float = 0.05) -> Dict[str, float]:
+    """
+    Clock offset (us) of each implementation against the reference, for runs on boxes without synced clocks.
+
+    A constant clock offset can't be told apart from a constant latency difference,
+    so this assumes the fastest arrivals of both are equally fast: the offset is the
+    `quantile` of the arrival differences over the hashes both have seen.
+    """
+    offsets = {reference: 0.0}
+    for name in arrivals.columns.drop(reference):
+        both = arrivals[[name, reference]].dropna()
+        offsets[name] = float((both[name] - both[reference]).quantile(quantile)) if len(both) else 0.0
+    return offsets
+
+
+def latency_table(arrivals: pd.DataFrame, offsets: Optional[Dict[str, float]] = None) -> pd.DataFrame:
+    """
+    Arrival latency (ms) of every implementation relative to the first implementation to see each tx
+    """
+    corrected = arrivals.copy()
+    for name, offset in (offsets or {}).items():
+        if name in corrected:
+            corrected[name] = corrected[name] - offset
+    first = corrected.min(axis=1)
+    return corrected.sub(first, axis=0) / 1000
+
+
+def summarize(latency: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per implementation: coverage, p50/p90/p99/max latency and win-rate.
+    Win-rate is over the txs seen by at least two implementations, a tie is a win for each,
+    a tx the implementation missed is a loss.
+    """
+    contested = latency[latency.notna().sum(axis=1) >= 2]
+    rows = []
+    for name in latency.columns:
+        seen = latency[name].dropna()
+        rows.append({
+            'implementation': name,
+            'seen': len(seen),
+            'coverage': len(seen) / len(latency) if len(latency) else 0.0,
+            'p50_ms': seen.quantile(0.5) if len(seen) else np.nan,
+            'p90_ms': seen.quantile(0.9) if len(seen) else np.nan,
+            'p99_ms': seen.quantile(0.99) if len(seen) else np.nan,
+            'max_ms': seen.max() if len(seen) else np.nan,
+            'win_rate': (contested[name] == 0).sum() / len(contested) if len(contested) else np.nan,
+        })
+    return pd.DataFrame(rows).set_index('implementation')
+
+
+def histogram(latency: pd.DataFrame) -> pd.DataFrame:
+    labels = []
+    for lo, hi in zip(HISTOGRAM_BINS_MS[:-1], HISTOGRAM_BINS_MS[1:]):
+        labels.append(f'>= {lo} ms' if hi == np.inf else f'{lo}-{hi} ms')
+    counts = {
+        name: pd.cut(latency[name].dropna(), HISTOGRAM_BINS_MS, right=False, labels=labels).value_counts(sort=False)
+        for name in latency.columns
+    }
+    return pd.DataFrame(counts).fillna(0).astype(int)
+
+
+def _md_table(df: pd.DataFrame, floatfmt: str = '{:.3f}') -> str:
+    header = [df.index.name or ''] + list(df.columns)
+    lines = ['| ' + ' | '.join(header) + ' |', '|' + '---|' * len(header)]
+    for idx, row in df.iterrows():
+        cells = [str(idx)] + [floatfmt.format(v) if isinstance(v, float) else str(v) for v in row]
+        lines.append('| ' + ' | '.join(cells) + ' |')
+    return '\n'.join(lines)
+
+
+def render_markdown(summary: pd.DataFrame, hist: pd.DataFrame, offsets: Dict[str, float], total: int) -> str:
+    width = 40
+    peak = max(1, int(hist.values.max())) if hist.size else 1
+    bars = []
+    for name in hist.columns:
+        bars.append(f'{name}:')
+        for label, count in hist[name].items():
+            bars.append(f'  {label:>12} | {"#" * int(round(count / peak * width)):<{width}} {count}')
+
+    return '\n'.join([
+        '# Pending transaction arrival latency',
+        '',
+        f'Generated {datetime.datetime.now().isoformat(timespec="seconds")} over {total} transactions.',
+        'Latency is relative to the first implementation to see each transaction.',
+        '',
+        '## Summary',
+        '',
+        _md_table(summary),
+        '',
+        '## Clock offsets (us, subtracted)',
+        '',
+        ', '.join(f'{name}: {offset:.0f}' for name, offset in offsets.items()) or 'none',
+        '',
+        '## Histogram',
+        '',
+        '```',
+        *bars,
+        '```',
+        '',
+    ])
+
+
+def render_html(summary: pd.DataFrame, hist: pd.DataFrame, offsets: Dict[str, float], total: int) -> str:
+    peak = max(1, int(hist.values.max())) if hist.size else 1
+    rows = []
+    for label in hist.index:
+        cells = ''.join(
+            f'<td><div class="bar" style="width:{hist.at[label, name] / peak * 200:.0f}px"></div>{hist.at[label, name]}</td>'
+            for name in hist.columns
+        )
+        rows.append(f'<tr><th>{html.escape(str(label))}</th>{cells}</tr>')
+    histogram_table = (
+        '<table><tr><th></th>' + ''.join(f'<th>{html.escape(name)}</th>' for name in hist.columns) + '</tr>'
+        + ''.join(rows) + '</table>'
+    )
+    offsets_text = ', '.join(f'{name}: {offset:.0f}' for name, offset in offsets.items()) or 'none'
+
+    return f'''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Pending transaction arrival latency</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; margin-bottom: 2em; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 8px; text-align: right; }}
+.bar {{ display: inline-block; height: 10px; background: #4a7; margin-right: 6px; }}
+</style>
+</head>
+<body>
+<h1>Pending transaction arrival latency</h1>
+<p>Generated {datetime.datetime.now().isoformat(timespec="seconds")} over {total} transactions.
+Latency is relative to the first implementation to see each transaction.</p>
+<h2>Summary</h2>
+{summary.to_html(float_format=lambda v: f"{v:.3f}")}
+<h2>Clock offsets (us, subtracted)</h2>
+<p>{html.escape(offsets_text)}</p>
+<h2>Histogram</h2>
+{histogram_table}
+</body>
+</html>
+'''
+
+
+def parse_offsets(values: List[str]) -> Dict[str, float]:
+    offsets = {}
+    for value in values:
+        name, offset = value.split('=')
+        offsets[name] = float(offset)
+    return offsets
+
+
 if __name__ == '__main__':
-    js = df_fmt(pd.read_csv(_DIR / 'javascript/benches/.benchmark.csv', header=None), 'js')
-    py = df_fmt(pd.read_csv(_DIR / 'python/benches/.benchmark.csv', header=None), 'py')
-    rs = df_fmt(pd.read_csv(_DIR / 'rust/benches/.benchmark.csv', header=None), 'rs')
-    
-    bench = js.merge(py, on='tx_hash').merge(rs, on='tx_hash')
-    bench['py - rs'] = bench['py'] - bench['rs']
-    bench['js - rs'] = bench['js'] - bench['rs']
-    bench['py - js'] = bench['py'] - bench['js']
-    bench = bench.drop_duplicates(['tx_hash'], keep='last')
-    
-    bench.to_csv(_DIR / '.benchmark.csv', index=None)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Cross-implementation pending tx latency report')
+    parser.add_argument('--offset', action='append', default=[],
+                        help='known clock offset of an implementation in us, ex. --offset py=1500')
+    parser.add_argument('--estimate-offsets', metavar='REFERENCE',
+                        help='estimate clock offsets against this implementation (runs on different boxes)')
+    parser.add_argument('--format', choices=['md', 'html'], default='md')
+    parser.add_argument('--out', help='report file (default: benchmark-report.md / .html)')
+    args = parser.parse_args()
+
+    arrivals = load_arrivals(IMPLEMENTATIONS)
+
+    offsets = parse_offsets(args.offset)
+    if args.estimate_offsets:
+        offsets = {**estimate_offsets(arrivals, args.estimate_offsets), **offsets}
+
+    latency = latency_table(arrivals, offsets)
+    summary = summarize(latency)
+    hist = histogram(latency)
+
+    # arrivals and pairwise differences in us as before (clock offsets subtracted), now keeping
+    # hashes some implementations missed, then the latencies of the report in ms
+    bench = arrivals.copy()
+    for name, offset in offsets.items():
+        if name in bench:
+            bench[name] = bench[name] - offset
+    for a, b in PAIRS:
+        if a in bench and b in bench:
+            bench[f'{a} - {b}'] = bench[a] - bench[b]
+    for name in latency.columns:
+        bench[f'{name} (ms)'] = latency[name]
+    bench.reset_index().to_csv(_DIR / '.benchmark.csv', index=None)
+
+    render = render_html if args.format == 'html' else render_markdown
+    out = Path(args.out) if args.out else _DIR / f'benchmark-report.{args.format}'
+    with open(out, 'w') as f:
+        f.write(render(summary, hist, offsets, len(latency)))
+
+    print(summary.to_string(float_format=lambda v: f'{v:.3f}'))
+    print(f'Report written: {out}')
@@ -0,0 +1,125 @@
+import threading
+
+from eth_utils import to_checksum_address
+from typing import Dict, List, Optional, Union
+
+AddressLike = Union[str, bytes]
+
+
+def to_bytes(address: AddressLike) -> bytes:
+    """
+    Canonical form of an address: its 20 raw bytes
+    """
+    if isinstance(address, str):
+        address = bytes.fromhex(address[2:] if address[:2] in ('0x', '0X') else address)
+    else:
+        address = bytes(address)
+    if len(address) == 32:
+        # left-padded log topic / abi word
+        address = address[12:]
+    if len(address) != 20:
+        raise ValueError(f'Not an address: {address.hex()}')
+    return address
+
+
+class AddressRegistry:
+    """
+    Interns addresses as small ints, so in-memory tables and indexes can be keyed
+    (and numpy arrays indexed) by id instead of by strings in whatever casing
+    the data source used.
+
+    Any form of an address (checksum hex, lowercase hex, 20 raw bytes or a 32 bytes
+    topic) maps to the same id. Ids are dense, starting from 0, and never reused.
+    Exact input strings are cached, so converting an address seen before
+    is a single dict lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids: Dict[bytes, int] = {}
+        self._cache: Dict[AddressLike, int] = {}
+        self._bytes: List[bytes] = []
+        self._checksum: List[Optional[str]] = []
+
+    def __len__(self) -> int:
+        return len(self._bytes)
+
+    def __contains__(self, address: AddressLike) -> bool:
+        return self.get(address) is not None
+
+    def id(self, address: AddressLike) -> int:
+        """
+        Returns the id of an address, assigning a new one if it was never seen
+        """
+        address_id = self._cache.get(address)
+        if address_id is not None:
+            return address_id
+
+        raw = to_bytes(address)
+        with self._lock:
+            address_id = self._ids.get(raw)
+            if address_id is None:
+                address_id = len(self._bytes)
+                self._ids[raw] = address_id
+                self._bytes.append(raw)
+                self._checksum.append(None)
+            self._cache[address] = address_id
+        return address_id
+
+    def get(self, address: AddressLike) -> Optional[int]:
+        """
+        Returns the id of an address, or None if it was never interned.
+        Use this for addresses coming from streams, so unrelated contracts
+        do not grow the registry.
+        """
+        address_id = self._cache.get(address)
+        if address_id is not None:
+            return address_id
+        try:
+            address_id = self._ids.get(to_bytes(address))
+        except ValueError:
+            return None
+        if address_id is not None:
+            self._cache[address] = address_id
+        return address_id
+
+    def ids(self, addresses: List[AddressLike]) -> List[int]:
+        return [self.id(address) for address in addresses]
+
+    def address(self, address_id: int) -> str:
+        """
+        Checksum address of an id, used when leaving the process (RPC calls, calldata, logs)
+        """
+        checksum = self._checksum[address_id]
+        if checksum is None:
+            checksum = to_checksum_address(self._bytes[address_id])
+            self._checksum[address_id] = checksum
+        return checksum
+
+    def to_bytes(self, address_id: int) -> bytes:
+        return self._bytes[address_id]
+
+    def export(self) -> bytes:
+        """
+        The raw addresses of every id, in id order, 20 bytes each
+        """
+        with self._lock:
+            return b''.join(self._bytes)
+
+    def restore(self, raw: bytes):
+        """
+        Interns the addresses of export() in order, so they get back the same ids.
+        Addresses already interned must be a prefix of the restored ones.
+        """
+        addresses = [bytes(raw[i:i + 20]) for i in range(0, len(raw), 20)]
+        with self._lock:
+            if self._bytes != addresses[:len(self._bytes)]:
+                raise ValueError('Registry ids conflict with the restored ones')
+            for address in addresses[len(self._bytes):]:
+                self._ids[address] = len(self._bytes)
+                self._bytes.append(address)
+                self._checksum.append(None)
+
+
+# the process-wide registry, ids are only meaningful within one process
+ADDRESSES = AddressRegistry()
@@ -1,9 +1,11 @@
 import os
 import csv
 import time
+import tracemalloc
 import asyncio
 import datetime
 import aioprocessing
+import multiprocessing
 from uuid import uuid4
 
 from web3 import Web3
@@ -20,13 +22,15 @@ from constants import (
     BOT_ADDRESS,
 )
 from pools import load_all_pools_from_v2
-from paths import generate_triangular_paths
-from bundler import Bundler, Flashloan
+from paths import PathTable, generate_triangular_paths
+from bundler import Bundler, Flashloan, OrderTemplate, encode_order_calldata
 from utils import get_touched_pool_reserves, calculate_next_block_base_fee
 from multi import get_uniswap_v2_reserves, batch_get_uniswap_v2_reserves
 from streams import stream_new_blocks, stream_pending_transactions
+from transport import make_event_queue
 
 ZERO_ADDRESS = '0x0000000000000000000000000000000000000000'
+BALANCER_VAULT = '0xBA12222222228d8Ba445958a75a0704d566BF2C8'
 
 # Create benches directory if it doesn't exist
 _DIR = Path(os.path.dirname(os.path.abspath(__file__)))
@@ -86,6 +90,117 @@ async def benchmark_streams(stream_func: Callable,
     handler_task.cancel()
 
 
+def benchmark_order_calldata(path_params: list, iterations: int = 100000):
+    """
+    Compares encodes per second of order_tx's eth_abi encoding
+    against a per-path OrderTemplate. No node connection needed.
+    """
+    amount_ins = [(i + 1) * 10 ** 6 for i in range(iterations)]
+
+    s = time.perf_counter()
+    for amount_in in amount_ins:
+        _ = encode_order_calldata(path_params, amount_in, Flashloan.Balancer, BALANCER_VAULT)
+    eth_abi_rate = iterations / (time.perf_counter() - s)
+
+    template = OrderTemplate(path_params)
+    s = time.perf_counter()
+    for amount_in in amount_ins:
+        _ = template.encode(amount_in, Flashloan.Balancer, BALANCER_VAULT)
+    template_rate = iterations / (time.perf_counter() - s)
+
+    expected = encode_order_calldata(path_params, amount_ins[-1], Flashloan.Balancer, BALANCER_VAULT)
+    assert template.encode(amount_ins[-1], Flashloan.Balancer, BALANCER_VAULT) == expected
+
+    return eth_abi_rate, template_rate
+
+
+def benchmark_path_memory(paths: list) -> dict:
+    """
+    Memory per path and time to walk every hop of every path,
+    for the ArbPath objects and for their PathTable. No node connection needed.
+    """
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    copies = [type(path)(path.pool_1, path.pool_2, path.pool_3,
+                         path.token_in_1, path.token_out_1,
+                         path.token_in_2, path.token_out_2,
+                         path.token_in_3, path.token_out_3,
+                         path.fee_1, path.fee_2, path.fee_3) for path in paths]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    s = time.perf_counter()
+    zero_for_one = 0
+    for path in copies:
+        for pool, token_in in zip(path.pools, path.tokens_in):
+            zero_for_one += token_in == pool.token0
+    path_iter = time.perf_counter() - s
+
+    table = PathTable(paths)
+    s = time.perf_counter()
+    table_zero_for_one = int(table.zero_for_one[table.pools >= 0].sum())
+    table_iter = time.perf_counter() - s
+
+    assert zero_for_one == table_zero_for_one
+
+    n = max(1, len(paths))
+    return {
+        'path_bytes': (after - before) / n,
+        'table_bytes': table.nbytes() / n,
+        'path_iter_us': path_iter / n * 1000000,
+        'table_iter_us': table_iter / n * 1000000,
+    }
+
+
+def _produce_timestamped_events(event_queue, n: int, interval: float):
+    # the send time travels in the tx_hash field, so every transport can carry it
+    for _ in range(n):
+        tx_hash = '0x' + time.monotonic_ns().to_bytes(32, 'big').hex()
+        event_queue.put({'type': 'pending_tx', 'tx_hash': tx_hash})
+        time.sleep(interval)
+
+
+async def _produce_timestamped_events_async(event_queue, n: int, interval: float):
+    for _ in range(n):
+        tx_hash = '0x' + time.monotonic_ns().to_bytes(32, 'big').hex()
+        event_queue.put({'type': 'pending_tx', 'tx_hash': tx_hash})
+        await asyncio.sleep(interval)
+
+
+async def benchmark_event_transport(mode: str, n: int = 10000, interval: float = 0.0001) -> dict:
+    """
+    Publish-to-consume latency (microsecs) of an event transport (see transport.make_event_queue).
+    The producer runs in a separate process, except for the in-process "local" mode.
+    """
+    event_queue = make_event_queue(mode)
+
+    if mode == 'local':
+        producer = asyncio.create_task(_produce_timestamped_events_async(event_queue, n, interval))
+    else:
+        producer = multiprocessing.Process(target=_produce_timestamped_events,
+                                           args=(event_queue, n, interval))
+        producer.start()
+
+    latencies = []
+    for _ in range(n):
+        event = await event_queue.coro_get()
+        latencies.append((time.monotonic_ns() - int(event['tx_hash'], 16)) / 1000)
+
+    if mode == 'local':
+        await producer
+    else:
+        producer.join()
+        if mode == 'shm':
+            event_queue.close()
+
+    latencies.sort()
+    return {
+        'p50': latencies[len(latencies) // 2],
+        'p99': latencies[int(len(latencies) * 0.99)],
+        'max': latencies[-1],
+    }
+
+
 if __name__ == '__main__':
     print('Starting benchmark')
     
@@ -123,7 +238,7 @@ if __name__ == '__main__':
     # 4️⃣ Generate triangular arbitrage paths #
     ##########################################
     s = time.time()
-    paths = generate_triangular_paths(pools, usdc_address)
+    paths = generate_triangular_paths({pool.id: pool for pool in pools.values()}, usdc_address)
     took = (time.time() - s) * 1000
     print(f'4. Generated {len(paths)} 3-hop paths | Took: {took} ms')
 
@@ -260,4 +375,23 @@ if __name__ == '__main__':
         took_list.append(total_took)
         
     print(sum(took_list))
-    
\ No newline at end of file
+
+    ###################################
+    # 1️⃣1️⃣ Order calldata encoding #
+    ###################################
+    eth_abi_rate, template_rate = benchmark_order_calldata(path_params)
+    print(f'11. Order calldata | eth_abi: {eth_abi_rate:.0f} encodes/s, '
+          f'template: {template_rate:.0f} encodes/s ({template_rate / eth_abi_rate:.1f}x)')
+
+    ###############################################
+    # 1️⃣2️⃣ Stream to strategy event transports #
+    ###############################################
+    for mode in ['aioprocessing', 'shm', 'local']:
+        latency = asyncio.run(benchmark_event_transport(mode))
+        print(f'12. {mode} event transport latency (microsecs) | {latency}')
+
+    #########################################
+    # 1️⃣3️⃣ Path memory and iteration #
+    #########################################
+    path_memory = benchmark_path_memory(paths)
+    print(f'13. Path memory/iteration (bytes, microsecs per path) | {path_memory}')
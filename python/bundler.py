@@ -1,40 +1,19 @@
-import eth_abi
-
 from web3 import Web3
-from enum import Enum
 from loguru import logger
 from flashbots import flashbot
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional
 from eth_account.account import Account
 
-from relay import send_bundle
+from relay import send_bundle, BundleSubmitter
+from nonce import NonceManager, is_nonce_error
+from utils import AccessListCache
+from orders import ZERO_ADDRESS, Path, Flashloan, OrderTemplate, path_key, encode_order_calldata
 from constants import (
-    BOT_ABI,
     PRIVATE_RELAY,
+    PRIVATE_RELAYS,
+    load_abi,
 )
 
-ZERO_ADDRESS = '0x0000000000000000000000000000000000000000'
-
-
-class Path:
-    
-    def __init__(self,
-                 router: str,
-                 token_in: str,
-                 token_out: str):
-        self.router = router
-        self.token_in = token_in
-        self.token_out = token_out
-        
-    def to_list(self):
-        return [self.router, self.token_in, self.token_out]
-    
-    
-class Flashloan(Enum):
-    NotUsed = 0
-    Balancer = 1
-    UniswapV2 = 2
-
 
 class Bundler:
     
@@ -50,27 +29,59 @@ class Bundler:
         self.w3 = Web3(Web3.HTTPProvider(https_url))
         flashbot(self.w3, self.signer, PRIVATE_RELAY)
         self.chain_id = self.w3.eth.chain_id
-        self.bot = self.w3.eth.contract(address=bot_address, abi=BOT_ABI)
+        self.bot = self.w3.eth.contract(address=bot_address, abi=load_abi('V2ArbBot.json'))
+        self.nonces = NonceManager(self.w3, self.sender.address)
+        self._templates: Dict[tuple, OrderTemplate] = {}
+        self.submitter = BundleSubmitter(https_url, PRIVATE_RELAYS, self.signer)
+        # start self.access_lists.run() as a task to attach access lists to order txs
+        self.access_lists = AccessListCache(https_url)
         
-    def to_bundle(self, tx: Dict[str, Any]) -> List[Dict[str, Any]]:
-        signed = self.sender.sign_transaction(tx)
-        return [{'signed_transaction': signed.rawTransaction}]
+    def to_bundle(self, *txs: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Signs txs into a bundle, executed in the order given (ex. the orders of selection.OrderSelector)
+        """
+        return [{'signed_transaction': self.sender.sign_transaction(tx).rawTransaction} for tx in txs]
     
     async def send_bundle(self,
                           bundle: List[Dict[str, Any]],
                           retry: int,
                           block_number: int = None):
         await send_bundle(self.w3, bundle, retry, block_number)
+
+    async def submit_bundle(self,
+                            bundle: List[Dict[str, Any]],
+                            retry: int,
+                            block_number: int = None,
+                            on_simulation: Optional[Callable[[Dict[str, Any]], None]] = None) -> list:
+        """
+        Sends the bundle to all PRIVATE_RELAYS in parallel.
+        Feed new blocks to self.submitter.on_new_head for inclusion tracking.
+        on_simulation gets the relay simulation of the bundle, see BundleSubmitter.submit.
+        """
+        return await self.submitter.submit(bundle, retry, block_number, on_simulation=on_simulation)
         
+    def sign_tx(self, transaction: Dict[str, Any]) -> bytes:
+        return self.sender.sign_transaction(transaction).rawTransaction
+
     def send_tx(self, transaction: Dict[str, Any]) -> str:
-        signed = self.sender.sign_transaction(transaction)
-        tx_hash = self.w3.eth.send_raw_transaction(signed.rawTransaction)
+        return self.send_raw_tx(self.sign_tx(transaction))
+
+    def send_raw_tx(self, raw_transaction: bytes) -> str:
+        try:
+            tx_hash = self.w3.eth.send_raw_transaction(raw_transaction)
+        except ValueError as e:
+            if is_nonce_error(e):
+                self.nonces.sync()
+            raise
         logger.info(tx_hash)
         return tx_hash
         
     @property
     def _common_fields(self) -> Dict[str, any]:
-        nonce = self.w3.eth.get_transaction_count(self.sender.address)
+        """
+        Every access reserves a new nonce from the local nonce manager
+        """
+        nonce = self.nonces.next()
         return {
             'from': self.sender.address,
             'nonce': nonce,
@@ -134,7 +145,8 @@ class Bundler:
                  max_priority_fee_per_gas: float,
                  max_fee_per_gas: float,
                  flashloan: Flashloan = Flashloan.NotUsed,
-                 loan_from: str = ZERO_ADDRESS) -> Dict[str, Any]:
+                 loan_from: str = ZERO_ADDRESS,
+                 gas: int = 600000) -> Dict[str, Any]:
         """
         Sends an order transaction to the contract.
         There is only a "fallback" function for this.
@@ -151,30 +163,81 @@ class Bundler:
         2. Uniswap V2 flashswap: pass in
             - flashloan: Flashloan.UniswapV2
             - loan_from: UniswapV2Pair address
+
+        :param gas: the gas limit, see gasmodel.GasModel.limit
         """
-        nhop = len(paths)
-        
-        calldata_types = ['uint', 'uint', 'address']
-        path_types = ['address', 'address', 'address'] * nhop
-        calldata_types = calldata_types + path_types
-        
-        calldata_raw = [amount_in, flashloan.value, loan_from]
-        
-        for path in paths:
-            calldata_raw.extend(path.to_list())
-            
-        calldata = eth_abi.encode(calldata_types, calldata_raw)
-        
+        calldata = encode_order_calldata(paths, amount_in, flashloan, loan_from)
+        return self._order_fields(path_key(paths), calldata, max_priority_fee_per_gas, max_fee_per_gas, gas)
+
+    def order_template(self, paths: List[Path]) -> OrderTemplate:
+        """
+        Returns the cached calldata template for this swap path
+        """
+        key = path_key(paths)
+        template = self._templates.get(key)
+        if template is None:
+            template = OrderTemplate(paths)
+            self._templates[key] = template
+        return template
+
+    def templated_order_tx(self,
+                           template: OrderTemplate,
+                           amount_in: int,
+                           max_priority_fee_per_gas: float,
+                           max_fee_per_gas: float,
+                           flashloan: Flashloan = Flashloan.NotUsed,
+                           loan_from: str = ZERO_ADDRESS,
+                           gas: int = 600000) -> Dict[str, Any]:
+        """
+        Same as order_tx, but only patches amount_in, flashloan, loan_from
+        into a calldata template created once per path (Bundler.order_template)
+        """
+        calldata = template.encode(amount_in, flashloan, loan_from)
+        return self._order_fields(template.key, calldata, max_priority_fee_per_gas, max_fee_per_gas, gas)
+
+    def order_call(self,
+                   paths: List[Path],
+                   amount_in: int = 0,
+                   flashloan: Flashloan = Flashloan.NotUsed,
+                   loan_from: str = ZERO_ADDRESS) -> Dict[str, Any]:
+        """
+        A nonce-free order call, used to warm up the access list cache
+        """
+        calldata = encode_order_calldata(paths, amount_in, flashloan, loan_from)
         return {
+            'from': self.sender.address,
+            'to': self.bot.address,
+            'data': '0x' + calldata.hex(),
+        }
+
+    def _order_fields(self,
+                      key: tuple,
+                      calldata: bytes,
+                      max_priority_fee_per_gas: float,
+                      max_fee_per_gas: float,
+                      gas: int) -> Dict[str, Any]:
+        tx = {
             **self._common_fields,
             'to': self.bot.address,
             'value': 0,
             'data': '0x' + calldata.hex(),
-            'gas': 600000,
+            'gas': gas,
             'maxFeePerGas': max_fee_per_gas,
             'maxPriorityFeePerGas': max_priority_fee_per_gas,
         }
 
+        access_list = self.access_lists.get(key)
+        if access_list is not None:
+            tx['accessList'] = access_list
+        else:
+            # first trade on this path, compute it in the background for the next one
+            self.access_lists.request(key, {
+                'from': tx['from'],
+                'to': tx['to'],
+                'data': tx['data'],
+            })
+        return tx
+
 
 if __name__ == '__main__':
     """
@@ -263,26 +326,15 @@ if __name__ == '__main__':
     # Filter pools that were used in arb paths
     pools = {}
     for path in paths:
-        pools[path.pool_1.address] = path.pool_1
-        pools[path.pool_2.address] = path.pool_2
-        pools[path.pool_3.address] = path.pool_3
+        for pool in path.pools:
+            pools[pool.address] = pool
 
     reserves = batch_get_uniswap_v2_reserves(HTTPS_URL, pools)
 
     path = paths[0]
     sushiswap_v2_router = '0x1b02dA8Cb0d097eB8D57A175b88c7D8b47997506'
     
-    swap_paths = []
-    
-    for i in range(path.nhop):
-        pool = getattr(path, f'pool_{i + 1}')
-        zero_for_one = getattr(path, f'zero_for_one_{i + 1}')
-        if zero_for_one:
-            token_in, token_out = pool.token0, pool.token1
-        else:
-            token_in, token_out = pool.token1, pool.token0
-        swap_path = Path(sushiswap_v2_router, token_in, token_out)
-        swap_paths.append(swap_path)
+    swap_paths = path.to_path_params([sushiswap_v2_router] * path.nhop)
         
     amount_in = 1 * 10 ** 6
     
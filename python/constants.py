@@ -1,5 +1,6 @@
 import os
 import json
+import functools
 
 from pathlib import Path
 from loguru import logger
@@ -13,19 +14,61 @@ BLOCKNATIVE_TOKEN = os.getenv('BLOCKNATIVE_TOKEN')
 PRIVATE_KEY = os.getenv('PRIVATE_KEY')
 SIGNING_KEY = os.getenv('SIGNING_KEY')
 BOT_ADDRESS = os.getenv('BOT_ADDRESS')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9101))
+PROFILE_SOCKET = os.getenv('PROFILE_SOCKET', '/tmp/bot-profiler.sock')
+PROFILE_SECONDS = float(os.getenv('PROFILE_SECONDS', 10))
+SNAPSHOT_INTERVAL = int(os.getenv('SNAPSHOT_INTERVAL', 100))  # blocks between snapshots
+SNAPSHOT_MAX_AGE = int(os.getenv('SNAPSHOT_MAX_AGE', 50000))  # blocks, older snapshots are ignored
+PRUNE_MIN_RESERVE = float(os.getenv('PRUNE_MIN_RESERVE', 1e-3))  # token units, pools below are pruned
+PRUNE_MAX_IDLE_BLOCKS = int(os.getenv('PRUNE_MAX_IDLE_BLOCKS', 200000))  # blocks without a Sync / Swap
+PRUNE_INTERVAL = float(os.getenv('PRUNE_INTERVAL', 300))  # seconds between re-evaluations
+POOL_HEADROOM = int(os.getenv('POOL_HEADROOM', 10000))  # paths / pool ids allocated for pools created while running
+PREFILTER_MIN_SPREAD = float(os.getenv('PREFILTER_MIN_SPREAD', 0.0))  # %, marginal spread after fee to simulate a path
+SELECT_TOP_K = int(os.getenv('SELECT_TOP_K', 10))  # candidates re-simulated per block
+SELECT_MAX_ORDERS = int(os.getenv('SELECT_MAX_ORDERS', 4))  # orders sent together per block
 
 _DIR = Path(os.path.dirname(os.path.abspath(__file__)))
 
 ABI_PATH = _DIR / 'abi'
 CACHED_POOLS_FILE = _DIR / '.cached-pools.csv'
+GAS_MODEL_FILE = _DIR / '.gas-model.json'
+PROFILE_DIR = _DIR / 'profiles'
+SNAPSHOT_FILE = _DIR / '.snapshot.bin'
 
-# retrieved from Etherscan
-ERC20_ABI = json.load(open(ABI_PATH / 'ERC20.json', 'r'))
-UNISWAP_V2_FACTORY_ABI = json.load(open(ABI_PATH / 'UniswapV2Factory.json', 'r'))
-WETH_ABI = json.load(open(ABI_PATH / 'WETH.json', 'r'))
 
-# compiled using Foundry
-BOT_ABI = json.load(open(ABI_PATH / 'V2ArbBot.json', 'r'))['abi']
+@functools.lru_cache(maxsize=None)
+def load_abi(filename: str) -> list:
+    """
+    ABIs are read on first use, importing this module doesn't touch the disk
+    """
+    with open(ABI_PATH / filename, 'r') as f:
+        abi = json.load(f)
+    # artifacts compiled using Foundry keep the ABI under 'abi'
+    return abi['abi'] if isinstance(abi, dict) else abi
+
+
+_LAZY_ABIS = {
+    # retrieved from Etherscan
+    'ERC20_ABI': 'ERC20.json',
+    'UNISWAP_V2_FACTORY_ABI': 'UniswapV2Factory.json',
+    'WETH_ABI': 'WETH.json',
+    # compiled using Foundry
+    'BOT_ABI': 'V2ArbBot.json',
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ABIS:
+        return load_abi(_LAZY_ABIS[name])
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 PRIVATE_RELAY = 'https://relay.flashbots.net'
 # PRIVATE_RELAY = 'https://bor.txrelay.marlin.org/'
+
+# bundles are sent to all of these in parallel by relay.BundleSubmitter
+PRIVATE_RELAYS = [
+    PRIVATE_RELAY,
+    # 'https://rpc.beaverbuild.org/',
+    # 'https://rpc.titanbuilder.xyz/',
+]
@@ -0,0 +1,303 @@
+import math
+import numpy as np
+
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pools import DexVariant
+
+# Negative cycle detection over the whole market, whatever the start token.
+#
+# Every pool is two directed edges between its tokens, weighted by -log of the marginal
+# rate after fee (V2: reserve_out / reserve_in, V3: sqrtP^2 or its inverse), so a cycle
+# of negative weight is a cycle whose product of rates is above 1. Weights use raw token
+# units, decimals cancel out around a cycle.
+#
+# Detection is a bounded SPFA (queue based Bellman-Ford) from a virtual source linked to
+# every token: a relaxation that would make a token its own ancestor closes a cycle,
+# which is recorded instead of relaxed, so the shortest path tree stays a tree. Paths are
+# cut at max_hops edges and the number of relaxations per pass is capped.
+#
+# Updates are incremental: only the edges of the pools whose state changed are re-weighted,
+# the subtrees hanging from edges that got heavier are reset to the source, and SPFA restarts
+# from the tails of the edges that changed. Known cycles through the changed pools are
+# re-checked, the others keep their weight.
+#
+# Cycles are closed along the shortest path tree, so a pass reports a subset of the negative cycles,
+# and an incremental pass can report other ones than a full pass over the same state would.
+#
+# Rates are marginal, a cycle is a candidate to size with the pricing kernels (paths.simulate_path).
+
+_LOG_Q96 = 96 * math.log(2)
+
+
+def edge_weights(pool, state: List[int]) -> Tuple[float, float]:
+    """
+    -log of the marginal rates after fee of a pool, (token0 -> token1, token1 -> token0).
+    Rows are (reserve0, reserve1) for V2 pools, (sqrtPriceX96, liquidity) for V3 pools,
+    as in parallel.SimulationPool. An empty pool has no edges (inf weights).
+    """
+    if pool.version == DexVariant.UniswapV3:
+        if state[0] <= 0 or state[1] <= 0:
+            return math.inf, math.inf
+        log_price = 2 * (math.log(state[0]) - _LOG_Q96)
+        log_fee = math.log1p(-pool.fee / 1000000)
+    else:
+        if state[0] <= 0 or state[1] <= 0:
+            return math.inf, math.inf
+        log_price = math.log(state[1]) - math.log(state[0])
+        log_fee = math.log((1000 - pool.fee // 100) / 1000)
+    return -(log_price + log_fee), -(log_fee - log_price)
+
+
+class Cycle:
+    """
+    A cycle of swaps, log_profit is the log of the product of the marginal rates (> 0)
+    """
+
+    __slots__ = ('edges', 'pool_ids', 'zero_for_one', 'tokens', 'log_profit')
+
+    def __init__(self,
+                 edges: Tuple[int, ...],
+                 pool_ids: Tuple[int, ...],
+                 zero_for_one: Tuple[bool, ...],
+                 tokens: Tuple[int, ...],
+                 log_profit: float):
+
+        self.edges = edges
+        self.pool_ids = pool_ids
+        self.zero_for_one = zero_for_one
+        self.tokens = tokens  # token ids, tokens[i] is the input of hop i
+        self.log_profit = log_profit
+
+    @property
+    def nhop(self) -> int:
+        return len(self.edges)
+
+    @property
+    def rate(self) -> float:
+        return math.exp(self.log_profit)
+
+    def __repr__(self) -> str:
+        return f'Cycle(pools={self.pool_ids}, tokens={self.tokens}, rate={self.rate:.6f})'
+
+
+class NegativeCycleDetector:
+    """
+    Profitable cycles of up to max_hops swaps among pools, from the current state of the pools.
+    Pools are the pools to watch (any mix of V2 and V3 pools), set_states() gives them a state,
+    and returns the cycles of negative weight found.
+    """
+
+    def __init__(self,
+                 pools: Iterable,
+                 max_hops: int = 4,
+                 max_relaxations: Optional[int] = None,
+                 tolerance: float = 1e-9):
+
+        self.max_hops = max_hops
+        self.tolerance = tolerance
+
+        self.pools = {}
+        self.nodes: Dict[int, int] = {}  # token id -> node
+        self.tokens: List[int] = []
+        self.src: List[int] = []
+        self.dst: List[int] = []
+        self.edge_pools: List[int] = []
+        self.edge_zero_for_one: List[bool] = []
+        self.pool_edges: Dict[int, int] = {}
+        self.out_edges: List[List[int]] = []
+        self.in_edges: List[List[int]] = []
+
+        # shortest path tree from the virtual source
+        self.dist: List[float] = []
+        self.pred: List[int] = []
+        self.hops: List[int] = []
+
+        for pool in pools:
+            self._insert(pool)
+        self.weights = np.full(len(self.src), np.inf, dtype=np.float64)
+        self._max_relaxations = max_relaxations
+
+        self.cycles: Dict[Tuple[int, ...], Cycle] = {}
+        self.relaxations = 0  # of the last pass
+
+    @property
+    def max_relaxations(self) -> int:
+        return self._max_relaxations or max(1, len(self.src)) * self.max_hops
+
+    def _node(self, token_id: int) -> int:
+        node = self.nodes.get(token_id)
+        if node is None:
+            node = self.nodes[token_id] = len(self.tokens)
+            self.tokens.append(token_id)
+            self.out_edges.append([])
+            self.in_edges.append([])
+            self.dist.append(0.0)
+            self.pred.append(-1)
+            self.hops.append(0)
+        return node
+
+    def _insert(self, pool) -> bool:
+        if pool.id in self.pools:
+            return False
+        self.pools[pool.id] = pool
+        node0, node1 = self._node(pool.token0_id), self._node(pool.token1_id)
+        # edge 2k is token0 -> token1 of the k-th pool, 2k + 1 token1 -> token0
+        e = len(self.src)
+        self.pool_edges[pool.id] = e
+        self.src += [node0, node1]
+        self.dst += [node1, node0]
+        self.edge_pools += [pool.id, pool.id]
+        self.edge_zero_for_one += [True, False]
+        self.out_edges[node0].append(e)
+        self.in_edges[node1].append(e)
+        self.out_edges[node1].append(e + 1)
+        self.in_edges[node0].append(e + 1)
+        return True
+
+    def add_pool(self, pool):
+        """
+        Watches a new pool (ex. created while running), its edges get a weight with its first state
+        """
+        if self._insert(pool):
+            self.weights = np.append(self.weights, [np.inf, np.inf])
+
+    def set_states(self, states: Dict[int, List[int]]) -> List[Cycle]:
+        """
+        Re-weights the pools given (by pool id, others are ignored) and returns every
+        negative cycle known, most profitable first. The first call is a full pass.
+        """
+        full = not np.isfinite(self.weights).any()
+        increased, changed_edges, changed_pools = [], [], set()
+        weights = self.weights
+        for pool_id, state in states.items():
+            e = self.pool_edges.get(pool_id)
+            if e is None:
+                continue
+            for edge, w in zip((e, e + 1), edge_weights(self.pools[pool_id], state)):
+                if w == weights[edge]:
+                    continue
+                if w > weights[edge]:
+                    increased.append(edge)
+                weights[edge] = w
+                changed_edges.append(edge)
+                changed_pools.add(pool_id)
+
+        if full:
+            n = len(self.nodes)
+            self.dist = [0.0] * n
+            self.pred = [-1] * n
+            self.hops = [0] * n
+            self.cycles = {}
+            self._spfa(range(n))
+        elif changed_edges:
+            self._recheck(changed_pools)
+            reset = self._reset_subtrees(increased)
+            seeds = {self.src[e] for e in changed_edges}
+            for node in reset:
+                seeds.add(node)
+                seeds.update(self.src[e] for e in self.in_edges[node])
+            self._spfa(seeds)
+
+        return sorted(self.cycles.values(), key=lambda c: -c.log_profit)
+
+    def _recheck(self, changed_pools: Set[int]):
+        for key, cycle in list(self.cycles.items()):
+            if changed_pools.isdisjoint(cycle.pool_ids):
+                continue
+            weight = float(self.weights[list(cycle.edges)].sum())
+            if weight < -self.tolerance:
+                cycle.log_profit = -weight
+            else:
+                del self.cycles[key]
+
+    def _reset_subtrees(self, increased: List[int]) -> Set[int]:
+        """
+        Nodes whose distance went through an edge that got heavier are reset to the source
+        """
+        pred = self.pred
+        roots = [self.dst[e] for e in increased if pred[self.dst[e]] == e]
+        if not roots:
+            return set()
+        children: Dict[int, List[int]] = {}
+        for node, e in enumerate(pred):
+            if e >= 0:
+                children.setdefault(self.src[e], []).append(node)
+        reset = set()
+        stack = roots
+        while stack:
+            node = stack.pop()
+            if node in reset:
+                continue
+            reset.add(node)
+            self.dist[node] = 0.0
+            pred[node] = -1
+            self.hops[node] = 0
+            stack.extend(children.get(node, ()))
+        return reset
+
+    def _spfa(self, seeds: Iterable[int]):
+        dist, pred, hops = self.dist, self.pred, self.hops
+        src, dst, out_edges = self.src, self.dst, self.out_edges
+        weights = self.weights.tolist()
+        max_hops, tolerance = self.max_hops, self.tolerance
+
+        queue = deque(seeds)
+        queued = [False] * len(dist)
+        for node in queue:
+            queued[node] = True
+
+        relaxations = 0
+        while queue and relaxations < self.max_relaxations:
+            u = queue.popleft()
+            queued[u] = False
+            if hops[u] >= max_hops:
+                continue
+            for e in out_edges[u]:
+                v = dst[e]
+                d = dist[u] + weights[e]
+                if d >= dist[v] - tolerance:
+                    continue
+                # v an ancestor of u: relaxing would close a cycle in the tree
+                ancestor, path = u, [e]
+                for _ in range(max_hops):
+                    back = pred[ancestor]
+                    if ancestor == v or back < 0:
+                        break
+                    path.append(back)
+                    ancestor = src[back]
+                if ancestor == v:
+                    self._record(path[::-1], weights)
+                    continue
+                dist[v] = d
+                pred[v] = e
+                hops[v] = hops[u] + 1
+                relaxations += 1
+                if not queued[v]:
+                    queued[v] = True
+                    queue.append(v)
+        self.relaxations = relaxations
+
+    def _record(self, edges: List[int], weights: List[float]):
+        if len(edges) > self.max_hops:
+            return
+        weight = sum(weights[e] for e in edges)
+        if weight >= -self.tolerance:
+            return
+        # the same cycle can be closed from any of its tokens
+        start = edges.index(min(edges))
+        edges = tuple(edges[start:] + edges[:start])
+        if edges in self.cycles:
+            return
+        self.cycles[edges] = Cycle(edges=edges,
+                                   pool_ids=tuple(self.edge_pools[e] for e in edges),
+                                   zero_for_one=tuple(self.edge_zero_for_one[e] for e in edges),
+                                   tokens=tuple(self.tokens[self.src[e]] for e in edges),
+                                   log_profit=-weight)
+
+    def through(self, token_id: int) -> List[Cycle]:
+        """
+        Known cycles going through a token, ex. the token flashloans are taken in
+        """
+        return [cycle for cycle in self.cycles.values() if token_id in cycle.tokens]
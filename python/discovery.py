@@ -0,0 +1,107 @@
+import asyncio
+import aiohttp
+
+from web3 import Web3
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import pools as pools_v2
+import poolsv3
+from pools import DexVariant, Pool
+from poolsv3 import Poolv3
+from paths import ArbPath, PathGraph
+from utils import fetch_token_decimals, fetch_pool_reserves_since, fetch_pool_states
+from constants import logger
+
+# Pools created while running (streams.stream_new_pools), added without a restart.
+#
+# The block handler only hands new_pool events over (submit). A background task resolves
+# the token decimals (cached, one JSON-RPC batch per pool at most) and the pool state of
+# its creation block, or its current state (getReserves / slot0) when the pool logged none,
+# enumerates the paths through the pool only (PathGraph.add_pool),
+# caches the pool for the next start, and calls on_pool. on_pool appends the paths to the
+# path table and the watched pools; the block handler picks them up between evaluations
+# (parallel.SimulationPool.extend).
+
+
+class NewPoolTracker:
+    """
+    Resolves new_pool events into pools and their new paths, off the block handler.
+    on_pool(pool, paths, state) is called for every pool accepted whose state is known,
+    pools whose state can't be fetched are dropped.
+    """
+
+    def __init__(self,
+                 https_url: str,
+                 graph: PathGraph,
+                 on_pool: Callable[[Union[Pool, Poolv3], List[ArbPath], List[int]], None],
+                 accept: Optional[Callable[[Union[Pool, Poolv3]], bool]] = None,
+                 cache: bool = True):
+
+        self.https_url = https_url
+        self.graph = graph
+        self.on_pool = on_pool
+        self.accept = accept
+        self.cache = cache
+        self.decimals: Dict[str, int] = {}
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def submit(self, event: Dict[str, Any]):
+        self.queue.put_nowait(event)
+
+    async def resolve(self, event: Dict[str, Any], session: aiohttp.ClientSession) -> Optional[Union[Pool, Poolv3]]:
+        # events from the shared memory transport carry lowercase addresses
+        token0 = Web3.to_checksum_address(event['token0'])
+        token1 = Web3.to_checksum_address(event['token1'])
+        missing = [token for token in (token0, token1) if token not in self.decimals]
+        if missing:
+            self.decimals.update(await fetch_token_decimals(self.https_url, missing, session))
+        if token0 not in self.decimals or token1 not in self.decimals:
+            logger.warning(f'New pool {event["pool"]}: no decimals for its tokens, ignored')
+            return None
+
+        version = DexVariant.UniswapV3 if event['version'] == DexVariant.UniswapV3.value else DexVariant.UniswapV2
+        cls = Poolv3 if version == DexVariant.UniswapV3 else Pool
+        return cls(address=Web3.to_checksum_address(event['pool']),
+                   version=version,
+                   token0=token0,
+                   token1=token1,
+                   decimals0=self.decimals[token0],
+                   decimals1=self.decimals[token1],
+                   fee=event['fee'])
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        async with aiohttp.ClientSession() as session:
+            while True:
+                event = await self.queue.get()
+                try:
+                    pool = await self.resolve(event, session)
+                    if pool is None or (self.accept is not None and not self.accept(pool)):
+                        continue
+                    v3 = isinstance(pool, Poolv3)
+                    states = await fetch_pool_reserves_since(self.https_url,
+                                                             event['block_number'],
+                                                             event['block_number'],
+                                                             [pool.id],
+                                                             session,
+                                                             v3=v3)
+                    if pool.id not in states:
+                        # no Sync / Swap yet, the pool state as the startup multicalls read it
+                        states = await fetch_pool_states(self.https_url,
+                                                         [pool.id],
+                                                         session,
+                                                         v3_pool_ids=[pool.id] if v3 else ())
+                except Exception as e:
+                    logger.warning(f'New pool {event["pool"]}: {e}')
+                    continue
+                if pool.id not in states:
+                    logger.warning(f'New pool {pool.address}: no state, ignored')
+                    continue
+
+                new_paths = self.graph.add_pool(pool)
+                self.on_pool(pool, new_paths, states[pool.id])
+                logger.info(f'New pool {pool.address} at block #{event["block_number"]}: {len(new_paths)} paths')
+
+                if self.cache:
+                    cache = poolsv3.cache_synced_pools if isinstance(pool, Poolv3) else pools_v2.cache_synced_pools
+                    loop.run_in_executor(None, cache, pool)
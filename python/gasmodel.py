@@ -0,0 +1,137 @@
+import os
+import json
+import threading
+
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+from pools import DexVariant
+from orders import Flashloan
+
+DEFAULT_EXPECTED_GAS = 550000
+DEFAULT_GAS_LIMIT = 600000
+
+
+def _as_int(value) -> int:
+    # JSON-RPC quantities are hex strings, web3 receipts and simulations carry ints
+    return int(value, base=16) if isinstance(value, str) else int(value)
+
+
+class GasModel:
+    """
+    Gas usage learned from receipts of our own orders and from bundle simulations,
+    keyed by path shape: (hop count, DEX variant, flashloan mode).
+
+    Each observation updates the stored figures of its shape, so expected() and limit()
+    are plain dict lookups that can be used in the profit filter and the tx builder:
+
+    - expected: median gas used, used to price an opportunity
+    - limit: the `quantile` gas used times `margin`, used as the tx gas limit
+
+    Shapes with fewer than `min_samples` observations fall back to the defaults.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 window: int = 256,
+                 quantile: float = 0.99,
+                 margin: float = 1.15,
+                 min_samples: int = 5,
+                 default_expected: int = DEFAULT_EXPECTED_GAS,
+                 default_limit: int = DEFAULT_GAS_LIMIT):
+
+        self.path = path
+        self.window = window
+        self.quantile = quantile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.default_expected = default_expected
+        self.default_limit = default_limit
+
+        self._lock = threading.Lock()
+        self._samples: Dict[Tuple[int, int, int], deque] = {}
+        self._expected: Dict[Tuple[int, int, int], int] = {}
+        self._limit: Dict[Tuple[int, int, int], int] = {}
+
+        if path and os.path.exists(path):
+            self.load(path)
+
+    @staticmethod
+    def key(nhop: int, dex: DexVariant, flashloan: Flashloan) -> Tuple[int, int, int]:
+        return nhop, dex.value, flashloan.value
+
+    def expected(self, key: Tuple[int, int, int]) -> int:
+        return self._expected.get(key, self.default_expected)
+
+    def limit(self, key: Tuple[int, int, int]) -> int:
+        return self._limit.get(key, self.default_limit)
+
+    def observe(self, key: Tuple[int, int, int], gas_used: int):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = deque(maxlen=self.window)
+                self._samples[key] = samples
+            samples.append(int(gas_used))
+            self._update(key)
+
+    def _update(self, key: Tuple[int, int, int]):
+        samples = sorted(self._samples[key])
+        if len(samples) < self.min_samples:
+            return
+        expected = samples[len(samples) // 2]
+        upper = samples[min(len(samples) - 1, int(self.quantile * len(samples)))]
+        self._expected[key] = expected
+        self._limit[key] = int(upper * self.margin)
+
+    def observe_receipt(self, key: Tuple[int, int, int], receipt: Dict[str, Any]):
+        """
+        Records the gas used by one of our mined order txs, reverted txs are skipped:
+        the gas of a revert says nothing about the gas of a swap going through
+        """
+        if _as_int(receipt.get('status', 1)) == 0:
+            return
+        self.observe(key, _as_int(receipt['gasUsed']))
+
+    def observe_simulation(self, key: Tuple[int, int, int], simulation: Dict[str, Any], tx_index: int = 0):
+        """
+        Records the gas used by the order tx in an eth_callBundle / flashbots.simulate result,
+        skipped when the tx reverted in the simulation
+        """
+        result = simulation['results'][tx_index]
+        if 'error' in result or 'revert' in result or 'gasUsed' not in result:
+            return
+        self.observe(key, _as_int(result['gasUsed']))
+
+    def save(self, path: Optional[str] = None):
+        path = path or self.path
+        with self._lock:
+            data = {
+                ','.join(map(str, key)): list(samples)
+                for key, samples in self._samples.items()
+            }
+            # written next to it then moved, so a crash never leaves a truncated file to load
+            tmp = f'{path}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, path)
+
+    def load(self, path: str):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        for key_str, samples in data.items():
+            key = tuple(int(k) for k in key_str.split(','))
+            for gas_used in samples:
+                self.observe(key, gas_used)
+
+
+if __name__ == '__main__':
+    import random
+
+    model = GasModel()
+    key = GasModel.key(3, DexVariant.UniswapV2, Flashloan.Balancer)
+    print(f'Before: expected {model.expected(key)} / limit {model.limit(key)}')
+
+    for _ in range(100):
+        model.observe(key, random.randint(280000, 320000))
+    print(f'After: expected {model.expected(key)} / limit {model.limit(key)}')
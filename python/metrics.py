@@ -0,0 +1,213 @@
+import os
+import time
+import threading
+
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+# aiohttp.web is only needed to serve the metrics
+if TYPE_CHECKING:
+    from aiohttp import web
+
+SUB_BUCKET_BITS = 5  # 32 linear sub-buckets per power of two, ~3% relative error
+MAX_VALUE_BITS = 40  # up to ~12 days in us
+
+# bucket bounds of the exported Prometheus histograms, in seconds
+EXPORT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _bucket_index(value: int) -> int:
+    if value < (1 << SUB_BUCKET_BITS):
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return (shift << SUB_BUCKET_BITS) + (value >> shift)
+
+
+def _bucket_upper(index: int) -> int:
+    shift = index >> SUB_BUCKET_BITS
+    if shift == 0:
+        return index
+    return (((index & ((1 << SUB_BUCKET_BITS) - 1)) + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    HDR style histogram of latencies in us: log-linear buckets with a bounded relative error,
+    so recording is an index computation and a list increment, and memory is fixed.
+    """
+
+    def __init__(self):
+        self.counts = [0] * ((MAX_VALUE_BITS + 1) << SUB_BUCKET_BITS)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value_us: int):
+        value_us = max(0, min(int(value_us), (1 << MAX_VALUE_BITS) - 1))
+        self.counts[_bucket_index(value_us)] += 1
+        self.count += 1
+        self.total += value_us
+        if value_us > self.max:
+            self.max = value_us
+
+    def percentile(self, q: float) -> int:
+        """
+        Upper bound of the bucket holding the q-th percentile (q in 0-100), in us
+        """
+        if self.count == 0:
+            return 0
+        rank = max(1, int(round(q / 100 * self.count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(_bucket_upper(index), self.max)
+        return self.max
+
+    def count_below(self, value_us: int) -> int:
+        """
+        Number of values in the buckets entirely at or below value_us
+        """
+        value_us = min(value_us, (1 << MAX_VALUE_BITS) - 1)
+        last = _bucket_index(value_us)
+        if _bucket_upper(last) > value_us:
+            last -= 1
+        return sum(self.counts[:last + 1])
+
+
+class Trace:
+    """
+    Spans of one opportunity through the pipeline. Every mark() records the time
+    since the previous mark under its stage name, finish() records the total.
+    """
+
+    __slots__ = ('tracker', 'start_ns', 'last_ns')
+
+    def __init__(self, tracker: 'LatencyTracker', start_ns: int):
+        self.tracker = tracker
+        self.start_ns = start_ns
+        self.last_ns = start_ns
+
+    def mark(self, stage: str):
+        now = time.monotonic_ns()
+        self.tracker.record(stage, (now - self.last_ns) // 1000)
+        self.last_ns = now
+
+    def finish(self, stage: str = 'total'):
+        self.tracker.record(stage, (time.monotonic_ns() - self.start_ns) // 1000)
+
+    def fork(self) -> 'Trace':
+        """
+        A copy to follow one of several candidates found on the same block
+        """
+        trace = Trace(self.tracker, self.start_ns)
+        trace.last_ns = self.last_ns
+        return trace
+
+
+class LatencyTracker:
+    """
+    Per stage latency histograms of the opportunity pipeline.
+
+    Traces start at the arrival of a block header (the stream stamps block events with
+    `received_ns`, time.monotonic_ns, the same clock in every process of the host).
+    Recording takes a lock, as txs are signed and sent from threads.
+    """
+
+    def __init__(self, name: str = 'pipeline'):
+        self.name = name
+        self._lock = threading.Lock()
+        self.stages: Dict[str, LatencyHistogram] = {}
+
+    def trace(self, start_ns: Optional[int] = None) -> Trace:
+        return Trace(self, start_ns or time.monotonic_ns())
+
+    def record(self, stage: str, value_us: int):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self.stages[stage] = histogram
+            histogram.record(value_us)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                stage: {
+                    'count': h.count,
+                    'p50_ms': h.percentile(50) / 1000,
+                    'p90_ms': h.percentile(90) / 1000,
+                    'p99_ms': h.percentile(99) / 1000,
+                    'max_ms': h.max / 1000,
+                }
+                for stage, h in self.stages.items()
+            }
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition format: a histogram per stage,
+        plus p50/p90/p99/max from the full resolution histogram as gauges
+        """
+        metric = f'{self.name}_stage_latency_seconds'
+        quantiles = f'{self.name}_stage_latency_quantile_seconds'
+        lines: List[str] = [
+            f'# HELP {metric} Latency of each stage of the opportunity pipeline.',
+            f'# TYPE {metric} histogram',
+        ]
+        with self._lock:
+            stages = sorted(self.stages.items())
+            for stage, h in stages:
+                for bound in EXPORT_BUCKETS:
+                    lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {h.count_below(int(bound * 1000000))}')
+                lines.append(f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {h.total / 1000000}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {h.count}')
+
+            lines.append(f'# HELP {quantiles} Latency percentiles of each stage of the opportunity pipeline.')
+            lines.append(f'# TYPE {quantiles} gauge')
+            for stage, h in stages:
+                for label, q in (('0.5', 50), ('0.9', 90), ('0.99', 99)):
+                    lines.append(f'{quantiles}{{stage="{stage}",quantile="{label}"}} {h.percentile(q) / 1000000}')
+                lines.append(f'{quantiles}{{stage="{stage}",quantile="1"}} {h.max / 1000000}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """
+        Writes the metrics for node_exporter's textfile collector, atomically
+        """
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+async def serve_metrics(tracker: LatencyTracker, host: str = '127.0.0.1', port: int = 9101) -> 'web.AppRunner':
+    """
+    Serves GET /metrics for Prometheus, returns the runner to clean up
+    """
+    from aiohttp import web
+
+    async def handle(_: 'web.Request') -> 'web.Response':
+        return web.Response(text=tracker.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
+
+
+# the opportunity pipeline of this process
+PIPELINE = LatencyTracker('pipeline')
+
+
+if __name__ == '__main__':
+    import random
+
+    tracker = LatencyTracker()
+    for _ in range(10000):
+        tracker.record('touched_pools', random.lognormvariate(8, 0.5))
+        tracker.record('simulated', random.lognormvariate(7, 0.3))
+    print(tracker.summary())
+    print(tracker.render())
@@ -0,0 +1,166 @@
+import asyncio
+
+from web3 import Web3
+from aiohttp import web
+from typing import Any, Dict, List, Optional
+
+
+class MockRelay:
+    """
+    A local stand-in for a Flashbots style relay, used to exercise relay.BundleSubmitter
+    without a node or a real relay.
+
+    It also answers eth_blockNumber and eth_getTransactionReceipt (batched or not),
+    so the same instance can play the node. Bundles are "included" when mine() is
+    called with their target block.
+    """
+
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 include: bool = True,
+                 fail: bool = False,
+                 latency: float = 0.0,
+                 gas_used: int = 21000,
+                 batch_error: bool = False):
+
+        self.host = host
+        self.port = port
+        self.include = include
+        self.fail = fail
+        self.latency = latency
+        self.gas_used = gas_used  # per tx, in eth_callBundle results and receipts
+        self.batch_error = batch_error  # batches answered with a single error object, as some nodes do
+
+        self.block_number = 0
+        self.bundles: List[Dict[str, Any]] = []
+        self.cancelled: List[str] = []
+        self.receipts: Dict[str, Dict[str, Any]] = {}
+        self.calls: List[str] = []
+
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def mine(self, block_number: int):
+        self.block_number = block_number
+        if not self.include:
+            return
+        for bundle in self.bundles:
+            if int(bundle['blockNumber'], base=16) != block_number:
+                continue
+            if bundle.get('replacementUuid') in self.cancelled:
+                continue
+            for idx, tx in enumerate(bundle['txs']):
+                tx_hash = Web3.to_hex(Web3.keccak(hexstr=tx))
+                self.receipts[tx_hash] = {
+                    'transactionHash': tx_hash,
+                    'transactionIndex': hex(idx),
+                    'blockNumber': hex(block_number),
+                    'gasUsed': hex(self.gas_used),
+                    'status': '0x1',
+                }
+
+    def _result(self, method: str, params: list) -> Any:
+        self.calls.append(method)
+        if method == 'eth_sendBundle':
+            self.bundles.append(params[0])
+            return {'bundleHash': Web3.to_hex(Web3.keccak(text=''.join(params[0]['txs'])))}
+        if method == 'eth_callBundle':
+            return {'results': [{'txHash': Web3.to_hex(Web3.keccak(hexstr=tx)), 'gasUsed': self.gas_used}
+                                for tx in params[0]['txs']]}
+        if method == 'eth_cancelBundle':
+            self.cancelled.append(params[0]['replacementUuid'])
+            return None
+        if method == 'eth_blockNumber':
+            return hex(self.block_number)
+        if method == 'eth_getTransactionReceipt':
+            return self.receipts.get(params[0])
+        raise ValueError(f'Unsupported method: {method}')
+
+    def _response(self, req: Dict[str, Any]) -> Dict[str, Any]:
+        res = {'id': req.get('id'), 'jsonrpc': '2.0'}
+        if self.fail:
+            res['error'] = {'code': -32000, 'message': 'mock relay failure'}
+            return res
+        try:
+            res['result'] = self._result(req['method'], req.get('params', []))
+        except Exception as e:
+            res['error'] = {'code': -32601, 'message': str(e)}
+        return res
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        body = await request.json()
+        if isinstance(body, list):
+            if self.batch_error:
+                return web.json_response({'id': None, 'jsonrpc': '2.0',
+                                          'error': {'code': -32600, 'message': 'mock batch failure'}})
+            return web.json_response([self._response(req) for req in body])
+        return web.json_response(self._response(body))
+
+
+if __name__ == '__main__':
+    """
+    Sends a bundle to two mock relays (one of them broken),
+    while a fake block stream pushes new heads to the submitter
+    """
+    from eth_account import Account
+
+    from relay import BundleSubmitter
+
+    async def run():
+        node = MockRelay()
+        broken = MockRelay(fail=True)
+        await node.start()
+        await broken.start()
+
+        sender = Account.create()
+        signed = sender.sign_transaction({
+            'to': sender.address,
+            'value': 0,
+            'gas': 21000,
+            'maxFeePerGas': 10 ** 9,
+            'maxPriorityFeePerGas': 10 ** 9,
+            'nonce': 0,
+            'chainId': 1,
+        })
+        bundle = [{'signed_transaction': signed.rawTransaction}]
+
+        submitter = BundleSubmitter(node.url, [node.url, broken.url], Account.create())
+        await submitter.on_new_head(100)
+
+        async def new_heads():
+            # the first target block misses the bundle, the retry lands
+            node.include = False
+            for block_number in range(101, 104):
+                await asyncio.sleep(0.1)
+                node.mine(block_number)
+                node.include = True
+                await submitter.on_new_head(block_number)
+
+        _, receipts = await asyncio.gather(new_heads(), submitter.submit(bundle, retry=2))
+        print(receipts)
+        print(node.calls)
+
+        await submitter.close()
+        await node.stop()
+        await broken.stop()
+
+    asyncio.run(run())
@@ -24,7 +24,8 @@ def get_uniswap_v3_slot0(HTTPS_URL: str, pools: Dict[str, Poolv3]):
     multicall = Multicall(calls, _w3=w3)
     result = multicall()
 
-    slot0 = {k: v[0] for k, v in result.items()}
+    # keyed by pool id, Poolv3.id is pickled along with the pool so this holds in worker processes too
+    slot0 = {pools[k].id: v[0] for k, v in result.items()}
     return slot0
 
 def batch_get_uniswap_v3_slot0(HTTPS_URL: str, pools: Dict[str, Poolv3]):
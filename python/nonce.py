@@ -0,0 +1,97 @@
+import threading
+
+from web3 import Web3
+from loguru import logger
+from typing import Optional
+
+NONCE_ERRORS = (
+    'nonce too low',
+    'nonce too high',
+    'invalid nonce',
+    'already known',
+    'replacement transaction underpriced',
+)
+
+
+def is_nonce_error(e: Exception) -> bool:
+    message = str(e).lower()
+    return any(err in message for err in NONCE_ERRORS)
+
+
+class NonceManager:
+    """
+    Hands out nonces for a single sender without hitting the node on every transaction.
+
+    The nonce is loaded once (lazily, on first use) and incremented locally for every
+    transaction built. All methods are guarded by a lock, so transactions can be built
+    and sent from separate threads.
+
+    The local value is corrected in two cases:
+
+    1. sync(): on a nonce error, the node's pending count is taken as the truth.
+    2. on_block(): on a confirmed block, external transactions from the same account
+       move the nonce forward, and nonces we handed out but never landed
+       (ex. bundles that were not included) are reclaimed once no tx was built for
+       a full block.
+    """
+
+    def __init__(self, w3: Web3, address: str):
+        self.w3 = w3
+        self.address = address
+
+        self._lock = threading.Lock()
+        self._nonce: Optional[int] = None
+        self._last_issued_block = 0
+        self._block_number = 0
+
+    def _fetch(self, block_identifier: str = 'pending') -> int:
+        return self.w3.eth.get_transaction_count(self.address, block_identifier)
+
+    def next(self) -> int:
+        """
+        Returns the nonce to use for the next transaction and increments it locally
+        """
+        with self._lock:
+            if self._nonce is None:
+                self._nonce = self._fetch()
+            nonce = self._nonce
+            self._nonce += 1
+            self._last_issued_block = self._block_number
+            return nonce
+
+    def peek(self) -> Optional[int]:
+        with self._lock:
+            return self._nonce
+
+    def sync(self) -> int:
+        """
+        Reloads the nonce from the node, used after a nonce error
+        """
+        nonce = self._fetch()
+        with self._lock:
+            logger.info(f'Nonce resynced: {self._nonce} -> {nonce}')
+            self._nonce = nonce
+            return nonce
+
+    def on_block(self, block_number: int) -> int:
+        """
+        Reconciles the local nonce with the node on a new block.
+        This does a blocking RPC call, so call it off the event loop (ex. run_in_executor).
+        Calls can then finish out of order, blocks older than the last one seen are ignored.
+        """
+        nonce = self._fetch()
+        with self._lock:
+            if block_number < self._block_number:
+                return self._nonce
+            if self._block_number == 0:
+                # first block seen, anything issued so far counts as recent
+                self._last_issued_block = block_number
+            self._block_number = block_number
+            if self._nonce is None or nonce > self._nonce:
+                self._nonce = nonce
+            elif nonce < self._nonce and self._last_issued_block < block_number - 1:
+                # nothing was built during the last block, so any nonce above the
+                # node's pending count was never used and can be handed out again
+                logger.info(f'Nonce gap reclaimed at #{block_number}: {self._nonce} -> {nonce}')
+                self._nonce = nonce
+            return self._nonce
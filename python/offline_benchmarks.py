@@ -0,0 +1,626 @@
+import os
+import sys
+import json
+import time
+import gc
+import random
+import hashlib
+import argparse
+import subprocess
+import statistics
+
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+import numpy as np
+
+from pathlib import Path
+from loguru import logger
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from eth_account import Account
+
+from simulator import UniswapV2Simulator
+from pools import DexVariant
+from poolsv3 import Poolv3
+from paths import PathTable, generate_triangular_paths, generate_multi_base_paths
+from parallel import log_rates, simulate_paths, simulate_v2_paths
+from selection import OrderSelector
+from cycles import NegativeCycleDetector
+from orders import Path as SwapPath, Flashloan, OrderTemplate, encode_order_calldata
+from transport import encode_event, decode_event
+from utils import (
+    SYNC_EVENT_SELECTOR,
+    V3_SWAP_EVENT_SELECTOR,
+    decode_touched_pool_logs,
+    calculate_next_block_base_fee,
+)
+
+# Benchmarks of our own compute only: no node, no key, no relay.
+#
+# Every benchmark runs over the checked-in fixture (fixtures/offline.json), so the numbers
+# are comparable between commits and machines. Results are written to benches/offline-results.json
+# and compared against fixtures/offline-baseline.json:
+#
+# - a benchmark slower than the baseline by more than the tolerance is a regression
+# - a benchmark whose output digest changed computes something different than the baseline
+#
+# Usage:
+#
+#     python offline_benchmarks.py                    # run, compare, exit 1 on regressions
+#     python offline_benchmarks.py --save-baseline    # store the results as the new baseline
+#     python offline_benchmarks.py --regenerate       # rebuild the fixture (seeded, deterministic)
+#     python offline_benchmarks.py --imports          # import time of the core modules, by module
+
+_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_FILE = _DIR / 'fixtures' / 'offline.json'
+BASELINE_FILE = _DIR / 'fixtures' / 'offline-baseline.json'
+RESULTS_FILE = _DIR / 'benches' / 'offline-results.json'
+
+UNISWAP_V2_ROUTER = '0xd9e1cE17f2641f24aE83637ab66a2cca9C378B9F'
+BALANCER_VAULT = '0xBA12222222228d8Ba445958a75a0704d566BF2C8'
+Q96 = 2 ** 96
+
+# modules the simulation core, tools and tests import: importing them stays offline and
+# within the budget (a fresh interpreter, interpreter startup included)
+IMPORT_MODULES = ['constants', 'addresses', 'pools', 'poolsv3', 'paths', 'simulator', 'simulatorv3',
+                  'parallel', 'transport', 'metrics']
+IMPORT_BUDGET_MS = 750
+
+
+def generate_fixture(seed: int = 0,
+                     n_tokens: int = 12,
+                     n_pools: int = 120,
+                     n_logs: int = 400,
+                     n_blocks: int = 50) -> Dict[str, Any]:
+    """
+    Builds a synthetic but realistic looking market: pools with reserves and slot0 states,
+    a block worth of Sync / Swap logs and newHeads messages
+    """
+    rng = random.Random(seed)
+
+    def address() -> str:
+        return '0x' + rng.getrandbits(160).to_bytes(20, 'big').hex()
+
+    tokens = [{'address': address(), 'decimals': rng.choice([6, 8, 18, 18, 18])} for _ in range(n_tokens)]
+
+    pools = []
+    for i in range(n_pools):
+        # a third of the pools trade the base token (tokens[0]) so paths exist
+        token0, token1 = rng.sample(tokens[1:], 2) if i % 3 else (tokens[0], rng.choice(tokens[1:]))
+        if rng.random() < 0.5:
+            token0, token1 = token1, token0
+        ratio = rng.uniform(0.3, 1.0)
+        pools.append({
+            'address': address(),
+            'token0': token0['address'],
+            'token1': token1['address'],
+            'decimals0': token0['decimals'],
+            'decimals1': token1['decimals'],
+            'fee': 3000,
+            'reserves': [rng.randint(10 ** 3, 10 ** 7) * 10 ** token0['decimals'],
+                         rng.randint(10 ** 3, 10 ** 7) * 10 ** token1['decimals']],
+            'sqrtPriceX96': int(Q96 * (ratio * 10 ** (token1['decimals'] - token0['decimals'])) ** 0.5),
+            'liquidity': rng.randint(10 ** 15, 10 ** 22),
+        })
+
+    logs = []
+    for i in range(n_logs):
+        pool = rng.choice(pools)
+        if rng.random() < 0.5:
+            topic = SYNC_EVENT_SELECTOR
+            data = b''.join(rng.getrandbits(112).to_bytes(32, 'big') for _ in range(2))
+        else:
+            topic = V3_SWAP_EVENT_SELECTOR
+            data = b''.join(rng.getrandbits(128).to_bytes(32, 'big') for _ in range(4)) + \
+                   rng.randint(-887272, 887272).to_bytes(32, 'big', signed=True)
+        logs.append({
+            'address': pool['address'],
+            'topics': [topic],
+            'data': '0x' + data.hex(),
+            'transactionIndex': hex(i // 4),
+            'logIndex': hex(i),
+            'removed': False,
+        })
+
+    blocks = []
+    for i in range(n_blocks):
+        blocks.append(json.dumps({
+            'jsonrpc': '2.0',
+            'method': 'eth_subscription',
+            'params': {'result': {
+                'number': hex(18000000 + i),
+                'hash': '0x' + rng.getrandbits(256).to_bytes(32, 'big').hex(),
+                'baseFeePerGas': hex(rng.randint(10, 100) * 10 ** 9),
+                'gasUsed': hex(rng.randint(0, 30000000)),
+                'gasLimit': hex(30000000),
+            }},
+        }))
+
+    return {
+        'seed': seed,
+        'base_token': tokens[0]['address'],
+        'tokens': tokens,
+        'pools': pools,
+        'logs': logs,
+        'blocks': blocks,
+        'signing_key': '0x' + hashlib.sha256(f'offline-benchmarks-{seed}'.encode()).hexdigest(),
+    }
+
+
+class Context:
+    """
+    Objects built once from the fixture and shared by the benchmarks
+    """
+
+    def __init__(self, fixture: Dict[str, Any]):
+        self.fixture = fixture
+        self.base_token = fixture['base_token']
+
+        self.pools: Dict[str, Poolv3] = {}
+        for row in fixture['pools']:
+            pool = Poolv3(row['address'],
+                          DexVariant.UniswapV3,
+                          row['token0'],
+                          row['token1'],
+                          row['decimals0'],
+                          row['decimals1'],
+                          row['fee'])
+            pool.liquidity = row['liquidity']
+            self.pools[pool.address] = pool
+
+        self.reserves = {self.pools[row['address']].id: row['reserves'] for row in fixture['pools']}
+        self.sqrt_prices = {self.pools[row['address']].id: row['sqrtPriceX96'] for row in fixture['pools']}
+        self.pools_by_id = {pool.id: pool for pool in self.pools.values()}
+
+        self.paths = generate_triangular_paths(self.pools_by_id, self.base_token)
+        self.table = PathTable(self.paths)
+        self.swap_paths = [
+            [SwapPath(UNISWAP_V2_ROUTER, token_in, token_out)
+             for token_in, token_out in zip(path.tokens_in, path.tokens_out)]
+            for path in self.paths
+        ]
+        self.account = Account.from_key(fixture['signing_key'])
+
+
+# name -> setup(ctx), the setup returns (run, number of operations per run)
+BENCHMARKS: Dict[str, Callable[[Context], Tuple[Callable[[], Any], int]]] = {}
+
+
+def benchmark(name: str):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+@benchmark('path_generation')
+def bench_path_generation(ctx: Context):
+    def run():
+        return len(generate_triangular_paths(ctx.pools_by_id, ctx.base_token))
+    return run, 1
+
+
+@benchmark('multi_base_path_generation')
+def bench_multi_base_path_generation(ctx: Context):
+    # the base token and the two tokens with the most pools, as one would add WETH / WMATIC
+    degree: Dict[str, int] = {}
+    for pool in ctx.pools.values():
+        for token in (pool.token0, pool.token1):
+            degree[token] = degree.get(token, 0) + 1
+    bases = [ctx.base_token] + sorted((t for t in degree if t != ctx.base_token), key=lambda t: (-degree[t], t))[:2]
+
+    def run():
+        return len(generate_multi_base_paths(ctx.pools_by_id, bases))
+    return run, 1
+
+
+@benchmark('path_table_build')
+def bench_path_table_build(ctx: Context):
+    def run():
+        return len(PathTable(ctx.paths))
+    return run, len(ctx.paths)
+
+
+@benchmark('v2_simulation')
+def bench_v2_simulation(ctx: Context):
+    sim = UniswapV2Simulator()
+    hops = [
+        [(ctx.reserves[pool.id], token_in == pool.token0) for pool, token_in in zip(path.pools, path.tokens_in)]
+        for path in ctx.paths
+    ]
+
+    def run():
+        amount_outs = []
+        for path_hops in hops:
+            amount = 10 ** 18
+            for reserve, zero_for_one in path_hops:
+                reserve_in, reserve_out = (reserve[0], reserve[1]) if zero_for_one else (reserve[1], reserve[0])
+                amount = sim.get_amount_out(amount, reserve_in, reserve_out)
+            amount_outs.append(amount)
+        return amount_outs
+    return run, len(hops)
+
+
+@benchmark('v2_simulation_vectorized')
+def bench_v2_simulation_vectorized(ctx: Context):
+    table = ctx.table
+    pool_ids = table.pool_ids()
+    reserves = np.zeros((int(pool_ids[-1]) + 1, 2), dtype=np.float64)
+    for pool_id, reserve in ctx.reserves.items():
+        if pool_id < len(reserves):
+            reserves[pool_id] = reserve
+    unit = (10.0 ** table.decimals_in)[:, None]
+
+    def run():
+        return simulate_v2_paths(unit, reserves, table.pools, table.zero_for_one, table.fees)[:, 0].tolist()
+    return run, len(table)
+
+
+@benchmark('v3_simulation')
+def bench_v3_simulation(ctx: Context):
+    def run():
+        return [path.simulate_v3_path(1, ctx.sqrt_prices) for path in ctx.paths]
+    return run, len(ctx.paths)
+
+
+@benchmark('v3_optimization')
+def bench_v3_optimization(ctx: Context):
+    paths = ctx.paths[:50]
+
+    def run():
+        return [path.optimize_amount_in(1000, 10, ctx.sqrt_prices) for path in paths]
+    return run, len(paths)
+
+
+@benchmark('v2_optimization_vectorized')
+def bench_v2_optimization_vectorized(ctx: Context):
+    table = ctx.table
+    pool_ids = table.pool_ids()
+    reserves = np.zeros((int(pool_ids[-1]) + 1, 2), dtype=np.float64)
+    for pool_id, reserve in ctx.reserves.items():
+        if pool_id < len(reserves):
+            reserves[pool_id] = reserve
+    unit = (10.0 ** table.decimals_in)[:, None]
+    grid = np.arange(0, 1000, 10, dtype=np.float64)[None, :]
+
+    def run():
+        amount_out = simulate_v2_paths(grid * unit, reserves, table.pools, table.zero_for_one, table.fees)
+        profits = (amount_out - grid * unit) / unit
+        return profits.argmax(axis=1).tolist()
+    return run, len(table)
+
+
+@benchmark('mixed_optimization_vectorized')
+def bench_mixed_optimization_vectorized(ctx: Context):
+    # the fixture pools priced as V2 pools (even ids) and V3 pools (odd ids), so most paths mix both
+    table = ctx.table
+    pool_ids = table.pool_ids()
+    states = np.zeros((int(pool_ids[-1]) + 1, 2), dtype=np.float64)
+    for pool_id in pool_ids.tolist():
+        if pool_id % 2 == 0:
+            states[pool_id] = ctx.reserves[pool_id]
+        else:
+            states[pool_id] = (ctx.sqrt_prices[pool_id], ctx.pools_by_id[pool_id].liquidity)
+    is_v2 = (table.pools >= 0) & (table.pools % 2 == 0)
+    kinds = np.where(table.pools < 0, 0, np.where(is_v2, DexVariant.UniswapV2.value, DexVariant.UniswapV3.value)).astype(np.int8)
+    fees = np.where(is_v2, 300, table.fees).astype(np.int32)
+    unit = (10.0 ** table.decimals_in)[:, None]
+    grid = np.arange(0, 1000, 10, dtype=np.float64)[None, :]
+
+    def run():
+        amount_out = simulate_paths(grid * unit, states, table.pools, table.zero_for_one, fees, kinds)
+        profits = (amount_out - grid * unit) / unit
+        return profits.argmax(axis=1).tolist()
+    return run, len(table)
+
+
+@benchmark('spread_prefilter')
+def bench_spread_prefilter(ctx: Context):
+    # marginal spread after fee of every path, gathered from the per-pool log rates (parallel.SimulationPool)
+    table = ctx.table
+    pool_ids = table.pool_ids()
+    reserves = np.zeros((int(pool_ids[-1]) + 1, 2), dtype=np.float64)
+    for pool_id, reserve in ctx.reserves.items():
+        if pool_id < len(reserves):
+            reserves[pool_id] = reserve
+    kinds = np.zeros(len(reserves), dtype=np.int8)
+    fees = np.zeros(len(reserves), dtype=np.int32)
+    kinds[pool_ids] = DexVariant.UniswapV2.value
+    fees[pool_ids] = 300
+    rates = log_rates(reserves, kinds, fees)
+    has_hop = table.pools >= 0
+    direction = (~table.zero_for_one).astype(np.intp)
+
+    def run():
+        log_spreads = np.where(has_hop, rates[table.pools, direction], 0.0).sum(axis=1)
+        return np.nonzero(log_spreads > 0)[0].tolist()
+    return run, len(table)
+
+
+@benchmark('order_selection')
+def bench_order_selection(ctx: Context):
+    # the 10 best candidates of the fixture re-simulated in sequence, up to 4 orders kept
+    table = ctx.table
+    pool_ids = table.pool_ids()
+    states = np.zeros((int(pool_ids[-1]) + 1, 2), dtype=np.float64)
+    for pool_id in pool_ids.tolist():
+        states[pool_id] = (ctx.sqrt_prices[pool_id], ctx.pools_by_id[pool_id].liquidity)
+    unit = (10.0 ** table.decimals_in)[:, None]
+    grid = np.arange(0, 1000, 10, dtype=np.float64)[None, :]
+    amount_out = simulate_paths(grid * unit, states, table.pools, table.zero_for_one, table.fees, table.kinds)
+    profits = (amount_out - grid * unit) / unit
+    best = profits.argmax(axis=1)
+    candidates = [(i, 0.0, float(grid[0, best[i]]), float(profits[i, best[i]])) for i in range(len(table))]
+    base_prices = np.ones(len(table), dtype=np.float64)
+    selector = OrderSelector(table, top_k=10, max_orders=4)
+
+    def run():
+        return selector.select(candidates, states, base_prices)
+    return run, 10
+
+
+@benchmark('negative_cycles_full')
+def bench_negative_cycles_full(ctx: Context):
+    states = {pool_id: (ctx.sqrt_prices[pool_id], pool.liquidity) for pool_id, pool in ctx.pools_by_id.items()}
+
+    def run():
+        detector = NegativeCycleDetector(ctx.pools.values(), max_hops=4)
+        return [cycle.edges for cycle in detector.set_states(states)]
+    return run, len(states)
+
+
+@benchmark('negative_cycles_update')
+def bench_negative_cycles_update(ctx: Context):
+    # a block moving the price of 5 pools, then moving them back
+    states = {pool_id: (ctx.sqrt_prices[pool_id], pool.liquidity) for pool_id, pool in ctx.pools_by_id.items()}
+    detector = NegativeCycleDetector(ctx.pools.values(), max_hops=4)
+    detector.set_states(states)
+    moved = sorted(states)[::len(states) // 5][:5]
+    block = {pool_id: (states[pool_id][0] * 102 // 100, states[pool_id][1]) for pool_id in moved}
+    back = {pool_id: states[pool_id] for pool_id in moved}
+
+    def run():
+        after = detector.set_states(block)
+        return [cycle.edges for cycle in after], [cycle.edges for cycle in detector.set_states(back)]
+    return run, 2
+
+
+@benchmark('calldata_eth_abi')
+def bench_calldata_eth_abi(ctx: Context):
+    def run():
+        return [encode_order_calldata(swap_paths, 10 ** 18, Flashloan.Balancer, BALANCER_VAULT)
+                for swap_paths in ctx.swap_paths]
+    return run, len(ctx.swap_paths)
+
+
+@benchmark('calldata_template')
+def bench_calldata_template(ctx: Context):
+    templates = [OrderTemplate(swap_paths) for swap_paths in ctx.swap_paths]
+
+    def run():
+        return [template.encode(10 ** 18, Flashloan.Balancer, BALANCER_VAULT) for template in templates]
+    return run, len(templates)
+
+
+@benchmark('tx_signing')
+def bench_tx_signing(ctx: Context):
+    txs = []
+    for nonce, swap_paths in enumerate(ctx.swap_paths[:50]):
+        txs.append({
+            'to': BALANCER_VAULT,
+            'data': '0x' + encode_order_calldata(swap_paths, 10 ** 18).hex(),
+            'value': 0,
+            'gas': 600000,
+            'maxFeePerGas': 100 * 10 ** 9,
+            'maxPriorityFeePerGas': 2 * 10 ** 9,
+            'nonce': nonce,
+            'chainId': 1,
+            'type': 2,
+        })
+
+    def run():
+        return [bytes(ctx.account.sign_transaction(tx).rawTransaction).hex() for tx in txs]
+    return run, len(txs)
+
+
+@benchmark('log_decoding')
+def bench_log_decoding(ctx: Context):
+    logs = ctx.fixture['logs']
+    pool_ids = set(ctx.reserves.keys())
+
+    def run():
+        return sorted(decode_touched_pool_logs(logs, pool_ids).items())
+    return run, len(logs)
+
+
+@benchmark('block_decoding')
+def bench_block_decoding(ctx: Context):
+    messages = ctx.fixture['blocks']
+
+    def run():
+        random.seed(0)  # calculate_next_block_base_fee adds a random tip
+        events = []
+        for msg in messages:
+            block = json.loads(msg)['params']['result']
+            events.append({
+                'type': 'block',
+                'block_number': int(block['number'], base=16),
+                'block_hash': block['hash'],
+                'base_fee': int(block['baseFeePerGas'], base=16),
+                'next_base_fee': calculate_next_block_base_fee(block),
+            })
+        return events
+    return run, len(messages)
+
+
+@benchmark('event_transport_codec')
+def bench_event_transport_codec(ctx: Context):
+    events = [
+        {
+            'type': 'pool_update',
+            'block_number': 18000000,
+            'pool': row['address'],
+            'reserves': row['reserves'],
+        }
+        for row in ctx.fixture['pools']
+    ]
+
+    def run():
+        return [decode_event(memoryview(encode_event(event)))['reserves'] for event in events]
+    return run, len(events)
+
+
+def _import_modules(modules: List[str], importtime: bool = False) -> str:
+    flags = ['-X', 'importtime'] if importtime else []
+    process = subprocess.run([sys.executable, *flags, '-c', f'import {", ".join(modules)}'],
+                             cwd=_DIR, capture_output=True, text=True, check=True)
+    return process.stderr
+
+
+def import_times(modules: List[str]) -> Dict[str, int]:
+    """
+    Cumulative import time of every package imported directly by `modules`
+    in a fresh interpreter, in us, slowest first (from python -X importtime)
+    """
+    times = {}
+    for line in _import_modules(modules, importtime=True).splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # nesting is shown by indentation, two spaces per level
+        if len(name) - len(name.lstrip()) <= 3:
+            times[name.strip()] = int(cumulative)
+    return dict(sorted(times.items(), key=lambda item: -item[1]))
+
+
+@benchmark('module_import')
+def bench_module_import(ctx: Context):
+    def run():
+        _import_modules(IMPORT_MODULES)
+        return IMPORT_MODULES
+    return run, 1
+
+
+def calibrate(repeat: int = 7) -> float:
+    """
+    Time of a fixed pure Python workload, in us. Timings are compared relative to it,
+    so a baseline stored on one machine is usable on another (and on a throttled one).
+    """
+    timings = []
+    for _ in range(repeat):
+        s = time.perf_counter()
+        acc = 0
+        for i in range(200000):
+            acc = (acc * 31 + i) & 0xFFFFFFFF
+        timings.append(time.perf_counter() - s)
+    return min(timings) * 1000000
+
+
+def _digest(result: Any) -> str:
+    return hashlib.sha256(repr(result).encode()).hexdigest()[:16]
+
+
+def run_benchmarks(ctx: Context,
+                   names: Optional[List[str]] = None,
+                   repeat: int = 7) -> Dict[str, Dict[str, Any]]:
+    results = {'_calibration_us': calibrate(repeat)}
+    for name, setup in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        run, ops = setup(ctx)
+        result = run()  # warm up
+        timings = []
+        gc.collect()
+        gc.disable()  # same as timeit, keeps collections of earlier garbage out of the timings
+        try:
+            for _ in range(repeat):
+                s = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - s)
+        finally:
+            gc.enable()
+        results[name] = {
+            'ops': ops,
+            'best_us': min(timings) / ops * 1000000,
+            'median_us': statistics.median(timings) / ops * 1000000,
+            'digest': _digest(result),
+        }
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]],
+            baseline: Dict[str, Dict[str, Any]],
+            tolerance: float = 0.3) -> List[str]:
+    """
+    Returns the regressions of results against baseline, compared on the best timing
+    (the least noisy one), scaled by the calibration ratio, with a relative tolerance
+    """
+    scale = results['_calibration_us'] / baseline.get('_calibration_us', results['_calibration_us'])
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if name.startswith('_') or base is None:
+            continue
+        if result['digest'] != base['digest']:
+            regressions.append(f'{name}: output changed ({base["digest"]} -> {result["digest"]})')
+        if result['best_us'] > base['best_us'] * scale * (1 + tolerance):
+            change = result['best_us'] / (base['best_us'] * scale) - 1
+            regressions.append(f'{name}: {base["best_us"]:.3f} -> {result["best_us"]:.3f} us/op (+{change:.0%})')
+    return regressions
+
+
+def _write_json(path: Path, data: Any, indent: Optional[int] = 2):
+    os.makedirs(path.parent, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=indent, sort_keys=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks over recorded fixtures')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--tolerance', type=float, default=0.3)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--regenerate', action='store_true')
+    parser.add_argument('--imports', action='store_true', help='print the import time of the core modules and exit')
+    args = parser.parse_args()
+
+    if args.imports:
+        for name, us in import_times(IMPORT_MODULES).items():
+            print(f'{name:<40} {us / 1000:>10.1f} ms')
+        sys.exit(0)
+
+    logger.disable('paths')  # generate_triangular_paths logs on every run
+
+    if args.regenerate or not FIXTURE_FILE.exists():
+        _write_json(FIXTURE_FILE, generate_fixture(), indent=None)
+        print(f'Fixture written: {FIXTURE_FILE}')
+
+    with open(FIXTURE_FILE, 'r') as f:
+        ctx = Context(json.load(f))
+
+    results = run_benchmarks(ctx, args.names, args.repeat)
+    print(f'calibration: {results["_calibration_us"]:.0f} us')
+    for name, result in results.items():
+        if name.startswith('_'):
+            continue
+        print(f'{name:<28} {result["best_us"]:>12.3f} us/op (median {result["median_us"]:.3f}, {result["ops"]} ops)')
+
+    _write_json(RESULTS_FILE, results)
+
+    if args.save_baseline:
+        _write_json(BASELINE_FILE, results)
+        print(f'Baseline saved: {BASELINE_FILE}')
+        sys.exit(0)
+
+    if not BASELINE_FILE.exists():
+        print('No baseline to compare with, run with --save-baseline')
+        sys.exit(0)
+
+    with open(BASELINE_FILE, 'r') as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if 'module_import' in results and results['module_import']['best_us'] > IMPORT_BUDGET_MS * 1000:
+        regressions.append(f'module_import: {results["module_import"]["best_us"] / 1000:.0f} ms '
+                           f'over the budget of {IMPORT_BUDGET_MS} ms')
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,88 @@
+import eth_abi
+
+from enum import Enum
+from typing import List
+
+# Order calldata of the bot contract: swap paths and their encoding, without web3 or a relay,
+# so pure code (gasmodel, paths, the offline benchmarks) can import it.
+
+ZERO_ADDRESS = '0x0000000000000000000000000000000000000000'
+
+
+class Path:
+
+    __slots__ = ('router', 'token_in', 'token_out', 'fee')
+    
+    def __init__(self,
+                 router: str,
+                 token_in: str,
+                 token_out: str):
+        self.router = router
+        self.token_in = token_in
+        self.token_out = token_out
+        self.fee = None
+        
+    def to_list(self):
+        return [self.router, self.token_in, self.token_out]
+    
+    
+class Flashloan(Enum):
+    NotUsed = 0
+    Balancer = 1
+    UniswapV2 = 2
+
+
+def path_key(paths: List[Path]) -> tuple:
+    return tuple(tuple(path.to_list()) for path in paths)
+
+
+def encode_order_calldata(paths: List[Path],
+                          amount_in: int,
+                          flashloan: Flashloan = Flashloan.NotUsed,
+                          loan_from: str = ZERO_ADDRESS) -> bytes:
+    nhop = len(paths)
+
+    calldata_types = ['uint', 'uint', 'address']
+    path_types = ['address', 'address', 'address'] * nhop
+    calldata_types = calldata_types + path_types
+
+    calldata_raw = [amount_in, flashloan.value, loan_from]
+
+    for path in paths:
+        calldata_raw.extend(path.to_list())
+
+    return eth_abi.encode(calldata_types, calldata_raw)
+
+
+class OrderTemplate:
+    """
+    Pre-encoded order calldata for a single swap path.
+
+    Every argument of the order calldata is a static 32 byte word:
+
+    [amount_in, flashloan, loan_from, router_1, token_in_1, token_out_1, ...]
+
+    so the router/token words are encoded once, and only the first three words
+    are patched into a preallocated buffer per order.
+    The buffer is reused, so a template should not be shared across threads.
+    """
+
+    def __init__(self, paths: List[Path]):
+        self.key = path_key(paths)
+        self.nhop = len(paths)
+        self._buffer = bytearray(encode_order_calldata(paths, 0))
+        self._loan_from = ZERO_ADDRESS
+        self._loan_from_word = bytes(32)
+
+    def encode(self,
+               amount_in: int,
+               flashloan: Flashloan = Flashloan.NotUsed,
+               loan_from: str = ZERO_ADDRESS) -> bytes:
+        buffer = self._buffer
+        buffer[0:32] = amount_in.to_bytes(32, 'big')
+        buffer[32:64] = flashloan.value.to_bytes(32, 'big')
+        if loan_from != self._loan_from:
+            self._loan_from = loan_from
+            self._loan_from_word = bytes(12) + bytes.fromhex(loan_from[2:])
+        buffer[64:96] = self._loan_from_word
+        return bytes(buffer)
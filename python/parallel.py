@@ -0,0 +1,511 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import numpy as np
+
+from typing import Dict, List, Optional, Tuple, Union
+from collections import Counter
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+from paths import PathTable
+from pools import DexVariant
+from profiler import SamplingProfiler
+from constants import logger
+
+# (path index, spread at 1 unit in %, optimized amount_in, expected profit)
+Candidate = Tuple[int, float, float, float]
+
+Q96 = 2 ** 96
+
+# shared arrays attached in every worker process
+_shared: Dict[str, np.ndarray] = {}
+_handles: List[shared_memory.SharedMemory] = []
+# sampler of the worker process, running while the pool profiles (SimulationPool.start_profiling)
+_profiler: Optional[SamplingProfiler] = None
+
+
+def _create_shared(array: np.ndarray) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[:] = array
+    return shm, shared
+
+
+def _attach_shared(layout: Dict[str, Tuple[str, tuple, str]]):
+    """
+    Worker initializer: maps the shared arrays created by the main process
+    """
+    for key, (name, shape, dtype) in layout.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _handles.append(shm)
+        _shared[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def simulate_v2_paths(amount_in: np.ndarray,
+                      reserves: np.ndarray,
+                      pool_ids: np.ndarray,
+                      zero_for_one: np.ndarray,
+                      fees: np.ndarray) -> np.ndarray:
+    """
+    Vectorized UniswapV2Simulator.get_amount_out over every hop of many paths.
+    amount_in has shape (n, m): m amounts for each of the n paths.
+    Hops with a pool id of -1 (2-hop paths) are skipped.
+    """
+    amount = amount_in
+    for i in range(pool_ids.shape[1]):
+        has_hop = (pool_ids[:, i] >= 0)[:, None]
+        pool_reserves = reserves[np.maximum(pool_ids[:, i], 0)]
+        reserve_in = np.where(zero_for_one[:, i], pool_reserves[:, 0], pool_reserves[:, 1])[:, None]
+        reserve_out = np.where(zero_for_one[:, i], pool_reserves[:, 1], pool_reserves[:, 0])[:, None]
+        fee = (fees[:, i] // 100)[:, None]
+        amount_in_with_fee = amount * (1000 - fee)
+        denominator = reserve_in * 1000 + amount_in_with_fee
+        amount_out = np.where(denominator > 0,
+                              amount_in_with_fee * reserve_out / np.where(denominator > 0, denominator, 1),
+                              0)
+        amount = np.where(has_hop, amount_out, amount)
+    return amount
+
+
+def _v2_amount_out(amount: np.ndarray, state: np.ndarray, zero_for_one: np.ndarray, fee: np.ndarray) -> np.ndarray:
+    """
+    UniswapV2Simulator.get_amount_out, state rows are (reserve0, reserve1), fees as in pools.Pool (300 is 0.3%)
+    """
+    reserve_in = np.where(zero_for_one, state[:, 0], state[:, 1])[:, None]
+    reserve_out = np.where(zero_for_one, state[:, 1], state[:, 0])[:, None]
+    amount_in_with_fee = amount * (1000 - (fee // 100))[:, None]
+    denominator = reserve_in * 1000 + amount_in_with_fee
+    return np.where(denominator > 0, amount_in_with_fee * reserve_out / np.where(denominator > 0, denominator, 1), 0)
+
+
+def _v3_amount_out(amount: np.ndarray, state: np.ndarray, zero_for_one: np.ndarray, fee: np.ndarray) -> np.ndarray:
+    """
+    UniswapV3Simulator.get_amount_out_in_range, state rows are (sqrtPriceX96, liquidity).
+    Within the current tick range, a V3 pool is a constant product over its
+    virtual reserves: L / sqrtP of token0 and L * sqrtP of token1.
+    """
+    sqrt_price = state[:, 0] / Q96
+    liquidity = state[:, 1]
+    reserve0 = np.divide(liquidity, sqrt_price, out=np.zeros_like(liquidity), where=sqrt_price > 0)
+    reserve1 = liquidity * sqrt_price
+    reserve_in = np.where(zero_for_one, reserve0, reserve1)[:, None]
+    reserve_out = np.where(zero_for_one, reserve1, reserve0)[:, None]
+    amount_in_less_fee = amount * (1 - fee / 1000000)[:, None]
+    denominator = reserve_in + amount_in_less_fee
+    return np.where(denominator > 0, amount_in_less_fee * reserve_out / np.where(denominator > 0, denominator, 1), 0)
+
+
+# pricing kernel of each pool kind (DexVariant values, as stored in PathTable.kinds)
+KERNELS = {
+    DexVariant.UniswapV2.value: _v2_amount_out,
+    DexVariant.UniswapV3.value: _v3_amount_out,
+}
+
+
+def simulate_paths(amount_in: np.ndarray,
+                   states: np.ndarray,
+                   pool_ids: np.ndarray,
+                   zero_for_one: np.ndarray,
+                   fees: np.ndarray,
+                   kinds: np.ndarray) -> np.ndarray:
+    """
+    simulate_v2_paths over paths mixing pool kinds: every hop is priced by the
+    kernel of its pool kind, batched over all the paths having that kind at that hop.
+    Hops with a kind of 0 (2-hop paths) are skipped.
+    """
+    if (kinds[kinds > 0] == DexVariant.UniswapV2.value).all():
+        return simulate_v2_paths(amount_in, states, pool_ids, zero_for_one, fees)
+
+    amount = np.array(amount_in, dtype=np.float64)
+    for i in range(pool_ids.shape[1]):
+        for kind, kernel in KERNELS.items():
+            rows = np.nonzero(kinds[:, i] == kind)[0]
+            if len(rows):
+                amount[rows] = kernel(amount[rows], states[pool_ids[rows, i]], zero_for_one[rows, i], fees[rows, i])
+    return amount
+
+
+def log_rates(states: np.ndarray, kinds: np.ndarray, fees: np.ndarray) -> np.ndarray:
+    """
+    log of the marginal rates after fee of pools, columns (token0 -> token1, token1 -> token0),
+    from rows of states with the kind and fee of each row (as in PathTable), the same rates as
+    cycles.edge_weights (negated). Empty pools and unused rows (kind 0) get -inf.
+    """
+    rates = np.full((len(states), 2), -np.inf, dtype=np.float64)
+    live = (kinds > 0) & (states[:, 0] > 0) & (states[:, 1] > 0)
+    v3 = live & (kinds == DexVariant.UniswapV3.value)
+    v2 = live & ~v3
+    log_price = np.zeros(len(states), dtype=np.float64)
+    log_fee = np.zeros(len(states), dtype=np.float64)
+    # V2: reserve1 / reserve0, V3: sqrtP ** 2
+    log_price[v2] = np.log(states[v2, 1]) - np.log(states[v2, 0])
+    log_price[v3] = 2 * (np.log(states[v3, 0]) - 96 * math.log(2))
+    log_fee[v2] = np.log((1000 - fees[v2] // 100) / 1000)
+    log_fee[v3] = np.log1p(-fees[v3] / 1000000)
+    rates[live, 0] = log_price[live] + log_fee[live]
+    rates[live, 1] = log_fee[live] - log_price[live]
+    return rates
+
+
+def _write_reserves(table: np.ndarray, reserves: Dict[int, List[int]]) -> List[int]:
+    updated = []
+    for pool_id, reserve in reserves.items():
+        if pool_id < len(table):
+            table[pool_id, 0] = reserve[0]
+            table[pool_id, 1] = reserve[1]
+            updated.append(pool_id)
+    return updated
+
+
+def _evaluate_range(start: int,
+                    end: int,
+                    touched: np.ndarray,
+                    max_amount_in: int,
+                    step_size: int,
+                    top_k: int,
+                    min_log_spread: Optional[float]) -> Tuple[List[Candidate], Dict[str, int], Tuple[int, int]]:
+    """
+    Runs in a worker: simulates the touched paths in [start, end) and
+    returns the top_k of them by expected profit, the time spent prefiltering,
+    simulating and optimizing in ns, and the number of paths touched and simulated
+    """
+    s = time.monotonic_ns()
+    timings = {'prefilter': 0, 'simulate': 0, 'optimize': 0}
+    pool_ids = _shared['pools'][start:end]
+    mask = np.isin(pool_ids, touched).any(axis=1) & _shared['active'][start:end]
+    ids = np.nonzero(mask)[0]
+    touched_paths = len(ids)
+
+    pool_ids = pool_ids[ids]
+    zero_for_one = _shared['zero_for_one'][start:end][ids]
+    if min_log_spread is not None and len(ids):
+        # log of the product of the marginal rates after fee around each path, gathered from the
+        # per-pool rates. The output of a path is concave in amount_in, so a path whose product
+        # is not above 1 is not profitable at any amount, and is not simulated.
+        hop_rates = _shared['log_rates'][pool_ids, (~zero_for_one).astype(np.intp)]
+        keep = np.where(pool_ids >= 0, hop_rates, 0.0).sum(axis=1) > min_log_spread
+        ids, pool_ids, zero_for_one = ids[keep], pool_ids[keep], zero_for_one[keep]
+    prefiltered = time.monotonic_ns()
+    timings['prefilter'] = prefiltered - s
+    if not len(ids):
+        return [], timings, (touched_paths, 0)
+
+    fees = _shared['fees'][start:end][ids]
+    kinds = _shared['kinds'][start:end][ids]
+    # raw amount of the base token of each path worth 1 unit of the numeraire
+    unit = (10.0 ** _shared['decimals_in'][start:end][ids] / _shared['base_prices'][start:end][ids])[:, None]
+    reserves = _shared['reserves']
+
+    # spread with 1 unit of the numeraire (of the starting token with a single base),
+    # same as paths.simulate_path(path, 1, reserves)
+    quote = simulate_paths(unit, reserves, pool_ids, zero_for_one, fees, kinds)
+    spreads = (quote[:, 0] / unit[:, 0] - 1) * 100
+    simulated = time.monotonic_ns()
+    timings['simulate'] = simulated - prefiltered
+
+    # brute force optimization over the same grid as path.optimize_amount_in
+    grid = np.arange(0, max_amount_in, step_size, dtype=np.float64)[None, :]
+    amount_out = simulate_paths(grid * unit, reserves, pool_ids, zero_for_one, fees, kinds)
+    profits = (amount_out - grid * unit) / unit
+    best = profits.argmax(axis=1)
+    best_profits = profits[np.arange(len(ids)), best]
+
+    k = min(top_k, len(ids))
+    top = np.argpartition(-best_profits, k - 1)[:k]
+    candidates = [
+        (int(start + ids[j]), float(spreads[j]), float(grid[0, best[j]]), float(best_profits[j]))
+        for j in top
+    ]
+    timings['optimize'] = time.monotonic_ns() - simulated
+    return candidates, timings, (touched_paths, len(ids))
+
+
+def _evaluate_range_sampled(*args) -> Tuple[List[Candidate], Dict[str, int], Tuple[int, int], Dict[str, int]]:
+    """
+    Runs in a worker: _evaluate_range, plus the collapsed stacks the worker sampler took
+    during it while the pool profiles (the interval in the shared 'profiling' value, 0 when off).
+    The sampler runs across evaluations and only samples during them, so evaluations
+    shorter than the interval are still sampled in proportion to their time.
+    """
+    global _profiler
+    interval = float(_shared['profiling'][0])
+    if not interval:
+        if _profiler is not None:
+            _profiler.stop()
+            _profiler = None
+        return _evaluate_range(*args) + ({},)
+
+    if _profiler is None:
+        _profiler = SamplingProfiler(interval, label='simulation-worker')
+        _profiler.paused = True
+        _profiler.start()
+    _profiler.interval = interval
+    _profiler.paused = False
+    try:
+        result = _evaluate_range(*args)
+    finally:
+        _profiler.paused = True
+    return result + (dict(_profiler.drain()),)
+
+
+class SimulationPool:
+    """
+    Offloads path simulation and amount_in optimization to worker processes.
+
+    Reserves live in a shared memory table indexed by pool id (addresses.ADDRESSES), that the main
+    process updates in place, so only the touched pool ids travel to the workers on every block.
+    Rows of V2 pools are (reserve0, reserve1), rows of V3 pools (sqrtPriceX96, liquidity),
+    as returned by utils.fetch_touched_pool_reserves, and each hop is priced by the kernel of its pool kind.
+    Paths are partitioned by path id range, each worker returns its top candidates,
+    and the main process merges them.
+
+    Paths going through touched pools can be prefiltered (evaluate(min_spread=...)) on the
+    product of the marginal rates after fee of their pools, from a per-pool table of log rates
+    kept next to the reserves, so only paths above the threshold are simulated and optimized.
+
+    Paths can start from different base tokens: amounts in and profits are in units of a
+    common numeraire, each base converted at its price set by set_base_prices() (1 by default,
+    so with a single base they are in units of that base).
+
+    The reserves table is read by the workers during evaluate(), so update() should
+    not be called while an evaluation is running.
+
+    Workers are sampled between start_profiling() and stop_profiling() (see profiler.ProfilerControl).
+    """
+
+    def __init__(self,
+                 paths: Union[list, PathTable],
+                 reserves: Dict[int, List[int]],
+                 workers: Optional[int] = None,
+                 partitions: Optional[int] = None,
+                 headroom: int = 0):
+
+        self.workers = workers or os.cpu_count()
+        self.partitions = partitions or self.workers
+        self.table = paths if isinstance(paths, PathTable) else PathTable(paths)
+        # paths and pool ids allocated beyond the current ones, so paths appended to the
+        # table (new pools, see PathGraph.add_pool) are picked up by extend() without reallocating
+        self.headroom = headroom
+        self.prices: Dict[int, float] = {}
+        # worker time of the last evaluate(), slowest partition: {'prefilter': ns, 'simulate': ns, 'optimize': ns}
+        self.last_timings: Dict[str, int] = {'prefilter': 0, 'simulate': 0, 'optimize': 0}
+        # paths of the last evaluate(): {'touched': paths through touched pools, 'simulated': past the prefilter}
+        self.last_counts: Dict[str, int] = {'touched': 0, 'simulated': 0}
+        # sampling interval of the workers in seconds, 0 when not profiling, and the stacks merged so far
+        self._profile_interval = 0.0
+        self.profile_stacks: Counter = Counter()
+        # mask of set_active() not applied yet, see _apply_active()
+        self._pending_active: Optional[np.ndarray] = None
+
+        self._allocate(reserves, np.ones(len(self.table), dtype=np.bool_))
+        logger.info(f'Simulation pool: {self.n} paths / {len(self.ranges)} partitions / {self.workers} workers')
+
+    def _allocate(self, reserves: Dict[int, List[int]], active: np.ndarray):
+        n = len(self.table)
+        capacity = n + self.headroom
+
+        # one row per id up to the largest pool id used by the paths
+        pool_ids = self.table.pool_ids()
+        table = np.zeros((int(pool_ids[-1]) + 1 + self.headroom if len(pool_ids) else self.headroom, 2),
+                         dtype=np.float64)
+        _write_reserves(table, reserves)
+        self._pool_kinds = np.zeros(len(table), dtype=np.int8)
+        self._pool_fees = np.zeros(len(table), dtype=np.int32)
+        self._set_pool_attributes(0, n)
+
+        def rows(array: np.ndarray, fill) -> np.ndarray:
+            padded = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            padded[:n] = array
+            return padded
+
+        arrays = {
+            'reserves': table,
+            # log marginal rates after fee of every pool, see log_rates()
+            'log_rates': log_rates(table, self._pool_kinds, self._pool_fees),
+            'pools': rows(self.table.pools, -1),
+            'zero_for_one': rows(self.table.zero_for_one, False),
+            'fees': rows(self.table.fees, 0),
+            'kinds': rows(self.table.kinds, 0),
+            'decimals_in': rows(self.table.decimals_in, 0),
+            # paths not pruned (pruning.PoolPruner), only those are simulated
+            'active': rows(active, True),
+            # price of the base token of each path in the numeraire
+            'base_prices': np.ones(capacity, dtype=np.float64),
+            # sampling interval of the workers, see start_profiling()
+            'profiling': np.array([self._profile_interval], dtype=np.float64),
+        }
+
+        self._handles = []
+        self._arrays: Dict[str, np.ndarray] = {}
+        layout = {}
+        for key, array in arrays.items():
+            shm, shared = _create_shared(array)
+            self._handles.append(shm)
+            self._arrays[key] = shared
+            layout[key] = (shm.name, array.shape, array.dtype.str)
+
+        self.reserves = self._arrays['reserves']
+        self.log_rates = self._arrays['log_rates']
+        self.active = self._arrays['active']
+        self.base_prices = self._arrays['base_prices']
+        self._set_rows(n)
+
+        self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                            initializer=_attach_shared,
+                                            initargs=(layout,))
+
+    def _set_pool_attributes(self, start: int, end: int) -> np.ndarray:
+        """
+        Kind and fee of the pools of the paths in [start, end), by pool id, returns the pool ids
+        """
+        pool_ids = self.table.pools[start:end]
+        has_hop = pool_ids >= 0
+        self._pool_kinds[pool_ids[has_hop]] = self.table.kinds[start:end][has_hop]
+        self._pool_fees[pool_ids[has_hop]] = self.table.fees[start:end][has_hop]
+        return np.unique(pool_ids[has_hop])
+
+    def _update_log_rates(self, pool_ids: Union[List[int], np.ndarray]):
+        pool_ids = np.asarray(pool_ids, dtype=np.intp)
+        self.log_rates[pool_ids] = log_rates(self.reserves[pool_ids], self._pool_kinds[pool_ids], self._pool_fees[pool_ids])
+
+    def _set_rows(self, n: int):
+        self.n = n
+        bases = self.table.bases
+        self._base_rows = {int(token_id): np.nonzero(bases == token_id)[0] for token_id in np.unique(bases)}
+        self.set_base_prices(self.prices)
+
+        bounds = np.linspace(0, n, self.partitions + 1, dtype=np.int64)
+        self.ranges = [(int(bounds[i]), int(bounds[i + 1]))
+                       for i in range(self.partitions) if bounds[i] < bounds[i + 1]]
+
+    def extend(self, reserves: Dict[int, List[int]]) -> bool:
+        """
+        Picks up the paths appended to the table since the last call, active and priced like
+        the other paths of their base. Writes them into the headroom, or reallocates the shared
+        arrays and restarts the workers (with reserves) when they don't fit, then returns True.
+        Like update(), not to be called while an evaluation is running.
+        """
+        start, n = self.n, len(self.table)
+        if n == start:
+            return False
+        pool_ids = self.table.pools[start:n]
+        if n > len(self.active) or int(pool_ids.max()) >= len(self.reserves):
+            active = np.concatenate([self.active[:start], np.ones(n - start, dtype=np.bool_)])
+            self._release()
+            self._allocate(reserves, active)
+            self._apply_active()
+            logger.info(f'Simulation pool: reallocated for {n} paths')
+            return True
+
+        for key in ('pools', 'zero_for_one', 'fees', 'kinds', 'decimals_in'):
+            self._arrays[key][start:n] = getattr(self.table, key)[start:n]
+        self._update_log_rates(self._set_pool_attributes(start, n))
+        self.active[start:n] = True
+        self._set_rows(n)
+        self._apply_active()
+        return False
+
+    def update(self, reserves: Dict[int, List[int]]) -> List[int]:
+        """
+        Writes new reserves into the shared table, and the log rates of the pools,
+        returns the ids of the pools updated
+        """
+        self._apply_active()
+        updated = _write_reserves(self.reserves, reserves)
+        self._update_log_rates(updated)
+        return updated
+
+    def set_active(self, mask: np.ndarray):
+        """
+        Sets the paths simulated from now on, one bool per path of the table.
+        Can be called anytime (ex. from pruning.PoolPruner.run): the mask is applied by the next
+        update() or extend(), between evaluations, and rows of paths appended to the table
+        but not picked up yet are applied by the extend() picking them up
+        """
+        self._pending_active = np.array(mask, dtype=np.bool_)
+
+    def _apply_active(self):
+        mask = self._pending_active
+        if mask is None:
+            return
+        n = min(len(mask), self.n)
+        self.active[:n] = mask[:n]
+        if len(mask) <= self.n:
+            self._pending_active = None
+
+    def set_base_prices(self, prices: Dict[int, float]):
+        """
+        Sets the price in the numeraire of base tokens (by token id), bases not given keep theirs
+        """
+        for token_id, price in prices.items():
+            self.prices[token_id] = price
+            rows = self._base_rows.get(token_id)
+            if rows is not None:
+                self.base_prices[rows] = price
+
+    def start_profiling(self, interval: float = 0.005):
+        """
+        Workers sample their stacks every `interval` seconds while they evaluate,
+        from their next evaluation on
+        """
+        self.profile_stacks = Counter()
+        self._profile_interval = interval
+        self._arrays['profiling'][0] = interval
+
+    def stop_profiling(self) -> Counter:
+        """
+        Stops the worker samplers, returns the collapsed stacks of every worker merged
+        """
+        self._profile_interval = 0.0
+        self._arrays['profiling'][0] = 0.0
+        stacks, self.profile_stacks = self.profile_stacks, Counter()
+        return stacks
+
+    async def evaluate(self,
+                       touched_pool_ids: List[int],
+                       max_amount_in: int = 1000,
+                       step_size: int = 10,
+                       top_k: int = 10,
+                       min_spread: Optional[float] = None) -> List[Candidate]:
+        """
+        Returns the top_k candidates by expected profit among the paths touching the given pools,
+        amounts in the numeraire: max_amount_in and step_size, and the amount_in and profit of candidates.
+        With min_spread (in %, as the spreads of candidates), only the paths whose marginal spread
+        after fee is above it are simulated: with 0, the paths that can be profitable at some amount.
+        """
+        if not touched_pool_ids:
+            return []
+
+        loop = asyncio.get_event_loop()
+        touched = np.asarray(touched_pool_ids, dtype=np.int32)
+        min_log_spread = math.log1p(min_spread / 100) if min_spread is not None else None
+        results = await asyncio.gather(*[
+            loop.run_in_executor(self.executor,
+                                 _evaluate_range_sampled,
+                                 start, end, touched, max_amount_in, step_size, top_k, min_log_spread)
+            for start, end in self.ranges
+        ])
+        self.last_timings = {
+            stage: max(timings[stage] for _, timings, _, _ in results)
+            for stage in ('prefilter', 'simulate', 'optimize')
+        }
+        self.last_counts = {
+            'touched': sum(touched_paths for _, _, (touched_paths, _), _ in results),
+            'simulated': sum(simulated for _, _, (_, simulated), _ in results),
+        }
+        if self._profile_interval:
+            for _, _, _, stacks in results:
+                self.profile_stacks.update(stacks)
+        return heapq.nlargest(top_k, (c for candidates, _, _, _ in results for c in candidates), key=lambda c: c[3])
+
+    def close(self):
+        self._release()
+
+    def _release(self):
+        self.executor.shutdown()
+        for shm in self._handles:
+            shm.close()
+            shm.unlink()
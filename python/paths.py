@@ -1,15 +1,27 @@
+import numpy as np
+
 from tqdm import tqdm
-from typing import Dict, List, Optional
-import requests
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+from pools import DexVariant
 from poolsv3 import Poolv3
-from bundler import Path
+from addresses import ADDRESSES
 from constants import logger
+from simulator import UniswapV2Simulator
 from simulatorv3 import UniswapV3Simulator
-response = requests.get('https://lively-restless-pond.matic.quiknode.pro/2b6686dcae197a1385f8497ae93d3cfaa79b5d04',  verify=False)
+
+# orders pulls in eth_abi, only needed to build orders
+if TYPE_CHECKING:
+    from orders import Path
 
 
 class ArbPath:
 
+    __slots__ = ('pool_1', 'pool_2', 'pool_3',
+                 'token_in_1', 'token_out_1',
+                 'token_in_2', 'token_out_2',
+                 'token_in_3', 'token_out_3',
+                 'fee_1', 'fee_2', 'fee_3')
+
     def __init__(self,
                  pool_1: Poolv3,
                  pool_2: Poolv3,
@@ -37,25 +49,41 @@ class ArbPath:
         self.fee_2 = fee_2
         self.fee_3 = fee_3
 
+    @property
+    def pools(self) -> tuple:
+        if self.pool_3 is None:
+            return self.pool_1, self.pool_2
+        return self.pool_1, self.pool_2, self.pool_3
+
+    @property
+    def tokens_in(self) -> tuple:
+        return (self.token_in_1, self.token_in_2, self.token_in_3)[:self.nhop]
+
+    @property
+    def tokens_out(self) -> tuple:
+        return (self.token_out_1, self.token_out_2, self.token_out_3)[:self.nhop]
+
+    @property
+    def fees(self) -> tuple:
+        return (self.fee_1, self.fee_2, self.fee_3)[:self.nhop]
+
     @property
     def nhop(self) -> int:
         return 2 if self.pool_3 is None else 3
 
     def has_pool(self, pool: str) -> bool:
-        is_pool_1 = self.pool_1.address == pool
-        is_pool_2 = self.pool_2.address == pool
-        is_pool_3 = self.pool_3.address == pool
-        return is_pool_1 or is_pool_2 or is_pool_3
+        for hop_pool in self.pools:
+            if hop_pool.address == pool:
+                return True
+        return False
 
     def should_blacklist(self, blacklist_tokens: List[str]) -> bool:
-        for i in range(self.nhop):
-            token_in = getattr(self, f'token_in_{i + 1}')
-            token_out = getattr(self, f'token_out_{i + 1}')
+        for token_in, token_out in zip(self.tokens_in, self.tokens_out):
             if token_in in blacklist_tokens or token_out in blacklist_tokens:
                 return True
         return False
 
-    def simulate_v3_path(self, amount_in: int, sqrtPriceX96: Dict[str, int]) -> int:
+    def simulate_v3_path(self, amount_in: int, sqrtPriceX96: Dict[int, int]) -> int:
         """
         Simulates the swap path for Uniswap V3 pools
         """
@@ -66,7 +94,7 @@ class ArbPath:
     def optimize_amount_in(self,
                            max_amount_in: int,
                            step_size: int,
-                           sqrtPriceX96: Dict[str, int]) -> (int, int):
+                           sqrtPriceX96: Dict[int, int]) -> (int, int):
         # a simple brute force profit optimization
         token_in_decimals = self.pool_1.decimals0 if self.token_in_1 == self.pool_1.token0 else self.pool_1.decimals1
         optimized_in = 0
@@ -81,28 +109,176 @@ class ArbPath:
                 break
         return optimized_in, profit / (10 ** token_in_decimals)
 
-    def to_path_params(self, routers: List[str]) -> List[Path]:
+    def to_path_params(self, routers: List[str]) -> List['Path']:
+        from orders import Path
+
         path_params = []
-        for i in range(self.nhop):
-            pool = getattr(self, f'pool_{i + 1}')
-            token_in = getattr(self, f'token_in_{i + 1}')
-            token_out = getattr(self, f'token_out_{i + 1}')
-            fee = getattr(self, f'fee_{i + 1}')
-            path = Path(routers[i], token_in, token_out)
+        for router, token_in, token_out, fee in zip(routers, self.tokens_in, self.tokens_out, self.fees):
+            path = Path(router, token_in, token_out)
             path.fee = fee
             path_params.append(path)
         return path_params
 
 
-def simulate_v3_path(path: ArbPath, amount_in: int, sqrtPriceX96: Dict[str, int]) -> int:
+class PathTable:
+    """
+    Struct-of-arrays storage of paths for vectorized code and compact snapshots.
+
+    Pools and tokens are stored as their addresses.ADDRESSES ids, and every hop field
+    is an (n, 3) array indexed by path id. Missing hops (2-hop paths) have a pool id of -1.
+    Every hop carries the kind of its pool (its DexVariant value, 0 for a missing hop),
+    so V2 and V3 pools can be mixed in the same paths. Paths can start from different
+    base tokens (generate_multi_base_paths), `bases` is the token id each path starts and ends with.
+    """
+
+    ARRAYS = ('nhop', 'pools', 'tokens_in', 'tokens_out', 'zero_for_one', 'fees', 'kinds', 'decimals_in', 'bases')
+
+    def __init__(self, paths: List[ArbPath]):
+        n = len(paths)
+
+        self.nhop = np.zeros(n, dtype=np.int8)
+        self.pools = np.full((n, 3), -1, dtype=np.int32)
+        self.tokens_in = np.full((n, 3), -1, dtype=np.int32)
+        self.tokens_out = np.full((n, 3), -1, dtype=np.int32)
+        self.zero_for_one = np.zeros((n, 3), dtype=np.bool_)
+        self.fees = np.zeros((n, 3), dtype=np.int32)
+        self.decimals_in = np.zeros(n, dtype=np.int8)
+
+        self._paths_by_pool: Optional[Dict[int, np.ndarray]] = None
+
+        # kinds are looked up per pool, then filled in for every hop at once
+        pool_kinds: Dict[int, int] = {}
+
+        for idx, path in enumerate(paths):
+            self.nhop[idx] = path.nhop
+            for i, (pool, token_in, fee) in enumerate(zip(path.pools, path.tokens_in, path.fees)):
+                zero_for_one = token_in == pool.token0
+                self.pools[idx, i] = pool.id
+                self.tokens_in[idx, i] = pool.token0_id if zero_for_one else pool.token1_id
+                self.tokens_out[idx, i] = pool.token1_id if zero_for_one else pool.token0_id
+                self.zero_for_one[idx, i] = zero_for_one
+                self.fees[idx, i] = fee
+                if pool.id not in pool_kinds:
+                    pool_kinds[pool.id] = pool.version.value
+            pool_1 = path.pools[0]
+            self.decimals_in[idx] = pool_1.decimals0 if self.zero_for_one[idx, 0] else pool_1.decimals1
+
+        kind_of = np.zeros(max(pool_kinds, default=-1) + 2, dtype=np.int8)  # the last entry is for missing hops
+        kind_of[list(pool_kinds)] = list(pool_kinds.values())
+        self.kinds = kind_of[self.pools]
+        self.bases = self.tokens_in[:, 0].copy()
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'PathTable':
+        """
+        A table over existing arrays (as returned by arrays()), without copying them,
+        so memory-mapped arrays stay memory-mapped
+        """
+        table = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(table, name, arrays[name])
+        table._paths_by_pool = None
+        if 'index_pools' in arrays:
+            bounds = arrays['index_bounds']
+            index_paths = arrays['index_paths']
+            table._paths_by_pool = {
+                int(pool): index_paths[bounds[i]:bounds[i + 1]]
+                for i, pool in enumerate(arrays['index_pools'])
+            }
+        return table
+
+    def arrays(self, index: bool = True) -> Dict[str, np.ndarray]:
+        """
+        The arrays of the table, plus the pool -> path index in CSR form if index is set
+        """
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        if index:
+            paths_by_pool = self._pool_index()
+            pools = sorted(paths_by_pool)
+            sizes = [len(paths_by_pool[pool]) for pool in pools]
+            arrays['index_pools'] = np.asarray(pools, dtype=np.int32)
+            arrays['index_bounds'] = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+            arrays['index_paths'] = (np.concatenate([paths_by_pool[pool] for pool in pools]).astype(np.int32)
+                                     if pools else np.zeros(0, dtype=np.int32))
+        return arrays
+
+    def append(self, paths: List[ArbPath]) -> range:
+        """
+        Appends paths (ex. the paths of a new pool, see PathGraph.add_pool), returns their path ids.
+        The pool -> path index, if built, is extended with the new paths only.
+        """
+        start = len(self)
+        if not paths:
+            return range(start, start)
+        new = PathTable(paths)
+        for name in self.ARRAYS:
+            setattr(self, name, np.concatenate([getattr(self, name), getattr(new, name)]))
+        if self._paths_by_pool is not None:
+            empty = np.zeros(0, dtype=np.int32)
+            for pool_id, path_ids in new._pool_index().items():
+                self._paths_by_pool[pool_id] = np.concatenate([self._paths_by_pool.get(pool_id, empty),
+                                                               (path_ids + start).astype(np.int32)])
+        return range(start, len(self))
+
+    def pool_ids(self) -> np.ndarray:
+        """
+        Sorted ids of the pools used by any path
+        """
+        pool_ids = self.pools.ravel()
+        return np.unique(pool_ids[pool_ids >= 0])
+
+    def __len__(self) -> int:
+        return len(self.nhop)
+
+    def paths_with_pool(self, pool_id: int) -> np.ndarray:
+        """
+        Path ids going through a pool, from a reverse index built on first use
+        """
+        return self._pool_index().get(pool_id, np.zeros(0, dtype=np.int32))
+
+    def _pool_index(self) -> Dict[int, np.ndarray]:
+        if self._paths_by_pool is None:
+            path_ids = np.repeat(np.arange(len(self), dtype=np.int32), 3)
+            pool_ids = self.pools.ravel()
+            valid = pool_ids >= 0
+            path_ids, pool_ids = path_ids[valid], pool_ids[valid]
+            order = np.argsort(pool_ids, kind='stable')
+            pools, starts = np.unique(pool_ids[order], return_index=True)
+            bounds = np.append(starts, len(order))
+            self._paths_by_pool = {
+                int(pool): np.unique(path_ids[order[bounds[i]:bounds[i + 1]]])
+                for i, pool in enumerate(pools)
+            }
+        return self._paths_by_pool
+
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+
+def simulate_path(path: ArbPath, amount_in: int, states: Dict[int, List[int]]) -> int:
+    """
+    Simulates a path of any mix of pools, each hop priced by the simulator of its pool kind.
+    states are keyed by pool id: [reserve0, reserve1] for V2 pools, [sqrtPriceX96, liquidity, ...]
+    for V3 pools (as returned by utils.fetch_touched_pool_reserves). V3 hops stay in the current tick range.
+    """
+    v2, v3 = UniswapV2Simulator(), UniswapV3Simulator()
+    for pool, token_in, fee in zip(path.pools, path.tokens_in, path.fees):
+        state = states[pool.id]
+        zero_for_one = token_in == pool.token0
+        if pool.version == DexVariant.UniswapV3:
+            amount_in = v3.get_amount_out_in_range(amount_in, state[0], state[1], fee, zero_for_one)
+        elif zero_for_one:
+            amount_in = v2.get_amount_out(amount_in, state[0], state[1], fee)
+        else:
+            amount_in = v2.get_amount_out(amount_in, state[1], state[0], fee)
+    return amount_in
+
+
+def simulate_v3_path(path: ArbPath, amount_in: int, sqrtPriceX96: Dict[int, int]) -> int:
     sim = UniswapV3Simulator()
 
-    for i in range(path.nhop):
-        pool = getattr(path, f'pool_{i + 1}')
-        token_in = getattr(path, f'token_in_{i + 1}')
-        token_out = getattr(path, f'token_out_{i + 1}')
-        fee = getattr(path, f'fee_{i + 1}')
-        sqrt_ratio_current_x96 = sqrtPriceX96[pool.address]
+    for pool, token_in, fee in zip(path.pools, path.tokens_in, path.fees):
+        sqrt_ratio_current_x96 = sqrtPriceX96[pool.id]
         sqrt_ratio_target_x96 = sim.sqrtx96_to_price(sqrt_ratio_current_x96,
                                                      pool.decimals0,
                                                      pool.decimals1,
@@ -114,82 +290,155 @@ def simulate_v3_path(path: ArbPath, amount_in: int, sqrtPriceX96: Dict[str, int]
     return amount_out
 
 
-def generate_triangular_paths(pools: Dict[str, Poolv3], token_in: str) -> List[ArbPath]:
+def generate_triangular_paths(pools: Dict[int, Poolv3], token_in: str) -> List[ArbPath]:
     """
     A straightforward triangular arbitrage path finder for Uniswap V3.
-    This call will find both 2-hop paths, 3-hop paths, but not more.
-    Also, we define triangular arb. paths as a 3-hop swap path starting
+    We define triangular arb. paths as a 3-hop swap path starting
     with token_in and ending with token_in:
 
     token_in --> token1 --> token2 --> token_in
 
-    NOTE: this function is highly recursive, and can easily extend to n-hop paths.
-    Refer to https://github.com/solidquant/whack-a-mole/blob/main/data/dex.py
-    __generate_paths function for this.
+    Pools can be any mix of V2 (pools.Pool) and V3 (poolsv3.Poolv3) pools,
+    hops keep their pool, and with it the pool kind to price them with (see simulate_path).
+    Same as generate_multi_base_paths with a single base token.
     """
-    paths = []
-
-    pools = list(pools.values())
-
-    for pool_1 in tqdm(pools,
-                       total=len(pools),
-                       ncols=100,
-                       desc=f'Generating paths',
-                       ascii=' =',
-                       leave=True):
-        pools_in_path = set()
-        pools_in_path.add(pool_1.address)
-        can_trade_1 = (pool_1.token0 == token_in) or (pool_1.token1 == token_in)
-        if can_trade_1:
-            token_in_1, token_out_1 = (pool_1.token0, pool_1.token1) if pool_1.token0 == token_in else (pool_1.token1, pool_1.token0)
-            fee_1 = pool_1.fee
-            if token_in_1 != token_in:
-                continue
-
-            for j in range(len(pools)):
-                pool_2 = pools[j]
-                pools_in_path.add(pool_2.address)
-                can_trade_2 = (pool_2.token0 == token_out_1) or (pool_2.token1 == token_out_1)
-                if can_trade_2:
-                    token_in_2, token_out_2 = (pool_2.token0, pool_2.token1) if pool_2.token0 == token_out_1 else (pool_2.token1, pool_2.token0)
-                    fee_2 = pool_2.fee
-                    if token_out_1 != token_in_2:
-                        continue
+    return generate_multi_base_paths(pools, [token_in])
 
-                    for k in range(len(pools)):
-                        pool_3 = pools[k]
-                        pools_in_path.add(pool_3.address)
-                        can_trade_3 = (pool_3.token0 == token_out_2) or (pool_3.token1 == token_out_2)
-                        if can_trade_3:
-                            token_in_3, token_out_3 = (pool_3.token0, pool_3.token1) if pool_3.token0 == token_out_2 else (pool_3.token1, pool_3.token0)
-                            fee_3 = pool_3.fee
-                            if token_out_2 != token_in_3:
-                                continue
-
-                            if token_out_3 == token_in:
-                                unique_pool_cnt = len(pools_in_path)
-
-                                if unique_pool_cnt < 3:
-                                    continue
-
-                                arb_path = ArbPath(pool_1=pool_1,
-                                                   pool_2=pool_2,
-                                                   pool_3=pool_3,
-                                                   token_in_1=token_in_1,
-                                                   token_out_1=token_out_1,
-                                                   token_in_2=token_in_2,
-                                                   token_out_2=token_out_2,
-                                                   token_in_3=token_in_3,
-                                                   token_out_3=token_out_3,
-                                                   fee_1=fee_1,
-                                                   fee_2=fee_2,
-                                                   fee_3=fee_3)
-                                paths.append(arb_path)
 
+def generate_multi_base_paths(pools: Dict[int, Poolv3], base_tokens: Iterable[str]) -> List[ArbPath]:
+    """
+    Triangular paths starting and ending with any of base_tokens, in one pass (see PathGraph)
+    """
+    paths = PathGraph(pools.values(), base_tokens).paths()
     logger.info(f'Generated {len(paths)} 3-hop arbitrage paths')
     return paths
 
 
+class PathGraph:
+    """
+    Adjacency index of pools by token, to enumerate triangular paths from several base tokens.
+
+    Every base walks the same index instead of scanning every pool at every hop. A cycle
+    through several bases is generated once, from the first of them in base_tokens: a base
+    skips the cycles through a base before it. Paths of a base come in the order of pools.
+    Tokens are matched by their addresses.ADDRESSES id, whatever the casing of their address.
+
+    Pools can be added later (ex. created while running), add_pool() then only
+    enumerates the paths through the new pool, following the same rules.
+    """
+
+    def __init__(self, pools: Iterable[Poolv3], base_tokens: Iterable[str]):
+        self.bases = list(dict.fromkeys(ADDRESSES.id(token) for token in base_tokens))
+        self.adjacency: Dict[int, List[Tuple[Poolv3, int]]] = {}
+        self.pool_ids = set()
+        for pool in pools:
+            self._insert(pool)
+
+    def _insert(self, pool: Poolv3) -> bool:
+        if pool.id in self.pool_ids:
+            return False
+        self.pool_ids.add(pool.id)
+        self.adjacency.setdefault(pool.token0_id, []).append((pool, pool.token1_id))
+        self.adjacency.setdefault(pool.token1_id, []).append((pool, pool.token0_id))
+        return True
+
+    def paths(self) -> List[ArbPath]:
+        paths = []
+        done = set()
+        for base in self.bases:
+            for pool_1, token_out_1 in tqdm(self.adjacency.get(base, []),
+                                            ncols=100,
+                                            desc=f'Generating paths',
+                                            ascii=' =',
+                                            leave=True):
+                if token_out_1 in done:
+                    continue
+                for pool_2, token_out_2 in self.adjacency[token_out_1]:
+                    if pool_2 is pool_1 or token_out_2 in done:
+                        continue
+                    for pool_3, token_out_3 in self.adjacency[token_out_2]:
+                        if token_out_3 == base and pool_3 is not pool_1 and pool_3 is not pool_2:
+                            paths.append(_arb_path(base, pool_1, token_out_1, pool_2, token_out_2, pool_3))
+            done.add(base)
+        return paths
+
+    def add_pool(self, pool: Poolv3) -> List[ArbPath]:
+        """
+        Inserts a pool, returns the new paths: the paths going through it, at any hop
+        """
+        if not self._insert(pool):
+            return []
+
+        tokens = (pool.token0_id, pool.token1_id)
+
+        def other(token: int) -> int:
+            return pool.token1_id if token == pool.token0_id else pool.token0_id
+
+        paths = []
+        done = set()
+        for base in self.bases:
+            # the pool at the first hop
+            if base in tokens and other(base) not in done:
+                token_out_1 = other(base)
+                for pool_2, token_out_2 in self.adjacency[token_out_1]:
+                    if pool_2 is pool or token_out_2 in done:
+                        continue
+                    for pool_3, token_out_3 in self.adjacency[token_out_2]:
+                        if token_out_3 == base and pool_3 is not pool and pool_3 is not pool_2:
+                            paths.append(_arb_path(base, pool, token_out_1, pool_2, token_out_2, pool_3))
+
+            # the pool at the second hop
+            for pool_1, token_out_1 in self.adjacency.get(base, []):
+                if pool_1 is pool or token_out_1 in done or token_out_1 not in tokens:
+                    continue
+                token_out_2 = other(token_out_1)
+                if token_out_2 in done:
+                    continue
+                for pool_3, token_out_3 in self.adjacency[token_out_2]:
+                    if token_out_3 == base and pool_3 is not pool_1 and pool_3 is not pool:
+                        paths.append(_arb_path(base, pool_1, token_out_1, pool, token_out_2, pool_3))
+
+            # the pool at the third hop
+            if base in tokens and other(base) not in done:
+                token_out_2 = other(base)
+                for pool_1, token_out_1 in self.adjacency[base]:
+                    if pool_1 is pool or token_out_1 in done:
+                        continue
+                    for pool_2, token_out in self.adjacency[token_out_1]:
+                        if token_out == token_out_2 and pool_2 is not pool_1 and pool_2 is not pool:
+                            paths.append(_arb_path(base, pool_1, token_out_1, pool_2, token_out_2, pool))
+            done.add(base)
+        return paths
+
+
+def _hop(pool: Poolv3, token_in: int) -> Tuple[str, str]:
+    # addresses as the pool has them, PathTable tells the direction by comparing them
+    return (pool.token0, pool.token1) if token_in == pool.token0_id else (pool.token1, pool.token0)
+
+
+def _arb_path(base: int,
+              pool_1: Poolv3,
+              token_out_1: int,
+              pool_2: Poolv3,
+              token_out_2: int,
+              pool_3: Poolv3) -> ArbPath:
+    token_in_1, out_1 = _hop(pool_1, base)
+    token_in_2, out_2 = _hop(pool_2, token_out_1)
+    token_in_3, out_3 = _hop(pool_3, token_out_2)
+    return ArbPath(pool_1=pool_1,
+                   pool_2=pool_2,
+                   pool_3=pool_3,
+                   token_in_1=token_in_1,
+                   token_out_1=out_1,
+                   token_in_2=token_in_2,
+                   token_out_2=out_2,
+                   token_in_3=token_in_3,
+                   token_out_3=out_3,
+                   fee_1=pool_1.fee,
+                   fee_2=pool_2.fee,
+                   fee_3=pool_3.fee)
+
+
 if __name__ == '__main__':
     from constants import HTTPS_URL
     from poolsv3 import load_all_pools_from_v3
@@ -207,5 +456,6 @@ if __name__ == '__main__':
                                    50000)
 
     token_in = '0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2'  # WETH
+    pools = {pool.id: pool for pool in pools.values()}
     paths = generate_triangular_paths(pools, token_in)
     # logger.info(paths)
@@ -1,18 +1,21 @@
 
 import os
 import csv
-import web3
 import json
 
 from tqdm import tqdm
 from enum import Enum
-from web3 import Web3
 from time import sleep
 from random import randint
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from constants import *
+from addresses import ADDRESSES
+
+# web3 is imported by the loaders only, it takes more than a second to import
+if TYPE_CHECKING:
+    import web3
 
 RATE_LIMIT = 10  # Limit requests, adjust this to rate limit
 
@@ -24,6 +27,9 @@ class DexVariant(Enum):
 
 class Pool:
 
+    __slots__ = ('address', 'version', 'token0', 'token1', 'decimals0', 'decimals1', 'fee',
+                 'id', 'token0_id', 'token1_id')
+
     def __init__(self,
                  address: str,
                  version: DexVariant,
@@ -41,6 +47,11 @@ class Pool:
         self.decimals1 = decimals1
         self.fee = fee
 
+        # interned once here, so tables and indexes downstream are keyed by ints
+        self.id = ADDRESSES.id(address)
+        self.token0_id = ADDRESSES.id(token0)
+        self.token1_id = ADDRESSES.id(token1)
+
     def cache_row(self):
         return [
             self.address,
@@ -55,7 +66,7 @@ class Pool:
 
 def fetch_events(params: tuple,
                  factory_address: str,
-                 v2_factory: web3.contract.Contract):
+                 v2_factory: 'web3.contract.Contract'):
     sleep(randint(10, 50) / 100.0)  # Adding some jitter to avoid rate-limiting
     try:
         events = v2_factory.events.PoolCreated.get_logs(fromBlock=params[0], toBlock=params[1])
@@ -74,7 +85,8 @@ def load_cached_pools() -> Optional[Dict[str, Pool]]:
         for row in rdr:
             if row[0] == 'address':
                 continue
-            version = DexVariant.UniswapV3 if row[1] == '3' else DexVariant.UniswapV3
+            # caches written before pools were tagged V2 here say 3
+            version = DexVariant.UniswapV2
             pool = Pool(address=row[0],
                         version=version,
                         token0=row[2],
@@ -122,9 +134,10 @@ def load_all_pools_from_v2(https_url: str,
         return pools
 
     pools = pools or {}
-    v2_factory_abi = json.load(open(ABI_PATH / 'UniswapV2Factory.json', 'r'))
-    v3_factory_abi = json.load(open(ABI_PATH / 'UniswapV3Factory.json', 'r'))
-    erc20_abi = json.load(open(ABI_PATH / 'ERC20.json', 'r'))
+    v2_factory_abi = load_abi('UniswapV2Factory.json')
+    v3_factory_abi = load_abi('UniswapV3Factory.json')
+    erc20_abi = load_abi('ERC20.json')
+    from web3 import Web3
     w3 = Web3(Web3.HTTPProvider(https_url))
     to_block = w3.eth.get_block_number()
     decimals: Dict[str, int] = {}
@@ -169,7 +182,7 @@ def load_all_pools_from_v2(https_url: str,
                         continue
 
                     pool = Pool(address=args.pool,
-                                version=DexVariant.UniswapV3,
+                                version=DexVariant.UniswapV2,
                                 token0=args.token0,
                                 token1=args.token1,
                                 decimals0=decimals0,
@@ -1,28 +1,29 @@
 import os
 import csv
-import web3
 import json
 import certifi
+import urllib3
 from tqdm import tqdm
-from enum import Enum
-from web3 import Web3
 from time import sleep
 from random import randint
-import requests
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
 from constants import *
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-from web3.middleware import geth_poa_middleware
+from addresses import ADDRESSES
+# one enum for V2 and V3 pools, so versions compare across pool types
+from pools import DexVariant
+# web3 is imported by the loaders only, it takes more than a second to import
+if TYPE_CHECKING:
+    import web3
+
 RATE_LIMIT = 10
 
-response = requests.get('https://lively-restless-pond.matic.quiknode.pro/2b6686dcae197a1385f8497ae93d3cfaa79b5d04',  verify=False)
-class DexVariant(Enum):
-    UniswapV2 = 2
-    UniswapV3 = 3
 
 class Poolv3:
+    # liquidity is set by the caller before simulating (see paths.simulate_v3_path)
+    __slots__ = ('address', 'version', 'token0', 'token1', 'decimals0', 'decimals1', 'fee', 'liquidity',
+                 'id', 'token0_id', 'token1_id')
+
     def __init__(self,
                  address: str,
                  version: DexVariant,
@@ -40,6 +41,10 @@ class Poolv3:
         self.decimals1 = decimals1
         self.fee = fee
 
+        self.id = ADDRESSES.id(address)
+        self.token0_id = ADDRESSES.id(token0)
+        self.token1_id = ADDRESSES.id(token1)
+
     def cache_row(self):
         return [
             self.address,
@@ -51,7 +56,7 @@ class Poolv3:
             self.fee,
         ]
 
-def fetch_events(params: tuple, v3_factory: web3.contract.Contract):
+def fetch_events(params: tuple, v3_factory: 'web3.contract.Contract'):
     sleep(randint(10, 60) / 100.0)
     try:
         events = v3_factory.events.PoolCreated.get_logs(fromBlock=params[0], toBlock=params[1])
@@ -69,7 +74,7 @@ def load_cached_pools() -> Optional[Dict[str, Poolv3]]:
         for row in rdr:
             if row[0] == 'address':
                 continue
-            version = DexVariant.UniswapV3 if row[1] == '3' else DexVariant.UniswapV3
+            version = DexVariant(int(row[1]))
             poolv3 = Poolv3(address=row[0],
                         version=version,
                         token0=row[2],
@@ -109,8 +114,12 @@ def load_all_pools_from_v3(HTTPS_URL: str, factory_addresses: List[str], from_bl
         return pools
 
     pools = pools or {}
-    erc20_abi = json.load(open(ABI_PATH / 'ERC20.json', 'r'))
-    v3_factory_abi = json.load(open(ABI_PATH / 'UniswapV3Factory.json', 'r'))
+    erc20_abi = load_abi('ERC20.json')
+    v3_factory_abi = load_abi('UniswapV3Factory.json')
+    # the endpoint is queried without certificate verification
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    from web3 import Web3
+    from web3.middleware import geth_poa_middleware
     w3 = Web3(Web3.HTTPProvider(HTTPS_URL, request_kwargs={'verify': False}))
     w3.middleware_onion.inject(geth_poa_middleware, layer=0)
     to_block = w3.eth.get_block_number()
@@ -0,0 +1,231 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import datetime
+import threading
+
+from collections import Counter
+from typing import Dict, Optional
+
+from metrics import LatencyHistogram
+
+# On-demand sampling profiler of the running bot, toggled without a restart:
+#
+#   kill -USR1 <pid>                                  # profile for PROFILE_SECONDS
+#   echo 'profile 30' | nc -U /tmp/bot-profiler.sock  # profile for 30s
+#   echo 'status' | nc -U /tmp/bot-profiler.sock
+#
+# A sampler thread reads the stacks of every thread of the process (the event loop
+# thread running the streams and the handler, executor and sender threads) with
+# sys._current_frames, nothing is instrumented and the loop isn't paused.
+# Stacks are dumped in the collapsed format ("thread;outer;inner count"), readable
+# by flamegraph.pl, speedscope and inferno. Event loop lag is measured while it runs.
+# Worker processes of parallel.SimulationPool are sampled by a sampler of their own
+# while they evaluate (SimulationPool.start_profiling), their stacks come back with the
+# results and are merged under "simulation-worker".
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads but its own every `interval` seconds,
+    except while paused. Stacks start with `label` when set (ex. the process).
+    """
+
+    def __init__(self, interval: float = 0.005, label: Optional[str] = None):
+        self.interval = interval
+        self.label = label
+        self.paused = False
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            if self.paused:
+                continue
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                if self.label:
+                    stack.append(self.label)
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def drain(self) -> Counter:
+        """
+        Returns the stacks sampled so far and starts over, the sampler keeps running
+        """
+        stacks, self.stacks = self.stacks, Counter()
+        return stacks
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class LoopLagMonitor:
+    """
+    Event loop lag: how late a sleep of `interval` seconds wakes up, in us
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.histogram = LatencyHistogram()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.histogram = LatencyHistogram()
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            s = time.monotonic_ns()
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic_ns() - s - int(self.interval * 1e9)
+            self.histogram.record(max(lag, 0) // 1000)
+
+    def summary(self) -> Dict[str, float]:
+        h = self.histogram
+        return {
+            'count': h.count,
+            'p50_ms': h.percentile(50) / 1000,
+            'p90_ms': h.percentile(90) / 1000,
+            'p99_ms': h.percentile(99) / 1000,
+            'max_ms': h.max / 1000,
+        }
+
+
+class ProfilerControl:
+    """
+    Runs one profile at a time for a number of seconds and writes
+    profile-<time>.collapsed and profile-<time>.lag.txt to `out_dir`.
+    With sim_pool (a parallel.SimulationPool), its workers are sampled too.
+    """
+
+    def __init__(self, out_dir: str, interval: float = 0.005, sim_pool=None):
+        self.out_dir = out_dir
+        self.sim_pool = sim_pool
+        self.profiler = SamplingProfiler(interval)
+        self.lag = LoopLagMonitor()
+        self.default_seconds = 10.0
+        self.last_output: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def trigger(self, seconds: float) -> bool:
+        """
+        Starts a profile from the event loop thread, False if one is already running
+        """
+        if self.running:
+            return False
+        self._task = asyncio.get_event_loop().create_task(self.run(seconds))
+        return True
+
+    async def run(self, seconds: float) -> str:
+        self.profiler.start()
+        if self.sim_pool is not None:
+            self.sim_pool.start_profiling(self.profiler.interval)
+        self.lag.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self.lag.stop()
+            # joining the sampler takes at most one interval
+            self.profiler.stop()
+            if self.sim_pool is not None:
+                self.profiler.stacks.update(self.sim_pool.stop_profiling())
+        return self._dump()
+
+    def _dump(self) -> str:
+        os.makedirs(self.out_dir, exist_ok=True)
+        prefix = os.path.join(self.out_dir, f'profile-{datetime.datetime.now().strftime("%Y%m%d-%H%M%S")}')
+        with open(f'{prefix}.collapsed', 'w') as f:
+            f.write(self.profiler.collapsed())
+        with open(f'{prefix}.lag.txt', 'w') as f:
+            f.write(f'samples {self.profiler.samples}\n')
+            for key, value in self.lag.summary().items():
+                f.write(f'loop_lag_{key} {value}\n')
+        self.last_output = prefix
+        return prefix
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            line = (await reader.readline()).decode().split()
+            command = line[0] if line else ''
+            if command == 'profile':
+                seconds = float(line[1]) if len(line) > 1 else None
+                started = self.trigger(seconds or self.default_seconds)
+                reply = 'started' if started else 'already running'
+            elif command == 'status':
+                reply = 'running' if self.running else f'idle, last: {self.last_output}'
+            else:
+                reply = 'commands: profile [seconds], status'
+            writer.write(f'{reply}\n'.encode())
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path: str, default_seconds: float = 10):
+        """
+        Listens on a local unix socket and on SIGUSR1
+        """
+        self.default_seconds = default_seconds
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(self._handle_client, path=socket_path)
+        try:
+            asyncio.get_event_loop().add_signal_handler(signal.SIGUSR1, self.trigger, default_seconds)
+        except (NotImplementedError, AttributeError):
+            # no signals on windows, the socket still works
+            pass
+        return server
+
+
+if __name__ == '__main__':
+    async def busy():
+        control = ProfilerControl('profiles', interval=0.001)
+        profile = asyncio.get_event_loop().create_task(control.run(1))
+        while not profile.done():
+            sum(i * i for i in range(200000))
+            await asyncio.sleep(0)
+        print(profile.result(), control.lag.summary())
+        print(control.profiler.collapsed()[:1000])
+
+    asyncio.get_event_loop().run_until_complete(busy())
@@ -0,0 +1,176 @@
+import math
+import asyncio
+import numpy as np
+
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from paths import PathTable
+from pools import DexVariant
+from addresses import ADDRESSES
+from constants import logger
+
+# filters of PoolPruner, in the order they are reported
+FILTERS = ('blacklist', 'reserves', 'inactive')
+
+# pools per multicall request, as in multi.batch_get_uniswap_v3_slot0
+MULTICALL_BATCH = 250
+
+
+def reserves_in_units(pool, state: List[int]) -> Tuple[float, float]:
+    """
+    Reserves of both tokens of a pool in token units. V3 pools use their virtual
+    reserves in the current tick range (L / sqrtP and L * sqrtP), the liquidity a swap sees.
+    """
+    if pool.version == DexVariant.UniswapV3:
+        sqrt_price = state[0] / 2 ** 96
+        reserve0 = state[1] / sqrt_price if sqrt_price else 0.0
+        reserve1 = state[1] * sqrt_price
+    else:
+        reserve0, reserve1 = state[0], state[1]
+    return reserve0 / 10 ** pool.decimals0, reserve1 / 10 ** pool.decimals1
+
+
+class PoolPruner:
+    """
+    Drops pools that are not worth enumerating, watching and simulating paths through:
+
+    - blacklist: pools with a blacklisted token
+    - reserves: pools with less than `min_reserve` units of either token, or less than
+      `min_reserves[token]` units of a token given there (ex. 1000 USDC, 0.5 WETH)
+    - inactive: pools without a Sync / Swap for `max_idle_blocks`, counted from
+      the first block observed when a pool was never seen active
+
+    Each filter is evaluated on its own, so the report shows what each one shrinks.
+    Run evaluate() on the pools and the state at hand (ex. a snapshot) before
+    generate_triangular_paths, and run() in the background to re-evaluate as
+    the state changes, deactivating the paths of pruned pools.
+    """
+
+    def __init__(self,
+                 blacklist_tokens: Iterable[str] = (),
+                 min_reserve: float = 0.0,
+                 min_reserves: Optional[Dict[str, float]] = None,
+                 max_idle_blocks: Optional[int] = None):
+
+        self.blacklist = {ADDRESSES.id(token) for token in blacklist_tokens}
+        self.min_reserve = min_reserve
+        self.min_reserves = {ADDRESSES.id(token): units for token, units in (min_reserves or {}).items()}
+        self.max_idle_blocks = max_idle_blocks
+
+        self.block_number: Optional[int] = None
+        self.first_block: Optional[int] = None
+        self.last_active: Dict[int, int] = {}
+        self.dropped: Dict[str, Set[int]] = {name: set() for name in FILTERS}
+
+    def observe(self, pool_ids: Iterable[int], block_number: int):
+        """
+        Marks pools as active at a block (ex. the pools touched by the block)
+        """
+        if self.first_block is None:
+            self.first_block = block_number
+        self.block_number = block_number
+        for pool_id in pool_ids:
+            self.last_active[pool_id] = block_number
+
+    def evaluate(self,
+                 pools: Dict,
+                 states: Optional[Dict[int, List[int]]] = None,
+                 block_number: Optional[int] = None) -> Set[int]:
+        """
+        Re-evaluates every filter over pools (keyed by id or by address), returns the ids of the pools dropped.
+        States are keyed by pool id, without states the reserves filter keeps every pool.
+        """
+        block_number = block_number or self.block_number
+        dropped = {name: set() for name in FILTERS}
+
+        for pool in pools.values():
+            pool_id = pool.id
+            if pool.token0_id in self.blacklist or pool.token1_id in self.blacklist:
+                dropped['blacklist'].add(pool_id)
+
+            state = states.get(pool_id) if states is not None else None
+            if state is not None:
+                units0, units1 = reserves_in_units(pool, state)
+                min0 = max(self.min_reserve, self.min_reserves.get(pool.token0_id, 0.0))
+                min1 = max(self.min_reserve, self.min_reserves.get(pool.token1_id, 0.0))
+                if units0 < min0 or units1 < min1:
+                    dropped['reserves'].add(pool_id)
+
+            if self.max_idle_blocks is not None and block_number is not None and self.first_block is not None:
+                last_active = self.last_active.get(pool_id, self.first_block)
+                if block_number - last_active > self.max_idle_blocks:
+                    dropped['inactive'].add(pool_id)
+
+        self.dropped = dropped
+        return self.dropped_ids()
+
+    def admits(self, pool) -> bool:
+        """
+        Whether a pool without a state yet (ex. just created) passes the filters, the blacklist only
+        """
+        return pool.token0_id not in self.blacklist and pool.token1_id not in self.blacklist
+
+    def dropped_ids(self) -> Set[int]:
+        return set().union(*self.dropped.values())
+
+    def keep(self, pools: Dict) -> Dict:
+        """
+        The pools not dropped by the last evaluate(), pools can be keyed by id or by address
+        """
+        dropped = self.dropped_ids()
+        return {key: pool for key, pool in pools.items() if pool.id not in dropped}
+
+    def active_paths(self, table: PathTable) -> np.ndarray:
+        """
+        Paths of the table going through no dropped pool
+        """
+        dropped = np.fromiter(self.dropped_ids(), dtype=np.int32)
+        return ~np.isin(table.pools, dropped).any(axis=1)
+
+    def report(self, table: PathTable) -> List[Dict[str, int]]:
+        """
+        Pools dropped, paths and multicall volume left with no filter, each filter alone and all filters
+        """
+        def row(name: str, dropped: Set[int]) -> Dict[str, int]:
+            active = ~np.isin(table.pools, np.fromiter(dropped, dtype=np.int32)).any(axis=1)
+            pool_ids = table.pools[active].ravel()
+            watched = len(np.unique(pool_ids[pool_ids >= 0]))
+            return {
+                'filter': name,
+                'pools_dropped': len(dropped),
+                'paths': int(active.sum()),
+                'multicall_pools': watched,
+                'multicall_batches': math.ceil(watched / MULTICALL_BATCH),
+            }
+
+        rows = [row('none', set())]
+        rows += [row(name, self.dropped[name]) for name in FILTERS]
+        rows.append(row('all', self.dropped_ids()))
+        return rows
+
+    @staticmethod
+    def format_report(rows: List[Dict[str, int]]) -> str:
+        lines = [f'{"filter":<10} {"dropped":>8} {"paths":>8} {"multicall pools":>16} {"batches":>8}']
+        for r in rows:
+            lines.append(f'{r["filter"]:<10} {r["pools_dropped"]:>8} {r["paths"]:>8} '
+                         f'{r["multicall_pools"]:>16} {r["multicall_batches"]:>8}')
+        return '\n'.join(lines)
+
+    async def run(self,
+                  pools: Dict,
+                  states: Dict[int, List[int]],
+                  table: PathTable,
+                  on_update: Callable[[np.ndarray], None],
+                  interval: float = 300.0):
+        """
+        Re-evaluates every `interval` seconds over the live pools and states,
+        and calls on_update with the active paths mask when the dropped pools changed
+        """
+        dropped = self.dropped_ids()
+        while True:
+            await asyncio.sleep(interval)
+            current = self.evaluate(pools, states)
+            if current != dropped:
+                logger.info(f'Pruning: {len(current - dropped)} pools dropped, {len(dropped - current)} back')
+                dropped = current
+                on_update(self.active_paths(table))
@@ -1,11 +1,19 @@
+import json
 import asyncio
+import aiohttp
 
 from web3 import Web3
 from uuid import uuid4
-from flashbots import Flashbots
-from typing import Any, Dict, List
+from loguru import logger
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+from eth_account.messages import encode_defunct
+from eth_account.signers.local import LocalAccount
 from web3.exceptions import TransactionNotFound
-from flashbots.flashbots import FlashbotsBundleResponse
+
+# only send_bundle (web3 with the flashbots middleware) uses these, as annotations
+if TYPE_CHECKING:
+    from flashbots import Flashbots
+    from flashbots.flashbots import FlashbotsBundleResponse
 
 
 async def send_bundle(w3: Web3,
@@ -13,7 +21,7 @@ async def send_bundle(w3: Web3,
                       retry: int,
                       block_number: int = None) -> list:
 
-    flashbots: Flashbots = w3.flashbots
+    flashbots: 'Flashbots' = w3.flashbots
 
     left_retries = retry
 
@@ -31,7 +39,7 @@ async def send_bundle(w3: Web3,
             break
 
         replacement_uuid = str(uuid4())
-        response: FlashbotsBundleResponse = flashbots.send_bundle(
+        response: 'FlashbotsBundleResponse' = flashbots.send_bundle(
             bundle,
             target_block_number=block_number + 1,
             opts={'replacementUuid': replacement_uuid},
@@ -52,4 +60,206 @@ async def send_bundle(w3: Web3,
             left_retries -= 1
             block_number += 1
 
-    return receipts
\ No newline at end of file
+    return receipts
+
+
+class BundleSubmitter:
+    """
+    Sends bundles to several relays in parallel and tracks inclusion from new heads.
+
+    Instead of polling the block number, the submitter waits on new heads pushed through
+    on_new_head from an existing block stream, for head_timeout seconds at most (a few
+    block times) before asking the node once.
+    Inclusion is checked with a single batched eth_getTransactionReceipt request.
+    """
+
+    def __init__(self,
+                 https_url: str,
+                 relays: List[str],
+                 signer: LocalAccount,
+                 timeout: float = 2.0,
+                 head_timeout: float = 10.0):
+
+        self.https_url = https_url
+        self.relays = relays
+        self.signer = signer
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.head_timeout = head_timeout
+
+        self.block_number = 0
+        self._new_head: Optional[asyncio.Condition] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def new_head(self) -> asyncio.Condition:
+        if self._new_head is None:
+            self._new_head = asyncio.Condition()
+        return self._new_head
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def on_new_head(self, block_number: int):
+        async with self.new_head:
+            if block_number > self.block_number:
+                self.block_number = block_number
+                self.new_head.notify_all()
+
+    async def wait_for_block(self, block_number: int) -> bool:
+        """
+        Waits for a head at or above block_number, for head_timeout seconds at most,
+        returns whether it came
+        """
+        async def _wait():
+            async with self.new_head:
+                await self.new_head.wait_for(lambda: self.block_number >= block_number)
+
+        try:
+            await asyncio.wait_for(_wait(), timeout=self.head_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _signature_header(self, body: str) -> Dict[str, str]:
+        message = encode_defunct(text=Web3.to_hex(Web3.keccak(text=body)))
+        signature = Web3.to_hex(self.signer.sign_message(message).signature)
+        return {
+            'Content-Type': 'application/json',
+            'X-Flashbots-Signature': f'{self.signer.address}:{signature}',
+        }
+
+    async def _relay_call(self, relay: str, method: str, params: list) -> Any:
+        body = json.dumps({
+            'id': 1,
+            'method': method,
+            'jsonrpc': '2.0',
+            'params': params
+        })
+        async with self.session.post(relay, data=body, headers=self._signature_header(body)) as r:
+            res = await r.json(content_type=None)
+        if 'error' in res:
+            raise ValueError(f'{relay} {method}: {res["error"]}')
+        return res.get('result')
+
+    async def _broadcast(self, method: str, params: list) -> Dict[str, Any]:
+        """
+        Calls every relay concurrently, a failing relay does not affect the others
+        """
+        results = await asyncio.gather(
+            *[self._relay_call(relay, method, params) for relay in self.relays],
+            return_exceptions=True
+        )
+        for relay, result in zip(self.relays, results):
+            if isinstance(result, Exception):
+                logger.warning(f'{method} failed on {relay}: {result}')
+        return dict(zip(self.relays, results))
+
+    async def get_block_number(self) -> int:
+        async with self.session.post(self.https_url, json={
+            'id': 1,
+            'method': 'eth_blockNumber',
+            'jsonrpc': '2.0',
+            'params': []
+        }) as r:
+            res = await r.json(content_type=None)
+        return int(res['result'], base=16)
+
+    async def get_receipts(self, tx_hashes: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Retrieves all receipts in one JSON-RPC batch request, None for txs not mined
+        (and for all of them when the node answers the batch with an error)
+        """
+        batch = [
+            {'id': i, 'method': 'eth_getTransactionReceipt', 'jsonrpc': '2.0', 'params': [tx_hash]}
+            for i, tx_hash in enumerate(tx_hashes)
+        ]
+        async with self.session.post(self.https_url, json=batch) as r:
+            res = await r.json(content_type=None)
+        if not isinstance(res, list):
+            logger.warning(f'eth_getTransactionReceipt batch failed: {res.get("error", res) if isinstance(res, dict) else res}')
+            return [None] * len(tx_hashes)
+        receipts = {item['id']: item.get('result') for item in res}
+        return [receipts.get(i) for i in range(len(tx_hashes))]
+
+    async def simulate(self, txs: List[str], block_number: int) -> Any:
+        """
+        Simulates on the first relay that answers, relays share the same simulation
+        """
+        errors = []
+        for relay in self.relays:
+            try:
+                return await self._relay_call(relay, 'eth_callBundle', [{
+                    'txs': txs,
+                    'blockNumber': hex(block_number),
+                    'stateBlockNumber': 'latest',
+                }])
+            except Exception as e:
+                errors.append(e)
+        raise ValueError(f'Simulation failed on every relay: {errors}')
+
+    async def submit(self,
+                     bundle: List[Dict[str, Any]],
+                     retry: int,
+                     block_number: int = None,
+                     simulate: bool = True,
+                     on_simulation: Optional[Callable[[Dict[str, Any]], None]] = None) -> list:
+        """
+        An async counterpart of send_bundle, sending the bundle to every relay.
+        on_simulation gets the eth_callBundle result of the bundle (ex. GasModel.observe_simulation).
+        """
+        txs = ['0x' + bytes(tx['signed_transaction']).hex() for tx in bundle]
+        tx_hashes = [Web3.to_hex(Web3.keccak(hexstr=tx)) for tx in txs]
+
+        if not block_number:
+            block_number = self.block_number or await self.get_block_number()
+
+        left_retries = retry
+        receipts = []
+
+        while left_retries >= 0:
+            logger.info(f'Sending bundles to {len(self.relays)} relays at: #{block_number}')
+            if simulate:
+                try:
+                    simulation = await self.simulate(txs, block_number)
+                except Exception as e:
+                    logger.warning(f'Simulation error {e}')
+                    break
+                # the same txs are simulated on every retry, reported once
+                if on_simulation is not None and left_retries == retry:
+                    on_simulation(simulation)
+
+            target_block_number = block_number + 1
+            replacement_uuid = str(uuid4())
+            await self._broadcast('eth_sendBundle', [{
+                'txs': txs,
+                'blockNumber': hex(target_block_number),
+                'replacementUuid': replacement_uuid,
+            }])
+
+            if not await self.wait_for_block(target_block_number):
+                # the head feed stalled, ask the node before giving up on the bundle
+                await self.on_new_head(await self.get_block_number())
+                if self.block_number < target_block_number:
+                    logger.warning(f'No head past #{target_block_number - 1} in {self.head_timeout}s, bundle dropped')
+                    await self._broadcast('eth_cancelBundle', [{'replacementUuid': replacement_uuid}])
+                    break
+
+            receipts = await self.get_receipts(tx_hashes)
+            if all(receipts):
+                logger.info(f'Bundle was mined in block {int(receipts[0]["blockNumber"], base=16)}')
+                break
+
+            logger.info(f'Bundle not found in block {target_block_number}')
+            await self._broadcast('eth_cancelBundle', [{'replacementUuid': replacement_uuid}])
+            receipts = []
+            left_retries -= 1
+            block_number = max(target_block_number, self.block_number)
+
+        return receipts
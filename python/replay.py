@@ -0,0 +1,365 @@
+import gzip
+import json
+import time
+import asyncio
+import aiohttp
+import threading
+
+from aiohttp import web
+from loguru import logger
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+# Record and replay of node traffic.
+#
+# RecordingProxy sits between the bot and the node: point HTTPS_URL / WSS_URL at it and
+# it forwards everything upstream, while appending every RPC request/response pair and
+# every websocket frame, with its arrival time, to a gzip log.
+#
+# ReplayServer serves the same log back on the same URLs, so stream_new_blocks,
+# stream_uniswap_v2_events and the RPC clients run unchanged against a recorded block:
+#
+# - websocket subscriptions are matched to a recorded connection by their eth_subscribe params,
+#   and the recorded frames are sent at their recorded pace (scaled by `speed`),
+#   or as fast as possible with speed=0
+# - RPC requests are answered with the recorded response of the same (method, params),
+#   in recorded order when the same request was made several times
+
+
+class TrafficLog:
+    """
+    Append-only gzip log of JSON records, one per line.
+
+    Every open() in append mode starts a new gzip member, which gzip readers concatenate,
+    so a recording can be resumed. Records are flushed every `flush_interval` seconds,
+    a crash loses at most that much, and read_log() stops at a truncated tail.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.records = 0
+
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'at')
+        self._last_flush = time.time()
+
+    def append(self, record: Dict[str, Any]):
+        line = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+            self.records += 1
+            now = time.time()
+            if now - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = now
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_log(path: str) -> Iterator[Dict[str, Any]]:
+    with gzip.open(path, 'rt') as f:
+        try:
+            for line in f:
+                if line.endswith('\n'):
+                    yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile):
+            logger.warning(f'{path}: truncated log, replaying up to the last complete record')
+
+
+def _rpc_key(request: Dict[str, Any]) -> Tuple[str, str]:
+    return request.get('method'), json.dumps(request.get('params', []), sort_keys=True)
+
+
+class RecordingProxy:
+    """
+    Forwards JSON-RPC over HTTP (POST /) and websockets (GET /) to the node and records the traffic
+    """
+
+    def __init__(self,
+                 https_url: str,
+                 wss_url: str,
+                 log_path: str,
+                 host: str = '127.0.0.1',
+                 port: int = 8545):
+
+        self.https_url = https_url
+        self.wss_url = wss_url
+        self.host = host
+        self.port = port
+        self.log = TrafficLog(log_path)
+
+        self._connections = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    @property
+    def ws_url(self) -> str:
+        return f'ws://{self.host}:{self.port}'
+
+    async def start(self):
+        self._session = aiohttp.ClientSession()
+        app = web.Application()
+        app.router.add_post('/', self._handle_rpc)
+        app.router.add_get('/', self._handle_ws)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        logger.info(f'Recording {self.https_url} / {self.wss_url} on {self.url}')
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+        if self._session is not None:
+            await self._session.close()
+        self.log.close()
+
+    async def _handle_rpc(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        async with self._session.post(self.https_url,
+                                      data=body,
+                                      headers={'Content-Type': 'application/json'}) as r:
+            response_body = await r.read()
+            status = r.status
+        received_at = time.time()
+
+        try:
+            req, res = json.loads(body), json.loads(response_body)
+            if isinstance(req, list):
+                # a node can answer a batch with a single error object, the requests are then recorded unanswered
+                responses = {item.get('id'): item for item in res if isinstance(item, dict)} if isinstance(res, list) else {}
+                for item in req:
+                    self.log.append({'t': received_at, 'type': 'rpc',
+                                     'request': item, 'response': responses.get(item.get('id'))})
+            else:
+                self.log.append({'t': received_at, 'type': 'rpc', 'request': req, 'response': res})
+        except ValueError:
+            pass  # not JSON, forwarded but not recorded
+
+        return web.Response(body=response_body, status=status, content_type='application/json')
+
+    async def _handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        client = web.WebSocketResponse()
+        await client.prepare(request)
+
+        self._connections += 1
+        conn = self._connections
+        self.log.append({'t': time.time(), 'type': 'ws_open', 'conn': conn})
+
+        async with self._session.ws_connect(self.wss_url, max_msg_size=0) as upstream:
+            async def client_to_upstream():
+                async for msg in client:
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        break
+                    self.log.append({'t': time.time(), 'type': 'ws_send', 'conn': conn, 'data': msg.data})
+                    await upstream.send_str(msg.data)
+
+            async def upstream_to_client():
+                async for msg in upstream:
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        break
+                    self.log.append({'t': time.time(), 'type': 'ws_recv', 'conn': conn, 'data': msg.data})
+                    await client.send_str(msg.data)
+
+            tasks = [asyncio.ensure_future(client_to_upstream()), asyncio.ensure_future(upstream_to_client())]
+            _, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+
+        self.log.append({'t': time.time(), 'type': 'ws_close', 'conn': conn})
+        return client
+
+
+class ReplayServer:
+    """
+    Serves a TrafficLog back as a node: RPC over HTTP (POST /) and subscriptions over websockets (GET /)
+    """
+
+    def __init__(self,
+                 log_path: str,
+                 speed: float = 1.0,
+                 host: str = '127.0.0.1',
+                 port: int = 8545):
+
+        self.speed = speed
+        self.host = host
+        self.port = port
+
+        self.rpc: Dict[Tuple[str, str], Deque[Dict[str, Any]]] = defaultdict(deque)
+        self.last_rpc: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # recorded connections: the eth_subscribe request that opened it, and its received frames
+        self.subscriptions: List[Tuple[Tuple[str, str], List[Tuple[float, str]]]] = []
+
+        self.t0: Optional[float] = None
+        self.started_at: Optional[float] = None
+        self.stats = defaultdict(int)
+
+        self._load(log_path)
+        self._used = set()
+        self._runner: Optional[web.AppRunner] = None
+
+    def _load(self, log_path: str):
+        connections: Dict[int, Dict[str, Any]] = {}
+        for record in read_log(log_path):
+            record_type = record['type']
+            if record_type == 'rpc':
+                if record['response'] is not None:
+                    self.rpc[_rpc_key(record['request'])].append(record['response'])
+            elif record_type == 'ws_open':
+                connections[record['conn']] = {'subscribe': None, 'frames': []}
+            elif record_type == 'ws_send':
+                conn = connections[record['conn']]
+                request = json.loads(record['data'])
+                if conn['subscribe'] is None and request.get('method') == 'eth_subscribe':
+                    conn['subscribe'] = _rpc_key(request)
+            elif record_type == 'ws_recv':
+                if self.t0 is None:
+                    self.t0 = record['t']
+                connections[record['conn']]['frames'].append((record['t'], record['data']))
+
+        for conn in connections.values():
+            if conn['subscribe'] is not None:
+                self.subscriptions.append((conn['subscribe'], conn['frames']))
+
+        logger.info(f'Loaded {sum(len(v) for v in self.rpc.values())} RPC responses / '
+                    f'{len(self.subscriptions)} subscriptions from {log_path}')
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    @property
+    def ws_url(self) -> str:
+        return f'ws://{self.host}:{self.port}'
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/', self._handle_rpc)
+        app.router.add_get('/', self._handle_ws)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        logger.info(f'Replaying on {self.url} (speed: {self.speed or "max"})')
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _rpc_response(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        key = _rpc_key(request)
+        recorded = self.rpc.get(key)
+        if recorded:
+            response = recorded.popleft()
+            self.last_rpc[key] = response
+        else:
+            response = self.last_rpc.get(key)
+        if response is None:
+            self.stats['rpc_misses'] += 1
+            return {'id': request.get('id'), 'jsonrpc': '2.0',
+                    'error': {'code': -32000, 'message': f'not recorded: {key[0]} {key[1]}'}}
+        self.stats['rpc_hits'] += 1
+        return {**response, 'id': request.get('id')}
+
+    async def _handle_rpc(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if isinstance(body, list):
+            return web.json_response([self._rpc_response(req) for req in body])
+        return web.json_response(self._rpc_response(body))
+
+    async def _delay_until(self, recorded_at: float):
+        if not self.speed:
+            return
+        if self.started_at is None:
+            self.started_at = time.time()
+        delay = (recorded_at - self.t0) / self.speed - (time.time() - self.started_at)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _play(self, ws: web.WebSocketResponse, request_id: Any, frames: List[Tuple[float, str]]):
+        for idx, (recorded_at, data) in enumerate(frames):
+            if idx == 0:
+                # the subscription confirmation, answered right away with the client's request id,
+                # the first subscription replayed starts the replay clock
+                data = json.dumps({**json.loads(data), 'id': request_id})
+                if self.speed and self.started_at is None:
+                    self.started_at = time.time() - (recorded_at - self.t0) / self.speed
+            else:
+                await self._delay_until(recorded_at)
+            await ws.send_str(data)
+            self.stats['ws_frames'] += 1
+
+    async def _handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        players = []
+        async for msg in ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                break
+            req = json.loads(msg.data)
+            if req.get('method') != 'eth_subscribe':
+                await ws.send_str(json.dumps(self._rpc_response(req)))
+                continue
+
+            key = _rpc_key(req)
+            for idx, (subscribe, frames) in enumerate(self.subscriptions):
+                if subscribe == key and idx not in self._used:
+                    self._used.add(idx)
+                    players.append(asyncio.ensure_future(self._play(ws, req.get('id'), frames)))
+                    break
+            else:
+                self.stats['ws_misses'] += 1
+                await ws.send_str(json.dumps({'id': req.get('id'), 'jsonrpc': '2.0',
+                                              'error': {'code': -32000, 'message': f'not recorded: {key[1]}'}}))
+
+        for player in players:
+            player.cancel()
+        return ws
+
+
+if __name__ == '__main__':
+    """
+    Record:  python replay.py record traffic.log.gz   (then run the bot with HTTPS_URL=http://127.0.0.1:8545 WSS_URL=ws://127.0.0.1:8545)
+    Replay:  python replay.py replay traffic.log.gz --speed 0
+    """
+    import argparse
+
+    from constants import HTTPS_URL, WSS_URL
+
+    parser = argparse.ArgumentParser(description='Record and replay node traffic')
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('log')
+    parser.add_argument('--port', type=int, default=8545)
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 0 for as fast as possible')
+    args = parser.parse_args()
+
+    async def run():
+        if args.mode == 'record':
+            server = RecordingProxy(HTTPS_URL, WSS_URL, args.log, port=args.port)
+        else:
+            server = ReplayServer(args.log, args.speed, port=args.port)
+        await server.start()
+        try:
+            while True:
+                await asyncio.sleep(10)
+                if args.mode == 'record':
+                    logger.info(f'{server.log.records} records')
+                else:
+                    logger.info(dict(server.stats))
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
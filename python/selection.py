@@ -0,0 +1,118 @@
+import heapq
+import numpy as np
+
+from typing import Callable, Dict, List, Optional
+
+from paths import PathTable
+from parallel import Candidate, KERNELS, Q96, simulate_paths
+from pools import DexVariant
+
+# Several orders per block among the candidates of parallel.SimulationPool.
+#
+# Candidates are evaluated independently against the state of the block, so two paths
+# through the same pool both count on its reserves. OrderSelector takes the top_k
+# candidates by expected profit (a heap), and re-simulates them one after the other
+# against a copy of the state of their pools, applying the swaps of every accepted order
+# to the copy, in the order the orders execute in a bundle. Each candidate is re-optimized
+# over the amount_in grid of the workers and accepted while its profit after cost stays
+# positive: paths sharing no pool with accepted orders keep their profit, the others are
+# priced after them.
+
+
+def apply_swap(state: np.ndarray,
+               kind: int,
+               zero_for_one: bool,
+               fee: int,
+               amount_in: float,
+               amount_out: float) -> np.ndarray:
+    """
+    State of a pool after a swap, rows as in parallel.SimulationPool: (reserve0, reserve1) for
+    V2 pools, the fee stays in the pool, and (sqrtPriceX96, liquidity) for V3 pools, within the
+    current tick range as parallel._v3_amount_out prices them (the next sqrt price from the
+    amount in, as SqrtPriceMath.getNextSqrtPriceFromInput)
+    """
+    if kind == DexVariant.UniswapV3.value:
+        sqrt_price = state[0] / Q96
+        liquidity = state[1]
+        amount_in_less_fee = amount_in * (1 - fee / 1000000)
+        if zero_for_one:
+            sqrt_price = liquidity / (liquidity / sqrt_price + amount_in_less_fee)
+        else:
+            sqrt_price = sqrt_price + amount_in_less_fee / liquidity
+        return np.array([sqrt_price * Q96, liquidity])
+
+    if zero_for_one:
+        return np.array([state[0] + amount_in, state[1] - amount_out])
+    return np.array([state[0] - amount_out, state[1] + amount_in])
+
+
+class OrderSelector:
+    """
+    Picks the orders to send together on a block (one bundle) from the candidates of
+    SimulationPool.evaluate: up to max_orders of the top_k candidates, re-simulated in
+    sequence on a shared copy of the state, see the comment above
+    """
+
+    def __init__(self,
+                 table: PathTable,
+                 top_k: int = 10,
+                 max_orders: int = 4,
+                 max_amount_in: int = 1000,
+                 step_size: int = 10):
+
+        self.table = table
+        self.top_k = top_k
+        self.max_orders = max_orders
+        self.grid = np.arange(0, max_amount_in, step_size, dtype=np.float64)[None, :]
+
+    def select(self,
+               candidates: List[Candidate],
+               states: np.ndarray,
+               base_prices: np.ndarray,
+               cost: Optional[Callable[[int], float]] = None) -> List[Candidate]:
+        """
+        Candidates to send, in execution order, re-simulated after the ones before them.
+        states and base_prices are those of the simulation pool (SimulationPool.reserves,
+        SimulationPool.base_prices), they are not modified. cost gives the cost of a path
+        in the numeraire (ex. gas), profits of candidates are before cost as in evaluate().
+        """
+        table = self.table
+        grid = self.grid
+        overlay: Dict[int, np.ndarray] = {}  # state after the accepted orders
+        selected = []
+
+        for path_idx, _, _, _ in heapq.nlargest(self.top_k, candidates, key=lambda c: c[3]):
+            if len(selected) == self.max_orders:
+                break
+            nhop = int(table.nhop[path_idx])
+            pool_ids = table.pools[path_idx, :nhop].tolist()
+            zero_for_one = table.zero_for_one[path_idx:path_idx + 1]
+            fees = table.fees[path_idx:path_idx + 1]
+            kinds = table.kinds[path_idx:path_idx + 1]
+            unit = 10.0 ** int(table.decimals_in[path_idx]) / float(base_prices[path_idx])
+
+            # the pools of the path, re-indexed 0..nhop-1 into a local copy of their state
+            local = np.array([overlay[pool_id] if pool_id in overlay else states[pool_id] for pool_id in pool_ids],
+                             dtype=np.float64)
+            local_ids = np.array([list(range(nhop)) + [-1] * (3 - nhop)], dtype=np.int32)
+
+            amount_out = simulate_paths(grid * unit, local, local_ids, zero_for_one, fees, kinds)
+            profits = (amount_out[0] - grid[0] * unit) / unit
+            best = int(profits.argmax())
+            profit = float(profits[best])
+            if best == 0 or profit - (cost(path_idx) if cost is not None else 0.0) <= 0:
+                continue
+
+            quote = simulate_paths(np.array([[unit]]), local, local_ids, zero_for_one, fees, kinds)
+            spread = (float(quote[0, 0]) / unit - 1) * 100
+            selected.append((path_idx, spread, float(grid[0, best]), profit))
+
+            # the swaps of the order, hop by hop, into the shared copy
+            amount = grid[0, best] * unit
+            for i, pool_id in enumerate(pool_ids):
+                kernel = KERNELS[int(kinds[0, i])]
+                out = float(kernel(np.array([[amount]]), local[i:i + 1], zero_for_one[0, i:i + 1], fees[0, i:i + 1])[0, 0])
+                overlay[pool_id] = apply_swap(local[i], int(kinds[0, i]), bool(zero_for_one[0, i]), int(fees[0, i]), amount, out)
+                amount = out
+
+        return selected
@@ -84,6 +84,28 @@ class UniswapV3Simulator:
         fee_amount = int(amount_in * fee_pct)
         return int(amount_out - fee_amount)
 
+    def get_amount_out_in_range(self,
+                                amount_in: int,
+                                sqrt_price_x96: int,
+                                liquidity: int,
+                                fee: int,
+                                zero_for_one: bool) -> int:
+        """
+        Exact amount out of a swap that stays within the current tick range (no tick crossing),
+        as SqrtPriceMath computes it. fee is in hundredths of a bip (3000 is 0.3%).
+        """
+        if liquidity == 0 or sqrt_price_x96 == 0:
+            return 0
+        amount_in_less_fee = amount_in * (1000000 - fee) // 1000000
+        if zero_for_one:
+            # getNextSqrtPriceFromAmount0RoundingUp, then getAmount1Delta rounding down
+            numerator = liquidity * self.Q96
+            sqrt_price_next = -(-numerator * sqrt_price_x96 // (numerator + amount_in_less_fee * sqrt_price_x96))
+            return liquidity * (sqrt_price_x96 - sqrt_price_next) // self.Q96
+        # getNextSqrtPriceFromAmount1RoundingDown, then getAmount0Delta rounding down
+        sqrt_price_next = sqrt_price_x96 + amount_in_less_fee * self.Q96 // liquidity
+        return liquidity * self.Q96 * (sqrt_price_next - sqrt_price_x96) // sqrt_price_next // sqrt_price_x96
+
     def get_amount_in(self,
                       amount_out: float,
                       sqrt_ratio_current_x96: int,
@@ -185,7 +207,6 @@ if __name__ == '__main__':
     import os
     from dotenv import load_dotenv
     from web3 import Web3
-    import requests
     from poolsv3 import load_all_pools_from_v3
     from paths import generate_triangular_paths, simulate_v3_path
 
@@ -194,7 +215,6 @@ if __name__ == '__main__':
 
     load_dotenv(override=True)
 
-    response = requests.get('https://lively-restless-pond.matic.quiknode.pro/2b6686dcae197a1385f8497ae93d3cfaa79b5d04',  verify=False)
     HTTPS_URL = os.getenv('HTTPS_URL')
 
     # Example on Ethereum
@@ -0,0 +1,209 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from pools import Pool, DexVariant
+from poolsv3 import Poolv3
+from paths import ArbPath, PathTable
+from addresses import ADDRESSES
+from constants import logger
+
+# Warm-start snapshot of the strategy: pools, the path table with its pool -> path index,
+# the interned address ids and the last known reserves, with the block they are valid at.
+#
+# A snapshot is one file: an 8 bytes header length, a JSON header (meta, and the dtype,
+# shape and offset of every array), then the arrays, 64 bytes aligned. Loading maps the
+# arrays with np.memmap, so nothing is parsed or copied until used. Files are written
+# to a temporary file and renamed, so a reader never sees a partial snapshot.
+
+SNAPSHOT_VERSION = 4
+_ALIGN = 64
+_MASK_64 = (1 << 64) - 1
+_WORDS = 3  # 64 bits words per reserve value: V2 reserves are 112 bits, V3 sqrtPriceX96 160 bits
+
+# pool class of each DEX variant (pool_versions column)
+_POOL_TYPES = {
+    DexVariant.UniswapV2.value: Pool,
+    DexVariant.UniswapV3.value: Poolv3,
+}
+
+
+def snapshot_key(*config: Any) -> str:
+    """
+    Identifies the configuration (factories, base token, blacklist...) a snapshot was built for
+    """
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class Snapshot:
+
+    def __init__(self, meta: Dict[str, Any], arrays: Dict[str, np.ndarray]):
+        self.meta = meta
+        self.arrays = arrays
+
+    @property
+    def block_number(self) -> int:
+        return self.meta['block_number']
+
+    @property
+    def block_hash(self) -> str:
+        return self.meta['block_hash']
+
+    def save(self, path: str):
+        header = {'version': SNAPSHOT_VERSION, 'meta': self.meta, 'arrays': {}}
+        # offsets depend on the header length, reserve room for them first
+        offset = 0
+        for name, array in self.arrays.items():
+            header['arrays'][name] = [array.dtype.str, list(array.shape), offset]
+            offset += -(-array.nbytes // _ALIGN) * _ALIGN
+        encoded = json.dumps(header).encode()
+        base = -(-(8 + len(encoded) + 16 * len(self.arrays)) // _ALIGN) * _ALIGN
+        for entry in header['arrays'].values():
+            entry[2] += base
+        encoded = json.dumps(header).encode()
+        assert len(encoded) <= base - 8
+        encoded = encoded.ljust(base - 8)
+
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(len(encoded).to_bytes(8, 'little'))
+            f.write(encoded)
+            for name, array in self.arrays.items():
+                f.seek(header['arrays'][name][2])
+                f.write(np.ascontiguousarray(array).tobytes())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'Snapshot':
+        with open(path, 'rb') as f:
+            size = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(size))
+        if header['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f'Snapshot version {header["version"]}, expected {SNAPSHOT_VERSION}')
+        arrays = {}
+        for name, (dtype, shape, offset) in header['arrays'].items():
+            if np.prod(shape) == 0:
+                arrays[name] = np.zeros(shape, dtype=np.dtype(dtype))
+            else:
+                arrays[name] = np.memmap(path, dtype=np.dtype(dtype), mode='r', offset=offset, shape=tuple(shape))
+        return cls(header['meta'], arrays)
+
+    @classmethod
+    def take(cls,
+             key: str,
+             block_number: int,
+             block_hash: str,
+             pools: Dict[int, Union[Pool, Poolv3]],
+             table: PathTable,
+             reserves: Dict[int, List[int]]) -> 'Snapshot':
+        """
+        Copies the state to snapshot, cheap enough for the event loop, save() can then run in a thread.
+        Reserves (or sqrtPriceX96 and liquidity of V3 pools) are stored as 3 64 bits words each, low first.
+        """
+        pool_list = list(pools.values())
+        reserve_ids = np.fromiter(reserves.keys(), dtype=np.int32, count=len(reserves))
+        reserve_words = np.zeros((len(reserves), 2 * _WORDS), dtype=np.uint64)
+        for row, reserve in enumerate(reserves.values()):
+            reserve_words[row] = [(value >> (64 * i)) & _MASK_64 for value in reserve[:2] for i in range(_WORDS)]
+
+        arrays = {
+            'addresses': np.frombuffer(ADDRESSES.export(), dtype=np.uint8).reshape(-1, 20),
+            'pool_ids': np.array([pool.id for pool in pool_list], dtype=np.int32),
+            'pool_tokens': np.array([(pool.token0_id, pool.token1_id) for pool in pool_list], dtype=np.int32).reshape(-1, 2),
+            'pool_decimals': np.array([(pool.decimals0, pool.decimals1) for pool in pool_list], dtype=np.int8).reshape(-1, 2),
+            'pool_fees': np.array([pool.fee for pool in pool_list], dtype=np.int32),
+            'pool_versions': np.array([pool.version.value for pool in pool_list], dtype=np.int8),
+            'reserve_ids': reserve_ids,
+            'reserves': reserve_words,
+            **table.arrays(index=True),
+        }
+        meta = {'key': key, 'block_number': block_number, 'block_hash': block_hash}
+        return cls(meta, arrays)
+
+    def restore_addresses(self):
+        """
+        Interns the snapshot addresses, so ids in the process match the snapshot ones.
+        Call it before anything else interns addresses (pruner blacklist, base tokens...):
+        the registry must still be empty, or hold a prefix of the snapshot one.
+        """
+        ADDRESSES.restore(self.arrays['addresses'].tobytes())
+
+    def restore(self) -> Tuple[Dict[int, Union[Pool, Poolv3]], List[ArbPath], PathTable, Dict[int, List[int]]]:
+        """
+        Returns (pools by id, paths, path table, reserves by pool id),
+        the addresses are restored first if restore_addresses() was not called yet
+        """
+        self.restore_addresses()
+
+        pools = {}
+        for pool_id, (token0_id, token1_id), (decimals0, decimals1), fee, version in zip(
+                self.arrays['pool_ids'].tolist(),
+                self.arrays['pool_tokens'].tolist(),
+                self.arrays['pool_decimals'].tolist(),
+                self.arrays['pool_fees'].tolist(),
+                self.arrays['pool_versions'].tolist()):
+            pool_type = _POOL_TYPES[version]
+            pools[pool_id] = pool_type(address=ADDRESSES.address(pool_id),
+                                       version=DexVariant(version),
+                                       token0=ADDRESSES.address(token0_id),
+                                       token1=ADDRESSES.address(token1_id),
+                                       decimals0=decimals0,
+                                       decimals1=decimals1,
+                                       fee=fee)
+
+        table = PathTable.from_arrays(self.arrays)
+        paths = table_to_paths(table, pools)
+
+        reserves = {}
+        for pool_id, words in zip(self.arrays['reserve_ids'].tolist(), self.arrays['reserves'].tolist()):
+            reserves[pool_id] = [sum(word << (64 * i) for i, word in enumerate(words[j:j + _WORDS]))
+                                 for j in (0, _WORDS)]
+        return pools, paths, table, reserves
+
+
+def table_to_paths(table: PathTable, pools: Dict[int, Union[Pool, Poolv3]]) -> List[ArbPath]:
+    """
+    ArbPath objects of the rows of a path table
+    """
+    paths = []
+    for hop_pools, zero_for_one, fees in zip(table.pools.tolist(), table.zero_for_one.tolist(), table.fees.tolist()):
+        hops = []
+        for pool_id, z, fee in zip(hop_pools, zero_for_one, fees):
+            if pool_id < 0:
+                hops.append((None, None, None, 0))
+                continue
+            pool = pools[pool_id]
+            hops.append((pool, pool.token0 if z else pool.token1, pool.token1 if z else pool.token0, fee))
+        paths.append(ArbPath(pool_1=hops[0][0],
+                             pool_2=hops[1][0],
+                             pool_3=hops[2][0],
+                             token_in_1=hops[0][1],
+                             token_out_1=hops[0][2],
+                             token_in_2=hops[1][1],
+                             token_out_2=hops[1][2],
+                             token_in_3=hops[2][1],
+                             token_out_3=hops[2][2],
+                             fee_1=hops[0][3],
+                             fee_2=hops[1][3],
+                             fee_3=hops[2][3]))
+    return paths
+
+
+def load_snapshot(path: str, key: str) -> Optional[Snapshot]:
+    """
+    The snapshot at path if there is one for this configuration, else None
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        snapshot = Snapshot.load(path)
+    except (ValueError, KeyError, OSError) as e:
+        logger.warning(f'Unreadable snapshot {path}: {e}')
+        return None
+    if snapshot.meta.get('key') != key:
+        logger.info(f'Snapshot {path} was taken for another configuration, ignored')
+        return None
+    return snapshot
@@ -1,20 +1,35 @@
 import time
+import aiohttp
 import asyncio
 import threading
 import aioprocessing
 from web3 import Web3
+from web3.exceptions import TimeExhausted
 from functools import partial
 
 from pools import load_all_pools_from_v2
-from paths import generate_triangular_paths
+from paths import PathGraph, PathTable
 from multi import batch_get_uniswap_v2_reserves
 from utils import (
     reconnecting_websocket_loop,
-    get_touched_pool_reserves,
+    fetch_touched_pool_reserves,
+    fetch_pool_reserves_since,
 )
-from streams import stream_new_blocks
+from streams import stream_new_blocks, stream_new_pools
+from transport import make_event_queue
 from simulator import UniswapV2Simulator
-from bundler import Path, Bundler, Flashloan
+from gasmodel import GasModel
+from metrics import PIPELINE, serve_metrics
+from profiler import ProfilerControl
+from parallel import SimulationPool
+from pruning import PoolPruner
+from cycles import NegativeCycleDetector
+from pools import DexVariant
+from addresses import ADDRESSES
+from bundler import Bundler, Flashloan, path_key
+from snapshot import Snapshot, load_snapshot, snapshot_key
+from discovery import NewPoolTracker
+from selection import OrderSelector
 
 from constants import (
     HTTPS_URL,
@@ -22,62 +37,151 @@ from constants import (
     PRIVATE_KEY,
     SIGNING_KEY,
     BOT_ADDRESS,
+    GAS_MODEL_FILE,
+    METRICS_PORT,
+    PROFILE_DIR,
+    PROFILE_SOCKET,
+    PROFILE_SECONDS,
+    SNAPSHOT_FILE,
+    SNAPSHOT_INTERVAL,
+    SNAPSHOT_MAX_AGE,
+    PRUNE_MIN_RESERVE,
+    PRUNE_MAX_IDLE_BLOCKS,
+    PRUNE_INTERVAL,
+    POOL_HEADROOM,
+    PREFILTER_MIN_SPREAD,
+    SELECT_TOP_K,
+    SELECT_MAX_ORDERS,
     logger,
 )
 
 # change if needed, the token below is a placeholder
 blacklist_tokens = ['0x9469603F3Efbcf17e4A5868d81C701BDbD222555', '0x692597b009d13C4049a947CAB2239b7d6517875F']
 
+uniswap_v2_router = '0xd9e1cE17f2641f24aE83637ab66a2cca9C378B9F'
+balancer_vault = '0xBA12222222228d8Ba445958a75a0704d566BF2C8'
 
-async def event_handler(event_queue: aioprocessing.AioQueue):
-    w3 = Web3(Web3.HTTPProvider(HTTPS_URL))
+factory_addresses = [
+    '0x9e5A52f57b3038F1B8EeE45F28b3C1967e22799C',  # Uniswap V2 (Ethereum)
+]
+factory_blocks = [
+    49948178,
+]
 
-    factory_addresses = [
-        '0x9e5A52f57b3038F1B8EeE45F28b3C1967e22799C',  # Uniswap V2 (Ethereum)
-    ]
-    factory_blocks = [
-        49948178,
-    ]
 
-    # Retrieve all Sushiswap V2 pools
-    pools = load_all_pools_from_v2(HTTPS_URL,
-                                   factory_addresses,
-                                   factory_blocks,
-                                   50000)
+def to_swap_paths(path) -> list:
+    # hop directions come from the tokens of the path, as in the simulators
+    return path.to_path_params([uniswap_v2_router] * path.nhop)
 
-    logger.info(f'Initial pool count: {len(pools)}')
+
+async def event_handler(event_queue: aioprocessing.AioQueue):
+    w3 = Web3(Web3.HTTPProvider(HTTPS_URL))
 
     # Create triangular paths using USDT as the starting/ending token
     usdc_address = '0xc2132D05D31c914a87C6611C10748AEb04B58e8F'
     usdc_decimals = 6
 
-    paths = generate_triangular_paths(pools, usdc_address)
+    # paths also start from WMATIC, priced in USDT, all bases are generated in one pass
+    wmatic_address = '0x0d500B1d8E8eF31E21C99d1Db9A6444d3ADf1270'
+    base_tokens = [usdc_address, wmatic_address]
+
+    # warm start: paths, pools and reserves of the last snapshot, caught up to the head
+    key = snapshot_key(factory_addresses, base_tokens, blacklist_tokens)
+    snapshot = load_snapshot(SNAPSHOT_FILE, key)
+    if snapshot is not None and Web3.to_hex(w3.eth.get_block(snapshot.block_number)['hash']) != snapshot.block_hash:
+        logger.info(f'Snapshot block #{snapshot.block_number} was reorged, ignored')
+        snapshot = None
+    if snapshot is not None and w3.eth.block_number - snapshot.block_number > SNAPSHOT_MAX_AGE:
+        logger.info(f'Snapshot block #{snapshot.block_number} is too old, ignored')
+        snapshot = None
+    if snapshot is not None:
+        # the snapshot ids are restored before anything interns an address
+        snapshot.restore_addresses()
+
+    # dust, idle and blacklisted pools are left out of paths, simulation and multicalls
+    pruner = PoolPruner(blacklist_tokens=blacklist_tokens,
+                        min_reserve=PRUNE_MIN_RESERVE,
+                        min_reserves={usdc_address: 10},
+                        max_idle_blocks=PRUNE_MAX_IDLE_BLOCKS)
+
+    if snapshot is not None:
+        s = time.time()
+        pools, paths, table, reserves = snapshot.restore()
+        head = w3.eth.block_number
+        try:
+            reserves.update(await fetch_pool_reserves_since(HTTPS_URL,
+                                                            snapshot.block_number + 1,
+                                                            head,
+                                                            pools.keys(),
+                                                            v3=False))
+        except (RuntimeError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # ex. a provider limit on the range or size of eth_getLogs, the cold start still works
+            logger.warning(f'Catching up from snapshot block #{snapshot.block_number} failed, cold start: {e}')
+            snapshot = None
+        else:
+            logger.info(f'Warm start from block #{snapshot.block_number} to #{head}: '
+                        f'{len(paths)} paths / {len(pools)} pools, took: {time.time() - s} seconds')
+            # only the pools of the paths are in the snapshot, new pools are matched against those
+            graph = PathGraph(pools.values(), base_tokens)
+
+    if snapshot is None:
+        # Retrieve all Sushiswap V2 pools
+        pools = load_all_pools_from_v2(HTTPS_URL,
+                                       factory_addresses,
+                                       factory_blocks,
+                                       50000)
+
+        logger.info(f'Initial pool count: {len(pools)}')
+
+        pruner.evaluate(pools)
+        graph = PathGraph(pruner.keep(pools).values(), base_tokens)
+        paths = graph.paths()
+        logger.info(f'Generated {len(paths)} 3-hop arbitrage paths')
+
+        # Filter pools that were used in arb paths
+        pools = {}
+        for path in paths:
+            for pool in path.pools:
+                pools[pool.address] = pool
+
+        logger.info(f'New pool count: {len(pools)}')
+
+        # Send multicall request to retrieve all reserves data for the pools
+        s = time.time()
+        reserves = batch_get_uniswap_v2_reserves(HTTPS_URL, pools)
+        e = time.time()
+        logger.info(f'Batch reserves call took: {e - s} seconds')
+
+        # from here on, pools and reserves are keyed by pool id
+        pools = {pool.id: pool for pool in pools.values()}
+        reserves = {ADDRESSES.id(address): reserve for address, reserve in reserves.items()}
+        table = PathTable(paths)
+
+    sim = UniswapV2Simulator()
 
-    # Filter pools that were used in arb paths
-    pools = {}
-    for path in paths:
-        if not path.should_blacklist(blacklist_tokens):
-            pools[path.pool_1.address] = path.pool_1
-            pools[path.pool_2.address] = path.pool_2
-            pools[path.pool_3.address] = path.pool_3
+    # path simulation runs in worker processes reading reserves from shared memory
+    sim_pool = SimulationPool(table, reserves, headroom=POOL_HEADROOM)
 
-    logger.info(f'New pool count: {len(pools)}')
+    # reserves are known from here, paths through pools too shallow to trade are deactivated
+    pruner.observe([], w3.eth.block_number)
+    pruner.evaluate(pools, reserves)
+    sim_pool.set_active(pruner.active_paths(table))
+    logger.info(f'Pruning:\n{PoolPruner.format_report(pruner.report(table))}')
 
-    # Send multicall request to retrieve all reserves data for the pools
-    s = time.time()
-    reserves = batch_get_uniswap_v2_reserves(HTTPS_URL, pools)
-    e = time.time()
-    logger.info(f'Batch reserves call took: {e - s} seconds')
+    # profitable cycles of any start token among the watched pools, updated from the touched pools
+    cycle_detector = NegativeCycleDetector(pools.values(), max_hops=4)
+    cycle_detector.set_states(reserves)
+    base_ids = [ADDRESSES.id(token) for token in base_tokens]
+    wmatic_id = ADDRESSES.id(wmatic_address)
 
-    sim = UniswapV2Simulator()
+    usdc_weth_id = ADDRESSES.id('0x397FF1542f962076d0BFE58eA045FfA2d347ACa0')
 
     def _get_weth_price(_reserves: dict):
         """
         Retrieves the price of WMATIC in USDC
         """
-        usdc_weth_address = '0x397FF1542f962076d0BFE58eA045FfA2d347ACa0'
-        pool = pools[usdc_weth_address]
-        reserve = _reserves[usdc_weth_address]
+        pool = pools[usdc_weth_id]
+        reserve = _reserves[usdc_weth_id]
         price = sim.reserves_to_price(reserve[0],
                                       reserve[1],
                                       pool.decimals0,
@@ -87,62 +191,192 @@ async def event_handler(event_queue: aioprocessing.AioQueue):
 
     bundler = Bundler(PRIVATE_KEY, SIGNING_KEY, HTTPS_URL, BOT_ADDRESS)
 
+    # gas usage learned from our own orders, per (hop count, DEX, flashloan)
+    gas_model = GasModel(GAS_MODEL_FILE)
+
+    def _send_and_record(order_tx: dict, gas_key: tuple, trace):
+        raw_tx = bundler.sign_tx(order_tx)
+        trace.mark('signed')
+        tx_hash = bundler.send_raw_tx(raw_tx)
+        trace.mark('sent')
+        trace.finish()
+        try:
+            receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
+        except TimeExhausted:
+            # not mined, the usual fate of a lost arbitrage: nothing to learn from
+            logger.info(f'Order {Web3.to_hex(tx_hash)} not mined in 120 seconds')
+            return
+        gas_model.observe_receipt(gas_key, receipt)
+        gas_model.save()
+
+    async def _submit_and_record(order_txs: list, gas_keys: list, block_number: int, trace):
+        # several orders of a block go in one bundle, in the order they were simulated
+        bundle = bundler.to_bundle(*order_txs)
+        trace.mark('signed')
+        def _observe_simulation(simulation: dict):
+            for tx_index, gas_key in enumerate(gas_keys):
+                gas_model.observe_simulation(gas_key, simulation, tx_index)
+
+        receipts = await bundler.submit_bundle(bundle, 0, block_number, on_simulation=_observe_simulation)
+        trace.mark('sent')
+        trace.finish()
+        for gas_key, receipt in zip(gas_keys, receipts):
+            gas_model.observe_receipt(gas_key, receipt)
+        gas_model.save()
+
+    # access lists of traded and candidate paths, computed in the background (see the block loop),
+    # so order txs get them attached without an extra RPC call
+    asyncio.create_task(bundler.access_lists.run())
+    asyncio.create_task(pruner.run(pools, reserves, table, sim_pool.set_active, PRUNE_INTERVAL))
+
+    # per stage latency histograms on http://127.0.0.1:METRICS_PORT/metrics
+    await serve_metrics(PIPELINE, port=METRICS_PORT)
+
+    # on-demand sampling profile of this process and the simulation workers:
+    # kill -USR1 <pid> or 'profile <seconds>' on PROFILE_SOCKET
+    await ProfilerControl(str(PROFILE_DIR), sim_pool=sim_pool).serve(PROFILE_SOCKET, PROFILE_SECONDS)
+
+    loop = asyncio.get_event_loop()
+    session = aiohttp.ClientSession()
+    pool_ids = list(pools.keys())
+
+    # pools created while running: resolved and enumerated in the background,
+    # their paths are appended to the table here and simulated from the next block
+    new_pool_ids = []
+
+    def _on_new_pool(pool, new_paths, state):
+        pools[pool.id] = pool
+        pool_ids.append(pool.id)
+        reserves[pool.id] = state
+        new_pool_ids.append(pool.id)
+        cycle_detector.add_pool(pool)
+        if new_paths:
+            table.append(new_paths)
+            paths.extend(new_paths)
+
+    def _log_nonce_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f'Nonce reconcile failed: {future.exception()}')
+
+    def _base_amount_in(path_idx: int, amount_in: float) -> int:
+        # the flashloan is taken in the base token of the path, amount_in is in USDT
+        return int(amount_in / sim_pool.base_prices[path_idx] * 10 ** int(table.decimals_in[path_idx]))
+
+    # the orders of a block, re-simulated together on the pools they share
+    selector = OrderSelector(table, top_k=SELECT_TOP_K, max_orders=SELECT_MAX_ORDERS, max_amount_in=1000, step_size=10)
+
+    tracker = NewPoolTracker(HTTPS_URL, graph, _on_new_pool, accept=pruner.admits)
+    asyncio.create_task(tracker.run())
+
+    # first block whose touched reserves couldn't be fetched, None when up to date
+    missed_block = None
+
     while True:
         data = await event_queue.coro_get()
+        if data['type'] == 'new_pool':
+            tracker.submit(data)
+            continue
+
+        trace = PIPELINE.trace(data.get('received_ns'))
+        trace.mark('queued')
 
         block_number = data['block_number']
-        touched_reserves = get_touched_pool_reserves(w3, block_number)
-        touched_pools = []
-        for address, reserve in touched_reserves.items():
-            if address in reserves:
-                reserves[address] = reserve
-                touched_pools.append(address)
-
-        spreads = {}
-        for idx, path in enumerate(paths):
-            touched_path = sum([path.has_pool(pool) for pool in touched_pools]) >= 1
-            if touched_path:
-                try:
-                    # get the price quote by using 1 USDT as amount_in
-                    price_quote = path.simulate_v2_path(1, reserves)
-                    spread = (price_quote / 1000000 - 1) * 100
-                    if spread > 0:
-                        spreads[idx] = spread
-                except:
-                    continue
+
+        # reconcile the local nonce with the node off the event loop
+        loop.run_in_executor(None, bundler.nonces.on_block, block_number).add_done_callback(_log_nonce_failure)
+        await bundler.submitter.on_new_head(block_number)
+
+        try:
+            touched_reserves = await fetch_touched_pool_reserves(HTTPS_URL,
+                                                                 data['block_hash'],
+                                                                 pool_ids,
+                                                                 session,
+                                                                 v3=False)
+            if missed_block is not None:
+                # reserves of the blocks skipped since, older logs first so the touched block wins
+                touched_reserves = {**await fetch_pool_reserves_since(HTTPS_URL,
+                                                                      missed_block,
+                                                                      block_number - 1,
+                                                                      pool_ids,
+                                                                      session,
+                                                                      v3=False),
+                                    **touched_reserves}
+                missed_block = None
+        except RuntimeError as e:
+            # the reserves of this block are unknown, caught up from its logs on the next block
+            logger.warning(f'Block #{block_number} skipped: {e}')
+            if missed_block is None:
+                missed_block = block_number
+            continue
+        for pool_id, reserve in touched_reserves.items():
+            if pool_id in reserves:
+                reserves[pool_id] = reserve
+        if new_pool_ids:
+            # new pools count as touched, their paths are evaluated on this block
+            sim_pool.extend(reserves)
+            touched_reserves = {**{pool_id: reserves[pool_id] for pool_id in new_pool_ids}, **touched_reserves}
+            new_pool_ids.clear()
+        touched_pool_ids = sim_pool.update(touched_reserves)
+        pruner.observe(touched_pool_ids, block_number)
+        trace.mark('touched_pools')
+
+        # amounts are in USDT whatever the base: spreads use 1 USDT worth of the base as amount_in,
+        # amount_in is optimized up to 1000 USDT by 10 USDT
+        sim_pool.set_base_prices({wmatic_id: _get_weth_price(reserves)})
+        # only paths with a marginal spread after fee above PREFILTER_MIN_SPREAD are simulated
+        candidates = await sim_pool.evaluate(touched_pool_ids, 1000, 10, top_k=SELECT_TOP_K,
+                                             min_spread=PREFILTER_MIN_SPREAD)
+        candidates = [candidate for candidate in candidates if candidate[1] > 0]
+        trace.mark('evaluated')
+
+        # access lists of the paths with a spread, ready if one turns into an order on a later block
+        for path_idx, _, amount_in, _ in candidates:
+            swap_paths = to_swap_paths(paths[path_idx])
+            key = path_key(swap_paths)
+            if bundler.access_lists.get(key) is None:
+                bundler.access_lists.request(key, bundler.order_call(swap_paths,
+                                                                     _base_amount_in(path_idx, amount_in),
+                                                                     Flashloan.Balancer,
+                                                                     balancer_vault))
+        PIPELINE.record('prefiltered', sim_pool.last_timings['prefilter'] // 1000)
+        PIPELINE.record('simulated', sim_pool.last_timings['simulate'] // 1000)
+        PIPELINE.record('optimized', sim_pool.last_timings['optimize'] // 1000)
+
+        cycles = cycle_detector.set_states(touched_reserves)
+        trace.mark('cycles')
+        if cycles:
+            elsewhere = [cycle for cycle in cycles if not any(base in cycle.tokens for base in base_ids)]
+            logger.info(f'Block #{block_number}: {len(cycles)} cycles, {len(elsewhere)} through no base token, '
+                        f'best: {cycles[0]}')
 
         # calculated estimated cost of bet
         weth_price = _get_weth_price(reserves)
         base_fee = int(data['next_base_fee'] * 1.1)
-        gas_cost_in_weth = (base_fee * 550000) / 10 ** 18  # estimated gas usage for 3-hop swap + flashloan
-        gas_cost = weth_price * gas_cost_in_weth
 
-        sorted_spreads = sorted(spreads.items(), key=lambda x: x[1], reverse=True)[:1]
-        print(f'Block #{block_number}: {sorted_spreads}')
+        def _gas_cost(path_idx: int) -> float:
+            gas_key = GasModel.key(paths[path_idx].nhop, DexVariant.UniswapV2, Flashloan.Balancer)
+            return weth_price * (base_fee * gas_model.expected(gas_key)) / 10 ** 18
+
+        print(f'Block #{block_number}: {[(c[0], c[1]) for c in candidates]}')
+
+        # the candidates worth sending together, each priced after the ones before it
+        candidates = selector.select(candidates, sim_pool.reserves, sim_pool.base_prices, cost=_gas_cost)
+        trace.mark('selected')
 
-        for spread in sorted_spreads:
-            path_idx = spread[0]
+        order_txs, gas_keys = [], []
+        for path_idx, spread, amount_in, expected_profit in candidates:
             path = paths[path_idx]
-            amount_in, expected_profit = path.optimize_amount_in(1000, 10, reserves)
+            gas_key = GasModel.key(path.nhop, DexVariant.UniswapV2, Flashloan.Balancer)
+            gas_cost = _gas_cost(path_idx)
+            amount_in = int(amount_in)
+            base_amount_in = _base_amount_in(path_idx, amount_in)
             excess_profit = expected_profit - gas_cost
             print(f'Spread found: {spread}. Amount in: {amount_in} / Expected profit: {expected_profit} / Gas cost: {gas_cost}')
 
             if excess_profit > 0:
-                uniswap_v2_router = '0xd9e1cE17f2641f24aE83637ab66a2cca9C378B9F'
-                balancer_vault = '0xBA12222222228d8Ba445958a75a0704d566BF2C8'
-
-                swap_paths = []
-
-                for i in range(path.nhop):
-                    pool = getattr(path, f'pool_{i + 1}')
-                    zero_for_one = getattr(path, f'zero_for_one_{i + 1}')
-                    if zero_for_one:
-                        token_in, token_out = pool.token0, pool.token1
-                    else:
-                        token_in, token_out = pool.token1, pool.token0
-                    swap_path = Path(uniswap_v2_router, token_in, token_out)
-                    swap_paths.append(swap_path)
-                    print(f'- {i} {token_in} --> {token_out}')
+                swap_paths = to_swap_paths(path)
+                for i, swap_path in enumerate(swap_paths):
+                    print(f'- {i} {swap_path.token_in} --> {swap_path.token_out}')
 
                 # base_fee = data['next_base_fee']
                 # profit_in_wmatic = (excess_profit / wmatic_price) * (10 ** 18)
@@ -152,20 +386,34 @@ async def event_handler(event_queue: aioprocessing.AioQueue):
                 # print(f'max_priority_fee_per_gas: {max_priority_fee_per_gas / 10 ** 18}')
                 # print(f'max_fee_per_gas: {max_fee_per_gas / 10 ** 18}')
 
-                order_tx = bundler.order_tx(swap_paths,
-                                            amount_in * 10 ** usdc_decimals,
-                                            data['max_priority_fee_per_gas'] * 3,
-                                            data['max_fee_per_gas'] * 4,
-                                            Flashloan.Balancer,
-                                            balancer_vault)
-
-                t = threading.Thread(target=bundler.send_tx, args=(order_tx,))
-                t.start()
+                order_tx = bundler.templated_order_tx(bundler.order_template(swap_paths),
+                                                      base_amount_in,
+                                                      data['max_priority_fee_per_gas'] * 3,
+                                                      data['max_fee_per_gas'] * 4,
+                                                      Flashloan.Balancer,
+                                                      balancer_vault,
+                                                      gas_model.limit(gas_key))
+                order_txs.append(order_tx)
+                gas_keys.append(gas_key)
                 # tx_hash = bundler.send_tx(order_tx)
                 # print(f'Block #{block_number}: {tx_hash}')
                 print(order_tx)
                 print('\n')
 
+        if order_txs:
+            order_trace = trace.fork()
+            order_trace.mark('tx_built')
+            if len(order_txs) == 1:
+                t = threading.Thread(target=_send_and_record, args=(order_txs[0], gas_keys[0], order_trace))
+                t.start()
+            else:
+                asyncio.create_task(_submit_and_record(order_txs, gas_keys, block_number, order_trace))
+
+        # state is copied here, written to disk off the event loop
+        if block_number % SNAPSHOT_INTERVAL == 0:
+            snapshot = Snapshot.take(key, block_number, data['block_hash'], pools, table, reserves)
+            loop.run_in_executor(None, snapshot.save, str(SNAPSHOT_FILE))
+
 
 def main():
     """
@@ -173,18 +421,25 @@ def main():
     """
     logger.info('Starting strategy')
 
-    event_queue = aioprocessing.AioQueue()
+    # streams and the handler share this process, no need to serialize events
+    event_queue = make_event_queue('local')
 
     new_blocks_stream = reconnecting_websocket_loop(
         partial(stream_new_blocks, WSS_URL, event_queue, False, 'polygon'),
         tag='new_blocks_stream'
     )
 
+    new_pools_stream = reconnecting_websocket_loop(
+        partial(stream_new_pools, WSS_URL, factory_addresses, event_queue, False),
+        tag='new_pools_stream'
+    )
+
     event_handler_loop = event_handler(event_queue)
 
     loop = asyncio.get_event_loop()
     loop.run_until_complete(asyncio.wait([
         new_blocks_stream,
+        new_pools_stream,
         event_handler_loop,
     ]))
 
@@ -1,4 +1,5 @@
 import json
+import time
 import eth_abi
 import asyncio
 import eth_utils
@@ -10,8 +11,15 @@ from loguru import logger
 from typing import Dict, List
 
 from pools import Pool, DexVariant
+from addresses import ADDRESSES
 from multi import get_uniswap_v2_reserves
-from utils import calculate_next_block_base_fee, estimated_next_block_gas
+from utils import (
+    calculate_next_block_base_fee,
+    estimated_next_block_gas,
+    decode_pool_created_log,
+    PAIR_CREATED_EVENT_SELECTOR,
+    POOL_CREATED_EVENT_SELECTOR,
+)
 
 
 async def stream_new_blocks(wss_url: str,
@@ -28,6 +36,8 @@ async def stream_new_blocks(wss_url: str,
         while True:
             try:
                 msg = await asyncio.wait_for(ws.recv(), timeout=60 * 10)
+                # start of the latency trace of this block (see metrics.LatencyTracker)
+                received_ns = time.monotonic_ns()
                 block = json.loads(msg)['params']['result']
                 block_number = int(block['number'], base=16)
                 base_fee = int(block['baseFeePerGas'], base=16)
@@ -36,8 +46,10 @@ async def stream_new_blocks(wss_url: str,
                 event = {
                     'type': 'block',
                     'block_number': block_number,
+                    'block_hash': block['hash'],
                     'base_fee': base_fee,
                     'next_base_fee': next_base_fee,
+                    'received_ns': received_ns,
                     **estimate_gas,
                 }
                 if not debug:
@@ -73,6 +85,36 @@ async def stream_pending_transactions(wss_url: str,
                 print(event)
 
 
+async def stream_new_pools(wss_url: str,
+                           factory_addresses: List[str],
+                           event_queue: aioprocessing.AioQueue,
+                           debug: bool = False):
+    """
+    Streams the pools created by the factories (V2 PairCreated, V3 PoolCreated) as new_pool events.
+    Only decodes the logs, token decimals are resolved by the consumer off the hot path.
+    """
+    async with websockets.connect(wss_url) as ws:
+        wss = Web3.WebsocketProvider(wss_url)
+        params = ['logs', {
+            'address': factory_addresses,
+            'topics': [[PAIR_CREATED_EVENT_SELECTOR, POOL_CREATED_EVENT_SELECTOR]],
+        }]
+        subscription = wss.encode_rpc_request('eth_subscribe', params)
+
+        await ws.send(subscription)
+        _ = await ws.recv()
+
+        while True:
+            msg = await asyncio.wait_for(ws.recv(), timeout=60 * 60)
+            event = decode_pool_created_log(json.loads(msg)['params']['result'])
+            if event is None:
+                continue
+            if not debug:
+                event_queue.put(event)
+            else:
+                logger.info(event)
+
+
 async def stream_uniswap_v2_events(https_url: str,
                                    wss_url: str,
                                    pools: Dict[str, Pool],
@@ -83,10 +125,13 @@ async def stream_uniswap_v2_events(https_url: str,
 
     block_number = w3.eth.get_block_number()
 
-    reserves = get_uniswap_v2_reserves(w3, pools)
+    reserves = {
+        ADDRESSES.id(address): reserve
+        for address, reserve in get_uniswap_v2_reserves(w3, pools).items()
+    }
 
     pools = {
-        addr.lower(): pool for addr, pool in pools.items()
+        pool.id: pool for pool in pools.values()
         if pool.version == DexVariant.UniswapV2
     }
 
@@ -96,19 +141,15 @@ async def stream_uniswap_v2_events(https_url: str,
 
         if len(data) == 2:
             # initial publishing occurs without data(=Sync event data)
-            reserves[pool.address][0] = data[0]
-            reserves[pool.address][1] = data[1]
-
-        reserve_update = {
-            pool.token0: reserves[pool.address][0],
-            pool.token1: reserves[pool.address][1],
-        }
+            reserves[pool.id][0] = data[0]
+            reserves[pool.id][1] = data[1]
 
+        # [reserve0, reserve1], the same layout as transport.POOL_UPDATE_LAYOUT
         pool_update = {
             'type': 'pool_update',
             'block_number': block_number,
             'pool': pool.address,
-            'reserves': reserve_update,
+            'reserves': [reserves[pool.id][0], reserves[pool.id][1]],
         }
 
         if not debug:
@@ -119,7 +160,7 @@ async def stream_uniswap_v2_events(https_url: str,
     """
     Send initial reserve data so that price can be calculated even if the pool is idle
     """
-    for address, pool in pools.items():
+    for pool in pools.values():
         _publish(block_number, pool)
 
     # Subscribe to Sync events from all the pools we input
@@ -136,11 +177,11 @@ async def stream_uniswap_v2_events(https_url: str,
         while True:
             msg = await asyncio.wait_for(ws.recv(), timeout=60 * 10)
             event = json.loads(msg)['params']['result']
-            address = event['address'].lower()
+            pool_id = ADDRESSES.get(event['address'])
 
-            if address in pools:
+            if pool_id in pools:
                 block_number = int(event['blockNumber'], base=16)
-                pool = pools[address]
+                pool = pools[pool_id]
                 data = eth_abi.decode(
                     ['uint112', 'uint112'],
                     eth_utils.decode_hex(event['data'])
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules live flat in python/, as the strategies import them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
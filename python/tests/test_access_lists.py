@@ -0,0 +1,117 @@
+import time
+import asyncio
+import aiohttp
+import pytest
+
+from aiohttp import web
+
+from utils import AccessListCache, get_access_list
+
+ACCESS_LIST = [{'address': '0x0d500B1d8E8eF31E21C99d1Db9A6444d3ADf1270', 'storageKeys': []}]
+
+
+class _Node:
+    """
+    Answers eth_createAccessList by the tx data: '0x01' reverts, '0x02' is a JSON-RPC error
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        req = await request.json()
+        data = req['params'][0]['data']
+        self.calls.append(data)
+        res = {'id': req['id'], 'jsonrpc': '2.0'}
+        if data == '0x01':
+            res['result'] = {'accessList': ACCESS_LIST[:0], 'gasUsed': '0x5208', 'error': 'execution reverted'}
+        elif data == '0x02':
+            res['error'] = {'code': -32000, 'message': 'header not found'}
+        else:
+            res['result'] = {'accessList': ACCESS_LIST, 'gasUsed': '0x5208'}
+        return web.json_response(res)
+
+
+async def _with_node(fn):
+    node = _Node()
+    app = web.Application()
+    app.router.add_post('/', node.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    try:
+        async with aiohttp.ClientSession() as session:
+            return await fn(f'http://127.0.0.1:{runner.addresses[0][1]}', session, node)
+    finally:
+        await runner.cleanup()
+
+
+def _tx(data: str) -> dict:
+    return {'from': '0x0000000000000000000000000000000000000001', 'to': '0x0000000000000000000000000000000000000002',
+            'data': data}
+
+
+def test_get_access_list_raises_on_errors_and_reverts():
+    async def run(url, session, _):
+        assert await get_access_list(_tx('0xaa'), url, session) == ACCESS_LIST
+        for data in ('0x01', '0x02'):
+            with pytest.raises(RuntimeError):
+                await get_access_list(_tx(data), url, session)
+
+    asyncio.run(_with_node(run))
+
+
+def test_reverted_calls_are_not_cached():
+    async def run(url, session, _):
+        cache = AccessListCache(url)
+        cache.request(('ok',), _tx('0xaa'))
+        cache.request(('reverts',), _tx('0x01'))
+        cache.request(('error',), _tx('0x02'))
+        await cache.step(session)
+        return cache
+
+    cache = asyncio.run(_with_node(run))
+    assert cache.get(('ok',)) == ACCESS_LIST
+    assert cache.get(('reverts',)) is None
+    assert cache.get(('error',)) is None
+
+
+def test_least_recently_used_entries_are_evicted():
+    async def run(url, session, _):
+        cache = AccessListCache(url, max_entries=2)
+        await cache.warm({('a',): _tx('0xaa'), ('b',): _tx('0xbb')}, session)
+        cache.get(('a',))
+        await cache.warm({('c',): _tx('0xcc')}, session)
+        return cache
+
+    cache = asyncio.run(_with_node(run))
+    assert len(cache) == 2
+    assert cache.get(('b',)) is None
+    assert cache.get(('a',)) is not None and cache.get(('c',)) is not None
+
+
+def test_stale_entries_are_refreshed_a_batch_at_a_time_after_requests():
+    async def run(url, session, node):
+        cache = AccessListCache(url, refresh_interval=60.0, refresh_batch=2)
+        await cache.warm({(i,): _tx(hex(0x10 + i)) for i in range(5)}, session)
+        # the first three age past the refresh interval
+        for key in [(0,), (1,), (2,)]:
+            cache._fetched[key] = time.monotonic() - 120
+        node.calls.clear()
+
+        cache.request(('new',), _tx('0xaa'))
+        await cache.step(session)
+        first = list(node.calls)
+        node.calls.clear()
+        await cache.step(session)
+        second = list(node.calls)
+        node.calls.clear()
+        await cache.step(session)
+        return first, second, list(node.calls)
+
+    first, second, third = asyncio.run(_with_node(run))
+    # the request is served first, then the oldest two stale entries, then the last one
+    assert first[0] == '0xaa' and sorted(first[1:]) == ['0x10', '0x11']
+    assert second == ['0x12']
+    assert third == []
@@ -0,0 +1,96 @@
+import math
+import random
+
+from cycles import NegativeCycleDetector, edge_weights
+from pools import DexVariant, Pool
+
+from test_paths import _triangle
+
+E = 10 ** 18
+
+
+def _fresh(pools, states):
+    detector = NegativeCycleDetector(pools)
+    return detector.set_states(states)
+
+
+def _summary(cycles):
+    return {cycle.edges: round(cycle.log_profit, 9) for cycle in cycles}
+
+
+def _states(pools, c):
+    # USDC -> WETH at 0.001, WETH -> WMATIC at 2000, WMATIC -> USDC at c[1] / c[0]
+    usdc_weth, wmatic_weth, wmatic_usdc = pools
+    return {usdc_weth.id: [1000 * E, 1 * E], wmatic_weth.id: [2000 * E, 1 * E], wmatic_usdc.id: c}
+
+
+def test_finds_a_profitable_triangle():
+    pools = _triangle()
+    detector = NegativeCycleDetector(pools)
+    cycles = detector.set_states(_states(pools, [2000 * E, 1050 * E]))
+
+    assert len(cycles) == 1
+    cycle = cycles[0]
+    assert cycle.nhop == 3
+    assert math.isclose(cycle.log_profit, math.log(1.05) + 3 * math.log(0.997), rel_tol=1e-9)
+    # USDC -> WETH -> WMATIC -> USDC, whichever token it was closed from
+    hops = dict(zip(cycle.tokens, zip(cycle.pool_ids, cycle.zero_for_one)))
+    usdc_weth, wmatic_weth, wmatic_usdc = pools
+    assert hops[usdc_weth.token0_id] == (usdc_weth.id, True)
+    assert hops[wmatic_weth.token1_id] == (wmatic_weth.id, False)
+    assert hops[wmatic_usdc.token0_id] == (wmatic_usdc.id, True)
+
+
+def test_incremental_updates_match_a_full_pass():
+    pools = _triangle()
+    detector = NegativeCycleDetector(pools)
+    states = _states(pools, [2000 * E, 1050 * E])
+    detector.set_states(states)
+
+    # one pool moves: the cycle shrinks, disappears, turns the other way round, comes back
+    for c in ([2000 * E, 1040 * E], [2000 * E, 1000 * E], [2000 * E, 900 * E], [2000 * E, 1100 * E]):
+        states = _states(pools, c)
+        cycles = detector.set_states({pools[2].id: c})
+        assert _summary(cycles) == _summary(_fresh(pools, states))
+
+    assert _summary(detector.set_states({pools[2].id: [2000 * E, 1000 * E]})) == {}
+
+
+def test_incremental_updates_only_report_cycles_of_the_current_state():
+    # cycles are closed along the shortest path tree, so on a larger market an incremental pass can
+    # report other cycles than a full pass: each one must still be a cycle of the current state
+    rng = random.Random(7)
+    tokens = [f'0x{i:040x}' for i in range(1, 7)]
+    pools = []
+    for i, (token0, token1) in enumerate((a, b) for a in tokens for b in tokens if a < b):
+        pools.append(Pool(address=f'0x{0x1000 + i:040x}', version=DexVariant.UniswapV2,
+                          token0=token0, token1=token1, decimals0=18, decimals1=18, fee=300))
+    # consistent prices, then noise on a few pools opens cycles of 2 to 4 hops
+    prices = {token: rng.uniform(0.5, 2) for token in tokens}
+
+    def state(pool, noise):
+        return [int(1000 * E * prices[pool.token1] * noise), int(1000 * E * prices[pool.token0])]
+
+    states = {pool.id: state(pool, 1.0) for pool in pools}
+    detector = NegativeCycleDetector(pools, max_hops=4)
+    assert detector.set_states(states) == []
+
+    found = 0
+    for _ in range(30):
+        updates = {pool.id: state(pool, rng.uniform(0.97, 1.03)) for pool in rng.sample(pools, 3)}
+        states.update(updates)
+        cycles = detector.set_states(updates)
+        found += len(cycles)
+        for cycle in cycles:
+            assert 2 <= cycle.nhop <= 4
+            log_rates = []
+            for pool_id, zero_for_one, token_in, token_out in zip(cycle.pool_ids, cycle.zero_for_one,
+                                                                  cycle.tokens, cycle.tokens[1:] + cycle.tokens[:1]):
+                pool = detector.pools[pool_id]
+                assert (token_in, token_out) == ((pool.token0_id, pool.token1_id) if zero_for_one
+                                                 else (pool.token1_id, pool.token0_id))
+                weights = edge_weights(pool, states[pool_id])
+                log_rates.append(-(weights[0] if zero_for_one else weights[1]))
+            assert math.isclose(cycle.log_profit, sum(log_rates), abs_tol=1e-9)
+            assert cycle.log_profit > 0
+    assert found
@@ -0,0 +1,97 @@
+import asyncio
+
+from aiohttp import web
+
+from discovery import NewPoolTracker
+from paths import PathGraph
+from pools import DexVariant, Pool
+from utils import DECIMALS_SELECTOR, GET_RESERVES_SELECTOR, SLOT0_SELECTOR, LIQUIDITY_SELECTOR
+
+USDC = '0x2791Bca1f2de4661ED88A30C99A7a9449Aa84174'
+WETH = '0x7ceB23fD6bC0adD59E62ac25578270cFf1b9f619'
+WMATIC = '0x0d500B1d8E8eF31E21C99d1Db9A6444d3ADf1270'
+NEW_POOL = '0x6e7a5FAFcec6BB1e78bAE2A1F0B612012BF14827'
+
+
+def _word(value: int) -> str:
+    return value.to_bytes(32, 'big', signed=value < 0).hex()
+
+
+class _Node:
+    """
+    A node whose pools logged nothing in their creation block, answering
+    decimals(), getReserves(), slot0() and liquidity() calls
+    """
+
+    def __init__(self):
+        self.methods = []
+
+    def _result(self, method: str, params: list):
+        self.methods.append(method)
+        if method == 'eth_getLogs':
+            return []
+        data = params[0]['data']
+        if data == DECIMALS_SELECTOR:
+            return '0x' + _word(18)
+        if data == GET_RESERVES_SELECTOR:
+            return '0x' + _word(1000) + _word(2000) + _word(1700000000)
+        if data == SLOT0_SELECTOR:
+            return '0x' + _word(1 << 96) + _word(-10) + _word(0) * 5
+        if data == LIQUIDITY_SELECTOR:
+            return '0x' + _word(5000)
+        raise ValueError(data)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        requests = body if isinstance(body, list) else [body]
+        responses = [{'id': req['id'], 'jsonrpc': '2.0', 'result': self._result(req['method'], req['params'])}
+                     for req in requests]
+        return web.json_response(responses if isinstance(body, list) else responses[0])
+
+
+async def _discover(event: dict):
+    node = _Node()
+    app = web.Application()
+    app.router.add_post('/', node.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = f'http://127.0.0.1:{runner.addresses[0][1]}'
+
+    graph = PathGraph([
+        Pool(address='0x853Ee4b2A13f8a742d64C8F088bE7bA2131f670d', version=DexVariant.UniswapV2,
+             token0=USDC, token1=WETH, decimals0=18, decimals1=18, fee=300),
+        Pool(address='0xadbF1854e5883eB8aa7BAf50705338739e558E5b', version=DexVariant.UniswapV2,
+             token0=WMATIC, token1=WETH, decimals0=18, decimals1=18, fee=300),
+    ], [USDC])
+    accepted = asyncio.Queue()
+    tracker = NewPoolTracker(url, graph, lambda *args: accepted.put_nowait(args), cache=False)
+    task = asyncio.ensure_future(tracker.run())
+    tracker.submit(event)
+    try:
+        return await asyncio.wait_for(accepted.get(), timeout=5), node
+    finally:
+        task.cancel()
+        await runner.cleanup()
+
+
+def _event(version: int, fee: int) -> dict:
+    return {'type': 'new_pool', 'block_number': 100, 'pool': NEW_POOL,
+            'token0': WMATIC, 'token1': USDC, 'fee': fee, 'version': version}
+
+
+def test_new_v2_pool_gets_its_current_reserves():
+    (pool, paths, state), node = asyncio.run(_discover(_event(2, 300)))
+
+    assert pool.address == NEW_POOL
+    assert len(paths) == 2
+    assert state == [1000, 2000]
+    assert node.methods.count('eth_getLogs') == 1
+
+
+def test_new_v3_pool_gets_its_current_slot0_and_liquidity():
+    (pool, paths, state), _ = asyncio.run(_discover(_event(3, 500)))
+
+    assert pool.version.value == 3
+    assert state == [1 << 96, 5000, -10]
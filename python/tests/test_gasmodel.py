@@ -0,0 +1,41 @@
+from gasmodel import GasModel
+from orders import Flashloan
+from pools import DexVariant
+
+KEY = GasModel.key(3, DexVariant.UniswapV2, Flashloan.Balancer)
+
+
+def test_reverted_receipts_are_not_samples():
+    model = GasModel(min_samples=1)
+    model.observe_receipt(KEY, {'gasUsed': hex(40000), 'status': '0x0'})
+    assert model.expected(KEY) == model.default_expected
+
+    model.observe_receipt(KEY, {'gasUsed': hex(300000), 'status': '0x1'})
+    assert model.expected(KEY) == 300000
+
+
+def test_simulations_are_samples_unless_reverted():
+    model = GasModel(min_samples=1)
+    simulation = {'results': [
+        {'txHash': '0x01', 'gasUsed': 250000},
+        {'txHash': '0x02', 'gasUsed': 30000, 'error': 'execution reverted', 'revert': ''},
+    ]}
+    model.observe_simulation(KEY, simulation, 1)
+    assert model.expected(KEY) == model.default_expected
+
+    model.observe_simulation(KEY, simulation, 0)
+    assert model.expected(KEY) == 250000
+
+
+def test_save_replaces_the_file(tmp_path):
+    path = str(tmp_path / 'gas.json')
+    model = GasModel(min_samples=1)
+    model.observe(KEY, 300000)
+    model.save(path)
+    model.observe(KEY, 300000)
+    model.save(path)
+    assert [p.name for p in tmp_path.iterdir()] == ['gas.json']
+
+    restored = GasModel(min_samples=1)
+    restored.load(path)
+    assert restored.expected(KEY) == 300000
@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+from nonce import NonceManager, is_nonce_error
+
+SENDER = '0x0000000000000000000000000000000000000001'
+
+
+class _Node:
+    """
+    The pending transaction count of the sender, as eth_getTransactionCount answers it
+    """
+
+    def __init__(self, count: int):
+        self.count = count
+        self.calls = 0
+        self.eth = SimpleNamespace(get_transaction_count=self.get_transaction_count)
+
+    def get_transaction_count(self, address: str, block_identifier: str = 'pending') -> int:
+        self.calls += 1
+        return self.count
+
+
+def test_nonces_are_loaded_once_and_issued_locally():
+    node = _Node(7)
+    nonces = NonceManager(node, SENDER)
+
+    assert [nonces.next() for _ in range(3)] == [7, 8, 9]
+    assert node.calls == 1
+    assert nonces.peek() == 10
+
+
+def test_sync_takes_the_node_count_after_a_nonce_error():
+    node = _Node(7)
+    nonces = NonceManager(node, SENDER)
+    nonces.next()
+
+    node.count = 12
+    assert is_nonce_error(ValueError({'message': 'nonce too low: next nonce 12, tx nonce 8'}))
+    assert nonces.sync() == 12
+    assert nonces.next() == 12
+
+
+def test_external_transactions_move_the_nonce_forward():
+    node = _Node(7)
+    nonces = NonceManager(node, SENDER)
+    nonces.on_block(100)
+    nonces.next()
+
+    # two txs sent from the same account by something else
+    node.count = 10
+    assert nonces.on_block(101) == 10
+    assert nonces.next() == 10
+
+
+def test_unused_nonces_are_reclaimed_after_a_quiet_block():
+    node = _Node(7)
+    nonces = NonceManager(node, SENDER)
+    nonces.on_block(100)
+    assert [nonces.next(), nonces.next()] == [7, 8]  # bundles that never landed
+
+    # issued during the last block, they may still land
+    assert nonces.on_block(101) == 9
+    # a full block without building anything, the gap is reclaimed
+    assert nonces.on_block(102) == 7
+    assert nonces.next() == 7
+
+
+def test_stale_blocks_are_ignored():
+    node = _Node(7)
+    nonces = NonceManager(node, SENDER)
+    nonces.on_block(100)
+    nonces.next()
+    nonces.on_block(101)
+
+    # a reconcile of block #99 finishing late doesn't rewind the block, nor reclaim the nonce in use
+    assert nonces.on_block(99) == 8
+    assert nonces._block_number == 101
+    assert nonces.on_block(101) == 8
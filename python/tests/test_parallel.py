@@ -0,0 +1,84 @@
+import math
+import asyncio
+import numpy as np
+
+from parallel import SimulationPool
+from paths import PathGraph, PathTable
+from pools import DexVariant
+from poolsv3 import Poolv3
+
+from test_paths import USDC, WETH, WMATIC, _pool, _triangle
+
+DAI = '0x8f3Cf7ad23Cd3CaDbD9735AFf958023239c6A063'
+E = 10 ** 18
+
+
+def _sim_pool(headroom: int = 0):
+    pools = _triangle()
+    paths = PathGraph(pools, [USDC]).paths()
+    reserves = {pool.id: [10 ** 24, 2 * 10 ** 24] for pool in pools}
+    return SimulationPool(PathTable(paths), reserves, workers=1, headroom=headroom), paths, reserves
+
+
+def test_active_mask_is_applied_between_evaluations():
+    sim_pool, _, reserves = _sim_pool()
+    try:
+        sim_pool.set_active(np.array([False, True]))
+        # nothing changes while an evaluation may be reading the table
+        assert sim_pool.active[:2].tolist() == [True, True]
+        sim_pool.update({})
+        assert sim_pool.active[:2].tolist() == [False, True]
+    finally:
+        sim_pool.close()
+
+
+def test_mask_of_paths_not_picked_up_yet_is_merged_by_extend():
+    for headroom in (4, 0):  # new paths written into the headroom, or reallocated
+        sim_pool, paths, reserves = _sim_pool(headroom)
+        try:
+            sim_pool.table.append(paths)
+            # built from the live table, longer than the paths of the pool
+            sim_pool.set_active(np.array([True, False, False, True]))
+            sim_pool.update({})
+            assert sim_pool.n == 2
+            assert sim_pool.active[:2].tolist() == [True, False]
+
+            sim_pool.extend(reserves)
+            assert sim_pool.n == 4
+            assert sim_pool.active[:4].tolist() == [True, False, False, True]
+        finally:
+            sim_pool.close()
+
+
+def test_prefilter_keeps_the_paths_the_simulation_finds_profitable():
+    pools = [
+        _pool('0x853Ee4b2A13f8a742d64C8F088bE7bA2131f670d', USDC, WETH),
+        _pool('0xadbF1854e5883eB8aa7BAf50705338739e558E5b', WMATIC, WETH),
+        _pool('0xCD578F016888B57F1b1e3f887f392F0159E26747', USDC, DAI),
+        _pool('0xc4e595acDD7d12feC385E5dA5D43160e8A0bAC0E', DAI, WETH),
+        Poolv3(address='0x45dDa9cb7c25131DF268515131f647d726f50608', version=DexVariant.UniswapV3,
+               token0=USDC, token1=WMATIC, decimals0=18, decimals1=18, fee=500),
+        Poolv3(address='0x0e44cEb592AcFC5D3F09D996302eB4C499ff8c10', version=DexVariant.UniswapV3,
+               token0=DAI, token1=WMATIC, decimals0=18, decimals1=18, fee=3000),
+    ]
+    # every token at 1:1, except WMATIC 5% cheaper in the USDC / WMATIC pool
+    reserves = {pool.id: [10000 * E, 10000 * E] for pool in pools[:4]}
+    reserves[pools[4].id] = [int(math.sqrt(1.05) * 2 ** 96), 10000 * E]
+    reserves[pools[5].id] = [2 ** 96, 10000 * E]
+    paths = PathGraph(pools, [USDC]).paths()
+    sim_pool = SimulationPool(PathTable(paths), reserves, workers=1)
+    try:
+        touched = [pool.id for pool in pools]
+        simulated = asyncio.run(sim_pool.evaluate(touched, top_k=len(paths)))
+        assert sim_pool.last_counts == {'touched': len(paths), 'simulated': len(paths)}
+        prefiltered = asyncio.run(sim_pool.evaluate(touched, top_k=len(paths), min_spread=0))
+    finally:
+        sim_pool.close()
+
+    profitable = {path_idx for path_idx, _, _, profit in simulated if profit > 0}
+    # three triangles both ways, only the two buying WMATIC in the V3 pool are profitable
+    assert len(paths) == 6 and len(profitable) == 2
+    assert {path_idx for path_idx, _, _, _ in prefiltered} == profitable
+    assert sim_pool.last_counts['simulated'] == len(profitable)
+    for candidate in prefiltered:
+        assert candidate in simulated
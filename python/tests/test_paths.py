@@ -0,0 +1,54 @@
+from orders import path_key
+from paths import PathGraph, PathTable
+from pools import DexVariant, Pool
+
+ROUTER = '0xd9e1cE17f2641f24aE83637ab66a2cca9C378B9F'
+USDC = '0x2791Bca1f2de4661ED88A30C99A7a9449Aa84174'
+WETH = '0x7ceB23fD6bC0adD59E62ac25578270cFf1b9f619'
+WMATIC = '0x0d500B1d8E8eF31E21C99d1Db9A6444d3ADf1270'
+
+
+def _pool(address: str, token0: str, token1: str) -> Pool:
+    return Pool(address=address,
+                version=DexVariant.UniswapV2,
+                token0=token0,
+                token1=token1,
+                decimals0=18,
+                decimals1=18,
+                fee=300)
+
+
+def _triangle():
+    # WETH / WMATIC is listed token0 = WMATIC, so one hop of each cycle swaps 1 -> 0
+    return [
+        _pool('0x853Ee4b2A13f8a742d64C8F088bE7bA2131f670d', USDC, WETH),
+        _pool('0xadbF1854e5883eB8aa7BAf50705338739e558E5b', WMATIC, WETH),
+        _pool('0x6e7a5FAFcec6BB1e78bAE2A1F0B612012BF14827', WMATIC, USDC),
+    ]
+
+
+def test_swap_paths_follow_the_tokens_of_the_path():
+    paths = PathGraph(_triangle(), [USDC]).paths()
+    assert len(paths) == 2  # both directions around the triangle
+
+    for path in paths:
+        swap_paths = path.to_path_params([ROUTER] * path.nhop)
+        assert len(swap_paths) == path.nhop == 3
+        assert swap_paths[0].token_in == USDC
+        assert swap_paths[-1].token_out == USDC
+        for swap_path, next_swap_path in zip(swap_paths, swap_paths[1:]):
+            assert swap_path.token_out == next_swap_path.token_in
+        for swap_path, pool in zip(swap_paths, path.pools):
+            assert swap_path.router == ROUTER
+            assert {swap_path.token_in, swap_path.token_out} == {pool.token0, pool.token1}
+
+
+def test_swap_paths_match_the_path_table_directions():
+    paths = PathGraph(_triangle(), [USDC]).paths()
+    table = PathTable(paths)
+
+    for idx, path in enumerate(paths):
+        swap_paths = path.to_path_params([ROUTER] * path.nhop)
+        for i, (swap_path, pool) in enumerate(zip(swap_paths, path.pools)):
+            assert (swap_path.token_in == pool.token0) == bool(table.zero_for_one[idx, i])
+        assert path_key(swap_paths) == tuple((ROUTER, t_in, t_out) for t_in, t_out in zip(path.tokens_in, path.tokens_out))
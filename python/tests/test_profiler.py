@@ -0,0 +1,42 @@
+import asyncio
+
+from parallel import SimulationPool
+from paths import PathGraph, PathTable
+from profiler import ProfilerControl
+
+from test_paths import USDC, _triangle
+
+
+def _sim_pool() -> SimulationPool:
+    pools = _triangle()
+    table = PathTable(PathGraph(pools, [USDC]).paths())
+    reserves = {pool.id: [10 ** 24, 2 * 10 ** 24] for pool in pools}
+    return SimulationPool(table, reserves, workers=2)
+
+
+def test_profile_merges_the_stacks_of_the_simulation_workers(tmp_path):
+    sim_pool = _sim_pool()
+    pool_ids = [int(pool_id) for pool_id in sim_pool.table.pool_ids()]
+    control = ProfilerControl(str(tmp_path), interval=0.001, sim_pool=sim_pool)
+
+    async def run():
+        profile = asyncio.ensure_future(control.run(0.5))
+        while not profile.done():
+            # a fine grid, so evaluations take a few ms
+            await sim_pool.evaluate(pool_ids, max_amount_in=200000, step_size=1)
+        return profile.result()
+
+    try:
+        prefix = asyncio.run(run())
+        # not profiling anymore, worker stacks are no longer collected
+        asyncio.run(sim_pool.evaluate(pool_ids, max_amount_in=200000, step_size=1))
+        assert not sim_pool.profile_stacks
+    finally:
+        sim_pool.close()
+
+    with open(f'{prefix}.collapsed') as f:
+        stacks = f.read().splitlines()
+    worker_stacks = [stack for stack in stacks if stack.startswith('simulation-worker;')]
+    assert worker_stacks
+    assert all('_evaluate_range' in stack for stack in worker_stacks)
+    assert any(stack.startswith('MainThread;') for stack in stacks)
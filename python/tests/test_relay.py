@@ -0,0 +1,115 @@
+import time
+import asyncio
+
+from eth_account import Account
+
+from mock_relay import MockRelay
+from relay import BundleSubmitter
+
+
+def _bundle() -> list:
+    sender = Account.create()
+    signed = sender.sign_transaction({
+        'to': sender.address,
+        'value': 0,
+        'gas': 21000,
+        'maxFeePerGas': 10 ** 9,
+        'maxPriorityFeePerGas': 10 ** 9,
+        'nonce': 0,
+        'chainId': 1,
+    })
+    return [{'signed_transaction': signed.rawTransaction}]
+
+
+async def _submit(include_from: int, retry: int, heads: range, head_timeout: float = 5.0, **kwargs):
+    """
+    Submits a bundle at head #100 to a node (also a relay), a second relay and a broken relay,
+    while new heads are mined: bundles are included from block include_from
+    """
+    node, relay, broken = MockRelay(), MockRelay(), MockRelay(fail=True)
+    for mock in (node, relay, broken):
+        await mock.start()
+    submitter = BundleSubmitter(node.url, [node.url, relay.url, broken.url], Account.create(),
+                                head_timeout=head_timeout)
+    await submitter.on_new_head(100)
+    node.block_number = 100
+
+    submitted = asyncio.ensure_future(submitter.submit(_bundle(), retry, **kwargs))
+
+    async def new_heads():
+        for block_number in heads:
+            # a block is mined once its bundle is in, heads stop when the submitter returns
+            while not submitted.done() and not any(
+                    int(bundle['blockNumber'], base=16) == block_number for bundle in node.bundles):
+                await asyncio.sleep(0.01)
+            if submitted.done():
+                return
+            await asyncio.sleep(0.05)
+            node.include = block_number >= include_from
+            node.mine(block_number)
+            await submitter.on_new_head(block_number)
+
+    try:
+        _, receipts = await asyncio.gather(new_heads(), submitted)
+    finally:
+        await submitter.close()
+        for mock in (node, relay, broken):
+            await mock.stop()
+    return receipts, node, relay
+
+
+def test_fans_out_to_every_relay_and_stops_on_inclusion():
+    simulations = []
+    receipts, node, relay = asyncio.run(_submit(101, retry=3, heads=range(101, 105),
+                                                on_simulation=simulations.append))
+
+    assert len(receipts) == 1 and receipts[0]['blockNumber'] == hex(101)
+    # one bundle per relay, the broken relay does not stop the others
+    assert node.calls.count('eth_sendBundle') == 1
+    assert relay.calls.count('eth_sendBundle') == 1
+    assert 'eth_cancelBundle' not in node.calls
+    # simulated once, the result handed over with the gas of each tx
+    assert node.calls.count('eth_callBundle') == 1
+    assert simulations[0]['results'][0]['gasUsed'] == node.gas_used
+
+
+def test_resubmits_for_the_next_block_when_missed():
+    receipts, node, relay = asyncio.run(_submit(102, retry=3, heads=range(101, 105)))
+
+    assert len(receipts) == 1 and receipts[0]['blockNumber'] == hex(102)
+    assert [int(bundle['blockNumber'], base=16) for bundle in node.bundles] == [101, 102]
+    assert [int(bundle['blockNumber'], base=16) for bundle in relay.bundles] == [101, 102]
+    # the missed bundle is cancelled on every relay
+    assert node.calls.count('eth_cancelBundle') == 1
+    assert relay.calls.count('eth_cancelBundle') == 1
+
+
+def test_gives_up_after_the_retries():
+    receipts, node, _ = asyncio.run(_submit(200, retry=1, heads=range(101, 105)))
+
+    assert receipts == []
+    assert [int(bundle['blockNumber'], base=16) for bundle in node.bundles] == [101, 102]
+
+
+def test_stalled_heads_do_not_hang_the_submitter():
+    s = time.monotonic()
+    receipts, node, _ = asyncio.run(_submit(101, retry=3, heads=range(0), head_timeout=0.3))
+
+    assert receipts == []
+    assert time.monotonic() - s < 5
+    assert node.calls.count('eth_sendBundle') == 1
+    assert node.calls.count('eth_cancelBundle') == 1
+
+
+def test_batch_errors_give_no_receipts():
+    async def run():
+        node = MockRelay(batch_error=True)
+        await node.start()
+        submitter = BundleSubmitter(node.url, [node.url], Account.create())
+        try:
+            return await submitter.get_receipts(['0x01', '0x02'])
+        finally:
+            await submitter.close()
+            await node.stop()
+
+    assert asyncio.run(run()) == [None, None]
@@ -0,0 +1,111 @@
+import json
+import asyncio
+import aiohttp
+
+from aiohttp import web
+
+from replay import RecordingProxy, ReplayServer, read_log
+
+BLOCK = {'jsonrpc': '2.0', 'method': 'eth_subscription',
+         'params': {'subscription': '0xabc', 'result': {'number': '0x64', 'hash': '0x01'}}}
+
+
+class _Node:
+    """
+    eth_blockNumber / eth_chainId, batches (too large ones answered with a single error object)
+    and a newHeads subscription sending two heads
+    """
+
+    async def handle_rpc(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if isinstance(body, list):
+            if len(body) > 2:
+                return web.json_response({'jsonrpc': '2.0', 'id': None,
+                                          'error': {'code': -32600, 'message': 'batch too large'}})
+            return web.json_response([self._result(req) for req in body])
+        return web.json_response(self._result(body))
+
+    def _result(self, req: dict) -> dict:
+        results = {'eth_blockNumber': '0x64', 'eth_chainId': '0x89'}
+        return {'jsonrpc': '2.0', 'id': req['id'], 'result': results[req['method']]}
+
+    async def handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for msg in ws:
+            req = json.loads(msg.data)
+            await ws.send_str(json.dumps({'jsonrpc': '2.0', 'id': req['id'], 'result': '0xabc'}))
+            for number in (0x64, 0x65):
+                await ws.send_str(json.dumps({**BLOCK, 'params': {**BLOCK['params'],
+                                                                  'result': {'number': hex(number)}}}))
+            break
+        await ws.close()
+        return ws
+
+
+async def _start_node():
+    node = _Node()
+    app = web.Application()
+    app.router.add_post('/', node.handle_rpc)
+    app.router.add_get('/', node.handle_ws)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, runner.addresses[0][1]
+
+
+async def _client(url: str, ws_url: str):
+    """
+    What the bot does against the node: single and batched calls, and a subscription
+    """
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json={'jsonrpc': '2.0', 'id': 1, 'method': 'eth_blockNumber', 'params': []}) as r:
+            single = await r.json()
+        async with session.post(url, json=[{'jsonrpc': '2.0', 'id': 2, 'method': 'eth_chainId', 'params': []},
+                                           {'jsonrpc': '2.0', 'id': 3, 'method': 'eth_blockNumber', 'params': []}]) as r:
+            batch = await r.json()
+        async with session.post(url, json=[{'jsonrpc': '2.0', 'id': i, 'method': 'eth_chainId', 'params': []}
+                                           for i in range(3)]) as r:
+            too_large = (r.status, await r.json())
+        frames = []
+        async with session.ws_connect(ws_url) as ws:
+            await ws.send_str(json.dumps({'jsonrpc': '2.0', 'id': 7, 'method': 'eth_subscribe', 'params': ['newHeads']}))
+            for _ in range(3):
+                frames.append(json.loads((await ws.receive()).data))
+    return single, batch, too_large, frames
+
+
+def test_record_then_replay(tmp_path):
+    log_path = str(tmp_path / 'traffic.log.gz')
+
+    async def record():
+        runner, port = await _start_node()
+        proxy = RecordingProxy(f'http://127.0.0.1:{port}', f'ws://127.0.0.1:{port}', log_path, port=0)
+        await proxy.start()
+        try:
+            return await _client(proxy.url, proxy.ws_url)
+        finally:
+            await proxy.stop()
+            await runner.cleanup()
+
+    async def replay():
+        server = ReplayServer(log_path, speed=0, port=0)
+        await server.start()
+        try:
+            return await _client(server.url, server.ws_url), server.stats
+        finally:
+            await server.stop()
+
+    single, batch, too_large, frames = asyncio.run(record())
+    # the error object of the node is forwarded as is
+    assert too_large[0] == 200 and too_large[1]['error']['message'] == 'batch too large'
+    assert [frame.get('result', frame.get('params', {}).get('result')) for frame in frames] == \
+           ['0xabc', {'number': '0x64'}, {'number': '0x65'}]
+    assert sum(record['type'] == 'rpc' for record in read_log(log_path)) == 6
+
+    (replayed_single, replayed_batch, _, replayed_frames), stats = asyncio.run(replay())
+    assert replayed_single == single
+    assert replayed_batch == batch
+    assert replayed_frames == frames
+    assert stats['ws_frames'] == 3
@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+
+from aiohttp import web
+
+from addresses import ADDRESSES
+from utils import fetch_pool_reserves_since
+
+POOL = '0x853Ee4b2A13f8a742d64C8F088bE7bA2131f670d'
+
+
+class _Node:
+    """
+    eth_getLogs with no logs, slow enough to count the requests in flight,
+    failing past max_block as providers limiting the range do
+    """
+
+    def __init__(self, max_block: int = 10 ** 9):
+        self.max_block = max_block
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        req = await request.json()
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        res = {'id': req['id'], 'jsonrpc': '2.0', 'result': []}
+        if int(req['params'][0]['toBlock'], 16) > self.max_block:
+            res = {'id': req['id'], 'jsonrpc': '2.0', 'error': {'code': -32005, 'message': 'query returned more than 10000 results'}}
+        return web.json_response(res)
+
+
+async def _fetch(node: _Node, **kwargs):
+    app = web.Application()
+    app.router.add_post('/', node.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    try:
+        return await fetch_pool_reserves_since(f'http://127.0.0.1:{runner.addresses[0][1]}', 1, 20000, [ADDRESSES.id(POOL)],
+                                               v3=False, **kwargs)
+    finally:
+        await runner.cleanup()
+
+
+def test_catch_up_requests_are_bounded():
+    node = _Node()
+    assert asyncio.run(_fetch(node, chunk=1000, concurrency=3)) == {}
+    assert node.requests == 20
+    assert node.max_in_flight <= 3
+
+
+def test_catch_up_raises_on_provider_errors():
+    with pytest.raises(RuntimeError):
+        asyncio.run(_fetch(_Node(max_block=15000), chunk=1000))
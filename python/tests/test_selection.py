@@ -0,0 +1,74 @@
+import numpy as np
+
+from paths import PathGraph, PathTable
+from selection import OrderSelector
+
+from test_paths import USDC, WETH, WMATIC, _pool
+
+DAI = '0x8f3Cf7ad23Cd3CaDbD9735AFf958023239c6A063'
+LINK = '0x53E0bca35eC356BD5ddDFebbD1Fc0fD03FaBad39'
+E = 10 ** 18
+
+
+def _select(pools, cheap):
+    """
+    Every pool at 1:1 with 10000 of each token, except the pools in cheap: they sell
+    their token1 for 5% less token0 (reserves of token1 5% higher)
+    """
+    paths = PathGraph(pools, [USDC]).paths()
+    table = PathTable(paths)
+    states = np.zeros((max(pool.id for pool in pools) + 1, 2))
+    for pool in pools:
+        states[pool.id] = [10000 * E, 10500 * E] if pool in cheap else [10000 * E, 10000 * E]
+    base_prices = np.ones(len(paths))
+    selector = OrderSelector(table)
+
+    # one candidate per profitable path, ranked by its profit on the block state alone
+    candidates = []
+    for path_idx in range(len(paths)):
+        candidates.extend(selector.select([(path_idx, 0.0, 0.0, 0.0)], states, base_prices))
+    return selector, candidates, states, base_prices, table
+
+
+def _pools_of(table, path_idx):
+    return set(table.pools[path_idx, :int(table.nhop[path_idx])].tolist())
+
+
+def test_candidates_sharing_a_pool_are_priced_after_each_other():
+    pools = [
+        _pool('0x853Ee4b2A13f8a742d64C8F088bE7bA2131f670d', USDC, WETH),
+        _pool('0xadbF1854e5883eB8aa7BAf50705338739e558E5b', WMATIC, WETH),
+        _pool('0x6e7a5FAFcec6BB1e78bAE2A1F0B612012BF14827', USDC, WMATIC),
+        _pool('0xCD578F016888B57F1b1e3f887f392F0159E26747', USDC, DAI),
+        _pool('0xEEf611894CeaE652979C9D0DaE1dEb597790C6eE', DAI, WMATIC),
+    ]
+    # USDC -> WMATIC is cheap, both triangles buy WMATIC there
+    selector, candidates, states, base_prices, table = _select(pools, [pools[2]])
+    assert len(candidates) == 2
+    shared = _pools_of(table, candidates[0][0]) & _pools_of(table, candidates[1][0])
+    assert shared == {pools[2].id}
+
+    before = states.copy()
+    selected = selector.select(candidates, states, base_prices)
+    assert (states == before).all()
+    # the best goes first with its profit, the other one is priced after it: less profit or dropped
+    best, other = sorted(candidates, key=lambda c: c[3], reverse=True)
+    assert selected[0] == best
+    assert len(selected) == 1 or (selected[1][0] == other[0] and 0 < selected[1][3] < other[3])
+
+
+def test_disjoint_candidates_keep_their_profit():
+    pools = [
+        _pool('0x853Ee4b2A13f8a742d64C8F088bE7bA2131f670d', USDC, WETH),
+        _pool('0xadbF1854e5883eB8aa7BAf50705338739e558E5b', WMATIC, WETH),
+        _pool('0x6e7a5FAFcec6BB1e78bAE2A1F0B612012BF14827', USDC, WMATIC),
+        _pool('0xCD578F016888B57F1b1e3f887f392F0159E26747', USDC, DAI),
+        _pool('0xEEf611894CeaE652979C9D0DaE1dEb597790C6eE', DAI, LINK),
+        _pool('0x3c986748414A812e455DCd5418246B8fdEd5C369', USDC, LINK),
+    ]
+    selector, candidates, states, base_prices, table = _select(pools, [pools[2], pools[5]])
+    assert len(candidates) == 2
+    assert not _pools_of(table, candidates[0][0]) & _pools_of(table, candidates[1][0])
+
+    selected = selector.select(candidates, states, base_prices)
+    assert sorted(selected) == sorted(candidates)
@@ -0,0 +1,61 @@
+import pytest
+
+from addresses import AddressRegistry
+from paths import PathGraph, PathTable
+from pools import DexVariant, Pool
+from poolsv3 import Poolv3
+from snapshot import Snapshot
+
+USDC = '0x2791Bca1f2de4661ED88A30C99A7a9449Aa84174'
+WETH = '0x7ceB23fD6bC0adD59E62ac25578270cFf1b9f619'
+WMATIC = '0x0d500B1d8E8eF31E21C99d1Db9A6444d3ADf1270'
+
+
+def _pools():
+    return [
+        Pool(address='0x853Ee4b2A13f8a742d64C8F088bE7bA2131f670d', version=DexVariant.UniswapV2,
+             token0=USDC, token1=WETH, decimals0=6, decimals1=18, fee=300),
+        Poolv3(address='0x45dDa9cb7c25131DF268515131f647d726f50608', version=DexVariant.UniswapV3,
+               token0=WMATIC, token1=WETH, decimals0=18, decimals1=18, fee=500),
+        Pool(address='0x6e7a5FAFcec6BB1e78bAE2A1F0B612012BF14827', version=DexVariant.UniswapV2,
+             token0=WMATIC, token1=USDC, decimals0=18, decimals1=6, fee=300),
+    ]
+
+
+def test_snapshot_round_trip(tmp_path):
+    pools = {pool.id: pool for pool in _pools()}
+    table = PathTable(PathGraph(pools.values(), [USDC]).paths())
+    reserves = {
+        pool_id: [(1 << 111) + 7, (1 << 100) + 3] for pool_id in pools
+    }
+    v3 = next(pool for pool in pools.values() if isinstance(pool, Poolv3))
+    reserves[v3.id] = [(1 << 159) + (1 << 64) + 5, (1 << 127) + 1]  # sqrtPriceX96 is 160 bits
+
+    path = str(tmp_path / 'snapshot.bin')
+    Snapshot.take('key', 100, '0xabc', pools, table, reserves).save(path)
+    restored_pools, paths, restored_table, restored_reserves = Snapshot.load(path).restore()
+
+    assert restored_reserves == reserves
+    assert len(paths) == len(table.nhop)
+    assert (restored_table.kinds == table.kinds).all()
+    for pool_id, pool in pools.items():
+        restored = restored_pools[pool_id]
+        assert type(restored) is type(pool)
+        assert restored.version == pool.version
+        assert (restored.address, restored.token0, restored.token1, restored.fee) == \
+               (pool.address, pool.token0, pool.token1, pool.fee)
+
+
+def test_registry_restore_needs_a_prefix():
+    registry = AddressRegistry()
+    registry.ids([USDC, WETH])
+    raw = registry.export()
+
+    fresh = AddressRegistry()
+    fresh.restore(raw)
+    assert fresh.id(WETH) == registry.id(WETH)
+
+    conflicting = AddressRegistry()
+    conflicting.id(WMATIC)
+    with pytest.raises(ValueError):
+        conflicting.restore(raw)
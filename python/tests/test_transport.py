@@ -0,0 +1,82 @@
+import asyncio
+import pytest
+
+from transport import SharedRingBuffer
+
+BLOCK = {'type': 'block', 'block_number': 100, 'block_hash': '0x' + 'ab' * 32, 'base_fee': 30 * 10 ** 9,
+         'next_base_fee': 31 * 10 ** 9, 'received_ns': 123456789,
+         'max_priority_fee_per_gas': 10 ** 9, 'max_fee_per_gas': 70 * 10 ** 9}
+PENDING_TX = {'type': 'pending_tx', 'tx_hash': '0x' + 'cd' * 32}
+NEW_POOL = {'type': 'new_pool', 'block_number': 100, 'factory': '0x' + '01' * 20, 'pool': '0x' + '02' * 20,
+            'token0': '0x' + '03' * 20, 'token1': '0x' + '04' * 20, 'fee': 500, 'version': 3}
+
+
+def _pool_update(i: int) -> dict:
+    return {'type': 'pool_update', 'block_number': 100 + i, 'pool': '0x' + f'{i:040x}',
+            'reserves': [(1 << 112) - 1 - i, i]}
+
+
+def test_records_wrap_around_the_ring():
+    ring = SharedRingBuffer(capacity=4)
+    try:
+        # one event left in the ring, then 3 in and 3 out per round: records go around the ring
+        # several times, from a different slot each round
+        expected = [BLOCK, PENDING_TX, NEW_POOL] + [_pool_update(i) for i in range(16)]
+        assert ring.put(expected[0])
+        received = []
+        for i in range(1, len(expected), 3):
+            for event in expected[i:i + 3]:
+                assert ring.put(event)
+            received.extend(ring.get_nowait() for _ in range(3))
+        received.append(ring.get_nowait())
+        assert received == expected
+        assert ring.get_nowait() is None
+        assert ring.dropped == 0
+    finally:
+        ring.close()
+
+
+def test_full_ring_drops_and_counts_new_events():
+    ring = SharedRingBuffer(capacity=4)
+    try:
+        assert [ring.put(_pool_update(i)) for i in range(6)] == [True] * 4 + [False] * 2
+        assert ring.qsize() == 4
+        assert ring.dropped == 2
+
+        # the events already in the ring are kept, the ring takes new ones once read
+        assert ring.get_nowait() == _pool_update(0)
+        assert ring.put(_pool_update(6))
+        assert [ring.get_nowait() for _ in range(4)] == [_pool_update(i) for i in (1, 2, 3, 6)]
+        assert ring.dropped == 2
+    finally:
+        ring.close()
+
+
+def test_events_too_large_for_their_record_are_rejected():
+    ring = SharedRingBuffer(capacity=4)
+    try:
+        oversized = dict(_pool_update(0), reserves=[1 << 160, 1])  # ex. a V3 sqrtPriceX96
+        with pytest.raises(ValueError):
+            ring.put(oversized)
+        assert ring.qsize() == 0
+        assert ring.dropped == 0
+
+        assert ring.put(_pool_update(1))
+        assert ring.get_nowait() == _pool_update(1)
+    finally:
+        ring.close()
+
+
+def test_consumer_is_woken_up_by_the_producer():
+    async def run():
+        ring = SharedRingBuffer(capacity=4)
+        try:
+            consumer = asyncio.ensure_future(ring.coro_get())
+            await asyncio.sleep(0.01)
+            assert not consumer.done()
+            ring.put(PENDING_TX)
+            return await asyncio.wait_for(consumer, timeout=5)
+        finally:
+            ring.close()
+
+    assert asyncio.run(run()) == PENDING_TX
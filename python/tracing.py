@@ -1,76 +1,226 @@
 import json
+import time
+import asyncio
 import aiohttp
 import aioprocessing
 
 from loguru import logger
-from typing import List, Optional
-
-
-async def get_geth_touched_pools(https_url: str, tx_hash: str) -> Optional[List[str]]:
-    async with aiohttp.ClientSession() as session:
-        req = {
-            'id': 1,
-            'method': 'debug_traceTransaction',
-            'jsonrpc': '2.0',
-            'params': [
-                tx_hash,
-                {'tracer': 'prestateTracer'}
-            ]
-        }
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        request = await session.post(https_url, data=json.dumps(req), headers=headers)
-        res = await request.json()
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
 
-        result = res.get('result')
 
-        if result:
-            addresses_touched = list(result.keys())
-        else:
-            addresses_touched = []
+async def _rpc_result(session: aiohttp.ClientSession,
+                      https_url: str,
+                      method: str,
+                      params: list) -> Any:
+    req = {
+        'id': 1,
+        'method': method,
+        'jsonrpc': '2.0',
+        'params': params
+    }
+    headers = {
+        'Content-Type': 'application/json'
+    }
+    request = await session.post(https_url, data=json.dumps(req), headers=headers)
+    res = await request.json()
+    return res.get('result')
 
-        return addresses_touched
 
+async def get_geth_touched_pools(https_url: str,
+                                 tx_hash: str,
+                                 session: Optional[aiohttp.ClientSession] = None) -> Optional[List[str]]:
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await get_geth_touched_pools(https_url, tx_hash, session)
 
-async def get_parity_touched_pools(https_url: str, tx_hash: str) -> Optional[List[str]]:
-    async with aiohttp.ClientSession() as session:
-        req = {
-            'id': 1,
-            'method': 'trace_replayTransaction',
-            'jsonrpc': '2.0',
-            'params': [tx_hash, ['stateDiff']]
-        }
-        request = await session.post(https_url, data=json.dumps(req))
-        res = await request.json()
+    result = await _rpc_result(session,
+                               https_url,
+                               'debug_traceTransaction',
+                               [tx_hash, {'tracer': 'prestateTracer'}])
 
-        result = res.get('result')
+    if result:
+        addresses_touched = list(result.keys())
+    else:
+        addresses_touched = []
 
-        if result:
-            state_diff = result['stateDiff']
-            addresses_touched = list(state_diff.keys())
-        else:
-            addresses_touched = []
+    return addresses_touched
 
-        return addresses_touched
 
+async def get_parity_touched_pools(https_url: str,
+                                   tx_hash: str,
+                                   session: Optional[aiohttp.ClientSession] = None) -> Optional[List[str]]:
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await get_parity_touched_pools(https_url, tx_hash, session)
 
-# TEST event_handler
-async def test_event_handler(https_url: str, event_queue: aioprocessing.AioQueue):
-    import time
+    result = await _rpc_result(session,
+                               https_url,
+                               'trace_replayTransaction',
+                               [tx_hash, ['stateDiff']])
+
+    if result:
+        state_diff = result['stateDiff']
+        addresses_touched = list(state_diff.keys())
+    else:
+        addresses_touched = []
+
+    return addresses_touched
+
+
+class TracingPool:
+    """
+    A bounded pool of tracing workers for pending transactions.
+
+    At most `workers` traces are in flight at any time. Pending tx hashes wait in a queue
+    of at most `max_queue` items, and when it is full the oldest hash is dropped to make
+    room for the newest one, since mempool bursts make old hashes irrelevant first.
+    Hashes that waited longer than `deadline` seconds, or that are already mined,
+    are dropped before being traced.
+    """
+
+    DROP_REASONS = ('overflow', 'stale', 'mined')
+
+    def __init__(self,
+                 https_url: str,
+                 tracers: Optional[List[Callable]] = None,
+                 workers: int = 8,
+                 max_queue: int = 1000,
+                 deadline: float = 2.0,
+                 check_mined: bool = True,
+                 on_traced: Optional[Callable] = None,
+                 latency_window: int = 1000):
+
+        self.https_url = https_url
+        self.tracers = tracers or [get_geth_touched_pools, get_parity_touched_pools]
+        self.workers = workers
+        self.deadline = deadline
+        self.check_mined = check_mined
+        self.on_traced = on_traced
+
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
 
-    while True:
-        data = await event_queue.coro_get()
+        self.received = 0
+        self.traced = 0
+        self.failed = 0
+        self.dropped = {reason: 0 for reason in self.DROP_REASONS}
+        self.latencies = deque(maxlen=latency_window)
+
+    def submit(self, tx_hash: str) -> bool:
+        """
+        Enqueues a tx hash without blocking the producer.
+        Returns False if an older hash had to be evicted to make room.
+        """
+        self.received += 1
+        evicted = False
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.dropped['overflow'] += 1
+                evicted = True
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait((tx_hash, time.monotonic()))
+        return not evicted
+
+    async def _is_mined(self, session: aiohttp.ClientSession, tx_hash: str) -> bool:
+        tx = await _rpc_result(session, self.https_url, 'eth_getTransactionByHash', [tx_hash])
+        return tx is not None and tx.get('blockNumber') is not None
+
+    async def _worker(self, session: aiohttp.ClientSession):
+        while True:
+            tx_hash, enqueued_at = await self.queue.get()
+            try:
+                if time.monotonic() - enqueued_at > self.deadline:
+                    self.dropped['stale'] += 1
+                    continue
+
+                if self.check_mined and await self._is_mined(session, tx_hash):
+                    self.dropped['mined'] += 1
+                    continue
+
+                s = time.monotonic()
+                results = await asyncio.gather(
+                    *[tracer(self.https_url, tx_hash, session) for tracer in self.tracers]
+                )
+                self.latencies.append(time.monotonic() - s)
+                self.traced += 1
+
+                if self.on_traced:
+                    self.on_traced(tx_hash, results)
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f'Tracing {tx_hash} failed: {e}')
+            finally:
+                self.queue.task_done()
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        Returns queue depth, drop counts/rate and per-trace latency (in ms)
+        """
+        dropped = sum(self.dropped.values())
+        latencies = sorted(self.latencies)
+
+        def _percentile(q: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+
+        return {
+            'queue_depth': self.queue.qsize(),
+            'received': self.received,
+            'traced': self.traced,
+            'failed': self.failed,
+            **{f'dropped_{reason}': cnt for reason, cnt in self.dropped.items()},
+            'drop_rate': dropped / self.received if self.received else 0.0,
+            'latency_p50_ms': _percentile(0.5),
+            'latency_p99_ms': _percentile(0.99),
+            'latency_max_ms': latencies[-1] * 1000 if latencies else 0.0,
+        }
+
+    async def _report(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(f'Tracing pool: {self.metrics()}')
+
+    async def run(self, event_queue: aioprocessing.AioQueue, report_interval: float = 10.0):
+        """
+        Consumes pending_tx events from event_queue and traces them with the worker pool
+        """
+        async with aiohttp.ClientSession() as session:
+            tasks = [asyncio.create_task(self._worker(session)) for _ in range(self.workers)]
+            if report_interval:
+                tasks.append(asyncio.create_task(self._report(report_interval)))
+            try:
+                while True:
+                    data = await event_queue.coro_get()
+                    if data['type'] == 'pending_tx':
+                        self.submit(data['tx_hash'])
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+
+# TEST event_handler
+async def test_event_handler(https_url: str,
+                             event_queue: aioprocessing.AioQueue,
+                             workers: int = 8,
+                             max_queue: int = 1000,
+                             deadline: float = 2.0):
 
-        if data['type'] == 'pending_tx':
-            s = time.time()
-            geth_touched_pools = await get_geth_touched_pools(https_url, data['tx_hash'])
-            parity_touched_pools = await get_parity_touched_pools(https_url, data['tx_hash'])
-            e = time.time()
+    def _log_traced(tx_hash: str, results: list):
+        geth_touched_pools, parity_touched_pools = results
+        logger.info(tx_hash)
+        logger.info(geth_touched_pools)
+        logger.info(parity_touched_pools)
 
-            logger.info(f'{data["tx_hash"]}: took {e - s} sec')
-            logger.info(geth_touched_pools)
-            logger.info(parity_touched_pools)
+    pool = TracingPool(https_url,
+                       workers=workers,
+                       max_queue=max_queue,
+                       deadline=deadline,
+                       on_traced=_log_traced)
+    await pool.run(event_queue)
 
 
 if __name__ == '__main__':
@@ -80,7 +230,6 @@ if __name__ == '__main__':
     https://medium.com/@solidquant/how-i-spend-my-days-mempool-watching-part-1-transaction-prediction-through-evm-tracing-77f4c99207f
     """
     import os
-    import asyncio
     import nest_asyncio
     from functools import partial
     from dotenv import load_dotenv
@@ -0,0 +1,225 @@
+import os
+import struct
+import asyncio
+
+from typing import Any, Dict, Optional
+from multiprocessing import shared_memory
+
+# Event transport between the stream tasks and the strategy:
+#
+# - LocalEventQueue: plain asyncio queue, for streams and strategy running in one process
+# - SharedRingBuffer: fixed-size records in shared memory, for streams running in other processes
+#
+# Both expose the same put / coro_get interface as aioprocessing.AioQueue,
+# so they can be passed to the stream functions and the event handlers as is.
+
+RECORD_SIZE = 96
+HEADER_SIZE = 64  # write sequence, read sequence, drop count on separate cache lines
+
+# type (uint8) followed by the typed layout of each event
+BLOCK_LAYOUT = struct.Struct('>BQ32sQQ?QQQ')  # block_number, block_hash, base_fee, next_base_fee, has_estimate, max_priority_fee_per_gas, max_fee_per_gas, received_ns
+PENDING_TX_LAYOUT = struct.Struct('>B32s')  # tx_hash
+POOL_UPDATE_LAYOUT = struct.Struct('>BQ20s16s16s')  # block_number, pool, reserve0, reserve1
+NEW_POOL_LAYOUT = struct.Struct('>BQ20s20s20s20sIB')  # block_number, factory, pool, token0, token1, fee, version
+
+_SEQ = struct.Struct('<Q')
+
+
+def encode_event(event: Dict[str, Any]) -> bytes:
+    event_type = event['type']
+    if event_type == 'block':
+        has_estimate = 'max_fee_per_gas' in event
+        return BLOCK_LAYOUT.pack(0,
+                                 event['block_number'],
+                                 bytes.fromhex(event.get('block_hash', '0x')[2:]),
+                                 event['base_fee'],
+                                 int(event['next_base_fee']),
+                                 has_estimate,
+                                 event.get('max_priority_fee_per_gas', 0),
+                                 event.get('max_fee_per_gas', 0),
+                                 event.get('received_ns', 0))
+    if event_type == 'pending_tx':
+        return PENDING_TX_LAYOUT.pack(1, bytes.fromhex(event['tx_hash'][2:]))
+    if event_type == 'pool_update':
+        reserve0, reserve1 = event['reserves']
+        return POOL_UPDATE_LAYOUT.pack(2,
+                                       event['block_number'],
+                                       bytes.fromhex(event['pool'][2:]),
+                                       int(reserve0).to_bytes(16, 'big'),
+                                       int(reserve1).to_bytes(16, 'big'))
+    if event_type == 'new_pool':
+        return NEW_POOL_LAYOUT.pack(3,
+                                    event['block_number'],
+                                    bytes.fromhex(event['factory'][2:]),
+                                    bytes.fromhex(event['pool'][2:]),
+                                    bytes.fromhex(event['token0'][2:]),
+                                    bytes.fromhex(event['token1'][2:]),
+                                    event['fee'],
+                                    event['version'])
+    raise ValueError(f'Unknown event type: {event_type}')
+
+
+def decode_event(record: memoryview) -> Dict[str, Any]:
+    event_type = record[0]
+    if event_type == 0:
+        _, block_number, block_hash, base_fee, next_base_fee, has_estimate, priority_fee, max_fee, received_ns = \
+            BLOCK_LAYOUT.unpack_from(record)
+        event = {
+            'type': 'block',
+            'block_number': block_number,
+            'block_hash': '0x' + block_hash.hex(),
+            'base_fee': base_fee,
+            'next_base_fee': next_base_fee,
+            'received_ns': received_ns,
+        }
+        if has_estimate:
+            event['max_priority_fee_per_gas'] = priority_fee
+            event['max_fee_per_gas'] = max_fee
+        return event
+    if event_type == 1:
+        _, tx_hash = PENDING_TX_LAYOUT.unpack_from(record)
+        return {'type': 'pending_tx', 'tx_hash': '0x' + tx_hash.hex()}
+    if event_type == 2:
+        _, block_number, pool, reserve0, reserve1 = POOL_UPDATE_LAYOUT.unpack_from(record)
+        return {
+            'type': 'pool_update',
+            'block_number': block_number,
+            'pool': '0x' + pool.hex(),
+            'reserves': [int.from_bytes(reserve0, 'big'), int.from_bytes(reserve1, 'big')],
+        }
+    if event_type == 3:
+        _, block_number, factory, pool, token0, token1, fee, version = NEW_POOL_LAYOUT.unpack_from(record)
+        return {
+            'type': 'new_pool',
+            'block_number': block_number,
+            'factory': '0x' + factory.hex(),
+            'pool': '0x' + pool.hex(),
+            'token0': '0x' + token0.hex(),
+            'token1': '0x' + token1.hex(),
+            'fee': fee,
+            'version': version,
+        }
+    raise ValueError(f'Unknown record type: {event_type}')
+
+
+class LocalEventQueue(asyncio.Queue):
+    """
+    In-process mode: events are passed by reference, nothing is serialized
+    """
+
+    def put(self, event: Dict[str, Any]):
+        self.put_nowait(event)
+
+    async def coro_get(self) -> Dict[str, Any]:
+        return await self.get()
+
+
+class SharedRingBuffer:
+    """
+    A single-producer/single-consumer ring of fixed-size event records in shared memory.
+
+    The producer packs an event into the next free slot and then publishes it by bumping
+    the write sequence. The consumer is woken up through a pipe registered with the event
+    loop, so it never polls. When the ring is full, new events are dropped and counted
+    instead of blocking the stream. Events with values too large for their layout raise ValueError.
+
+    Create it before starting the producer process (fork), the pipe is inherited.
+    """
+
+    def __init__(self, capacity: int = 65536):
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity * RECORD_SIZE)
+        self.buf = self.shm.buf
+        self.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+        self._owner_pid = os.getpid()
+
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        os.set_blocking(self._write_fd, False)
+        self._ready: Optional[asyncio.Event] = None
+
+    def _seq(self, offset: int) -> int:
+        return _SEQ.unpack_from(self.buf, offset)[0]
+
+    @property
+    def dropped(self) -> int:
+        return self._seq(16)
+
+    def qsize(self) -> int:
+        return self._seq(0) - self._seq(8)
+
+    def put(self, event: Dict[str, Any]) -> bool:
+        write_seq = self._seq(0)
+        if write_seq - self._seq(8) >= self.capacity:
+            _SEQ.pack_into(self.buf, 16, self.dropped + 1)
+            return False
+
+        try:
+            record = encode_event(event)
+        except (OverflowError, struct.error) as e:
+            # ex. reserves over 128 bits, nothing is written
+            raise ValueError(f'Event does not fit in a record: {e}') from e
+        offset = HEADER_SIZE + (write_seq % self.capacity) * RECORD_SIZE
+        self.buf[offset:offset + len(record)] = record
+        _SEQ.pack_into(self.buf, 0, write_seq + 1)
+
+        try:
+            os.write(self._write_fd, b'\x00')
+        except BlockingIOError:
+            pass  # the consumer has wakeups pending already
+        return True
+
+    def get_nowait(self) -> Optional[Dict[str, Any]]:
+        read_seq = self._seq(8)
+        if read_seq >= self._seq(0):
+            return None
+        offset = HEADER_SIZE + (read_seq % self.capacity) * RECORD_SIZE
+        event = decode_event(self.buf[offset:offset + RECORD_SIZE])
+        _SEQ.pack_into(self.buf, 8, read_seq + 1)
+        return event
+
+    def _on_wakeup(self):
+        try:
+            os.read(self._read_fd, 65536)
+        except BlockingIOError:
+            pass
+        self._ready.set()
+
+    async def coro_get(self) -> Dict[str, Any]:
+        if self._ready is None:
+            self._ready = asyncio.Event()
+            asyncio.get_event_loop().add_reader(self._read_fd, self._on_wakeup)
+
+        while True:
+            event = self.get_nowait()
+            if event is not None:
+                return event
+            self._ready.clear()
+            event = self.get_nowait()
+            if event is not None:
+                return event
+            await self._ready.wait()
+
+    def close(self):
+        if self._ready is not None:
+            asyncio.get_event_loop().remove_reader(self._read_fd)
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+        self.shm.close()
+        if os.getpid() == self._owner_pid:
+            self.shm.unlink()
+
+
+def make_event_queue(mode: str = 'local', capacity: int = 65536):
+    """
+    mode: "local" for single-process deployments, "shm" for multi-process ones,
+          "aioprocessing" for the previous aioprocessing.AioQueue
+    """
+    if mode == 'local':
+        return LocalEventQueue()
+    if mode == 'shm':
+        return SharedRingBuffer(capacity)
+    if mode == 'aioprocessing':
+        import aioprocessing
+        return aioprocessing.AioQueue()
+    raise ValueError(f'Unknown event queue mode: {mode}')
@@ -1,4 +1,5 @@
 import json
+import time
 import random
 import aiohttp
 import asyncio
@@ -6,12 +7,23 @@ import eth_abi
 import websockets
 
 from web3 import Web3
-from typing import Any, Callable, Dict, List
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
 
-from constants import BLOCKNATIVE_TOKEN
+from constants import BLOCKNATIVE_TOKEN, logger
+from addresses import ADDRESSES
 
 GWEI = 10 ** 9
 
+SYNC_EVENT_SELECTOR = Web3.keccak(text='Sync(uint112,uint112)').hex()
+V3_SWAP_EVENT_SELECTOR = Web3.keccak(text='Swap(address,address,int256,int256,uint160,uint128,int24)').hex()
+PAIR_CREATED_EVENT_SELECTOR = Web3.keccak(text='PairCreated(address,address,address,uint256)').hex()
+POOL_CREATED_EVENT_SELECTOR = Web3.keccak(text='PoolCreated(address,address,uint24,int24,address)').hex()
+DECIMALS_SELECTOR = Web3.keccak(text='decimals()').hex()[:10]
+GET_RESERVES_SELECTOR = Web3.keccak(text='getReserves()').hex()[:10]
+SLOT0_SELECTOR = Web3.keccak(text='slot0()').hex()[:10]
+LIQUIDITY_SELECTOR = Web3.keccak(text='liquidity()').hex()[:10]
+
 
 async def reconnecting_websocket_loop(stream_fn: Callable, tag: str):
     while True:
@@ -70,31 +82,177 @@ async def estimated_next_block_gas(chain: str = 'ethereum') -> Dict[str, float]:
     return estimate
 
 
-async def get_access_list(tx: Dict[str, Any], https_url: str) -> List[Dict[str, Any]]:
+async def get_access_list(tx: Dict[str, Any],
+                          https_url: str,
+                          session: Optional[aiohttp.ClientSession] = None) -> List[Dict[str, Any]]:
     """
     Reference: https://www.rareskills.io/post/eip-2930-optional-access-list-ethereum
+    Raises RuntimeError on JSON-RPC errors and when the call reverts: a reverted call
+    stops early, its access list misses the slots of the rest of the order.
     """
-    access_list = []
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            url=https_url,
-            headers={'content-type': 'application/json'},
-            data=json.dumps({
-                'id': 1,
-                'method': 'eth_createAccessList',
-                'jsonrpc': '2.0',
-                'params': [{
-                    'from': tx.get('from'),
-                    'to': tx.get('to'),
-                    'data': tx.get('data', '0x'),
-                    'value': hex(tx.get('value', 0)),
-                    'gas': hex(500000)
-                }, 'latest']
-            })
-        ) as r:
-            res = await r.json()
-            access_list = res['result']['accessList']
-    return access_list
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await get_access_list(tx, https_url, session)
+
+    async with session.post(
+        url=https_url,
+        headers={'content-type': 'application/json'},
+        data=json.dumps({
+            'id': 1,
+            'method': 'eth_createAccessList',
+            'jsonrpc': '2.0',
+            'params': [{
+                'from': tx.get('from'),
+                'to': tx.get('to'),
+                'data': tx.get('data', '0x'),
+                'value': hex(tx.get('value', 0)),
+                'gas': hex(500000)
+            }, 'latest']
+        })
+    ) as r:
+        res = await r.json()
+    if 'error' in res:
+        raise RuntimeError(f'eth_createAccessList: {res["error"]}')
+    if res['result'].get('error'):
+        raise RuntimeError(f'eth_createAccessList reverted: {res["result"]["error"]}')
+    return res['result']['accessList']
+
+
+class AccessListCache:
+    """
+    EIP-2930 access lists keyed by swap path, so order txs can ship with them
+    without an eth_createAccessList call at send time.
+
+    Access lists are computed in the background (run) for the paths requested: paths traded
+    for the first time and candidates of recent blocks, never the whole path universe.
+    At most max_entries are kept, the least recently used are evicted. Entries older than
+    refresh_interval are refreshed refresh_batch at a time, oldest first, after the pending
+    requests, so refreshes don't hold first trades back.
+    The tx used for a path only needs "from", "to", "data", calls that revert are not cached.
+    """
+
+    def __init__(self,
+                 https_url: str,
+                 refresh_interval: float = 60.0,
+                 concurrency: int = 8,
+                 max_entries: int = 4096,
+                 refresh_batch: int = 16,
+                 tick: float = 1.0):
+
+        self.https_url = https_url
+        self.refresh_interval = refresh_interval
+        self.concurrency = concurrency
+        self.max_entries = max_entries
+        self.refresh_batch = refresh_batch
+        self.tick = tick
+
+        # least recently used first
+        self.access_lists: OrderedDict[tuple, List[Dict[str, Any]]] = OrderedDict()
+        self._txs: Dict[tuple, Dict[str, Any]] = {}
+        # time.monotonic() of the last fetch, oldest first
+        self._fetched: Dict[tuple, float] = {}
+        self._pending: Dict[tuple, Dict[str, Any]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def __len__(self) -> int:
+        return len(self.access_lists)
+
+    def get(self, key: tuple) -> Optional[List[Dict[str, Any]]]:
+        access_list = self.access_lists.get(key)
+        if access_list is not None:
+            self.access_lists.move_to_end(key)
+        return access_list
+
+    def request(self, key: tuple, tx: Dict[str, Any]):
+        """
+        Schedules the access list of a path to be computed in the background
+        """
+        if key in self._pending or key in self.access_lists:
+            return
+        self._pending[key] = tx
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _store(self, key: tuple, tx: Dict[str, Any], access_list: List[Dict[str, Any]]):
+        self.access_lists[key] = access_list
+        self.access_lists.move_to_end(key)
+        self._txs[key] = tx
+        self._fetched.pop(key, None)
+        self._fetched[key] = time.monotonic()
+        while len(self.access_lists) > self.max_entries:
+            self._forget(next(iter(self.access_lists)))
+
+    def _forget(self, key: tuple):
+        self.access_lists.pop(key, None)
+        self._txs.pop(key, None)
+        self._fetched.pop(key, None)
+
+    async def _fetch(self,
+                     session: aiohttp.ClientSession,
+                     semaphore: asyncio.Semaphore,
+                     key: tuple,
+                     tx: Dict[str, Any]):
+        async with semaphore:
+            try:
+                self._store(key, tx, await get_access_list(tx, self.https_url, session))
+            except Exception as e:
+                # a path that reverts now has no usable access list, it is requested again when traded
+                self._forget(key)
+                logger.warning(f'Access list for {key} failed: {e}')
+
+    async def warm(self,
+                   txs: Dict[tuple, Dict[str, Any]],
+                   session: Optional[aiohttp.ClientSession] = None):
+        """
+        Computes access lists for the given paths, at most `concurrency` requests at a time
+        """
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                return await self.warm(txs, session)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*[
+            self._fetch(session, semaphore, key, tx) for key, tx in txs.items()
+        ])
+
+    def stale(self) -> Dict[tuple, Dict[str, Any]]:
+        """
+        Up to refresh_batch entries fetched more than refresh_interval ago, oldest first
+        """
+        deadline = time.monotonic() - self.refresh_interval
+        stale = {}
+        for key, fetched in self._fetched.items():
+            if fetched > deadline or len(stale) == self.refresh_batch:
+                break
+            stale[key] = self._txs[key]
+        return stale
+
+    async def step(self, session: aiohttp.ClientSession):
+        """
+        One round of run(): the pending requests, then a batch of stale entries
+        """
+        if self._pending:
+            pending, self._pending = self._pending, {}
+            await self.warm(pending, session)
+        stale = self.stale()
+        if stale:
+            await self.warm(stale, session)
+
+    async def run(self):
+        """
+        Background task: computes requested access lists as soon as they come in,
+        and refreshes stale entries every tick
+        """
+        self._wakeup = asyncio.Event()
+
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.tick)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.step(session)
 
 
 def get_touched_pool_reserves(w3: Web3, block_number: int) -> Dict[str, List[int]]:
@@ -110,6 +268,7 @@ def get_touched_pool_reserves(w3: Web3, block_number: int) -> Dict[str, List[int
         'topics': [sync_event_selector]
     })
     logs = event_filter.get_all_entries()
+    w3.eth.uninstall_filter(event_filter.filter_id)
     tx_idx = {}
     reserves = {}
     for log in logs:
@@ -124,6 +283,255 @@ def get_touched_pool_reserves(w3: Web3, block_number: int) -> Dict[str, List[int
     return reserves
 
 
+def decode_touched_pool_logs(logs: List[Dict[str, Any]], pool_ids: Set[int]) -> Dict[int, List[int]]:
+    """
+    Decodes the last Sync / V3 Swap log of each pool in pool_ids (see fetch_touched_pool_reserves)
+    """
+    # logs are ordered by (transactionIndex, logIndex), so the last log per pool wins
+    last_logs = {}
+    for log in logs:
+        if not log.get('removed'):
+            pool_id = ADDRESSES.get(log['address'])
+            if pool_id in pool_ids:
+                last_logs[pool_id] = log
+
+    reserves = {}
+    for pool_id, log in last_logs.items():
+        data = bytes.fromhex(log['data'][2:])
+        if log['topics'][0] == SYNC_EVENT_SELECTOR:
+            reserves[pool_id] = [
+                int.from_bytes(data[0:32], 'big'),
+                int.from_bytes(data[32:64], 'big'),
+            ]
+        else:
+            reserves[pool_id] = [
+                int.from_bytes(data[64:96], 'big'),
+                int.from_bytes(data[96:128], 'big'),
+                int.from_bytes(data[128:160], 'big', signed=True),
+            ]
+    return reserves
+
+
+async def fetch_touched_pool_reserves(https_url: str,
+                                      block_hash: str,
+                                      pool_ids: Iterable[int],
+                                      session: Optional[aiohttp.ClientSession] = None,
+                                      v3: bool = True) -> Dict[int, List[int]]:
+    """
+    An async, filter-free version of get_touched_pool_reserves.
+
+    A single eth_getLogs request by blockHash returns the Sync (and V3 Swap) logs
+    of the watched pools only. Only the last log of each pool is decoded:
+
+    - V2 pools: [reserve0, reserve1]
+    - V3 pools: [sqrtPriceX96, liquidity, tick]
+
+    Pools are passed and returned as addresses.ADDRESSES ids.
+    """
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await fetch_touched_pool_reserves(https_url, block_hash, pool_ids, session, v3)
+
+    pool_ids = set(pool_ids)
+    topics = [SYNC_EVENT_SELECTOR, V3_SWAP_EVENT_SELECTOR] if v3 else [SYNC_EVENT_SELECTOR]
+
+    async with session.post(
+        url=https_url,
+        headers={'content-type': 'application/json'},
+        data=json.dumps({
+            'id': 1,
+            'method': 'eth_getLogs',
+            'jsonrpc': '2.0',
+            'params': [{
+                'blockHash': block_hash,
+                'address': [ADDRESSES.address(pool_id) for pool_id in pool_ids],
+                'topics': [topics],
+            }]
+        })
+    ) as r:
+        res = await r.json()
+    if 'error' in res:
+        raise RuntimeError(f'eth_getLogs {block_hash}: {res["error"]}')
+
+    return decode_touched_pool_logs(res['result'], pool_ids)
+
+
+async def fetch_pool_reserves_since(https_url: str,
+                                    from_block: int,
+                                    to_block: int,
+                                    pool_ids: Iterable[int],
+                                    session: Optional[aiohttp.ClientSession] = None,
+                                    v3: bool = True,
+                                    chunk: int = 1000,
+                                    concurrency: int = 4) -> Dict[int, List[int]]:
+    """
+    Reserves of the pools that logged a Sync (or V3 Swap) from from_block to to_block (inclusive),
+    the last log of each pool wins. Used to catch up from a snapshot, eth_getLogs requests
+    cover `chunk` blocks each, at most `concurrency` at a time. Raises RuntimeError on JSON-RPC errors.
+    """
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await fetch_pool_reserves_since(https_url, from_block, to_block, pool_ids, session, v3, chunk,
+                                                   concurrency)
+
+    pool_ids = set(pool_ids)
+    addresses = [ADDRESSES.address(pool_id) for pool_id in pool_ids]
+    topics = [SYNC_EVENT_SELECTOR, V3_SWAP_EVENT_SELECTOR] if v3 else [SYNC_EVENT_SELECTOR]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def get_logs(start: int, end: int) -> List[Dict[str, Any]]:
+        async with semaphore, session.post(
+            url=https_url,
+            headers={'content-type': 'application/json'},
+            data=json.dumps({
+                'id': 1,
+                'method': 'eth_getLogs',
+                'jsonrpc': '2.0',
+                'params': [{
+                    'fromBlock': hex(start),
+                    'toBlock': hex(end),
+                    'address': addresses,
+                    'topics': [topics],
+                }]
+            })
+        ) as r:
+            res = await r.json()
+        if 'error' in res:
+            raise RuntimeError(f'eth_getLogs {start}-{end}: {res["error"]}')
+        return res['result']
+
+    ranges = [(start, min(start + chunk - 1, to_block)) for start in range(from_block, to_block + 1, chunk)]
+    results = await asyncio.gather(*[get_logs(start, end) for start, end in ranges])
+    # chunks are in block order, so the logs stay ordered
+    return decode_touched_pool_logs([log for logs in results for log in logs], pool_ids)
+
+
+def decode_pool_created_log(log: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    A new_pool event of a V2 factory PairCreated or V3 factory PoolCreated log, None for other logs.
+    Decoding only, token decimals are resolved later (see discovery.NewPoolTracker).
+    V2 pools get the fee of pools.Pool (300), V3 pools their fee in pips.
+    """
+    topics = log['topics']
+    if log.get('removed') or not topics:
+        return None
+    data = bytes.fromhex(log['data'][2:])
+    if topics[0] == PAIR_CREATED_EVENT_SELECTOR:
+        pool, fee, version = data[12:32], 300, 2
+    elif topics[0] == POOL_CREATED_EVENT_SELECTOR:
+        pool, fee, version = data[44:64], int(topics[3], 16), 3
+    else:
+        return None
+    return {
+        'type': 'new_pool',
+        'block_number': int(log['blockNumber'], 16),
+        'factory': Web3.to_checksum_address(log['address']),
+        'pool': Web3.to_checksum_address(pool),
+        'token0': Web3.to_checksum_address(topics[1][-40:]),
+        'token1': Web3.to_checksum_address(topics[2][-40:]),
+        'fee': fee,
+        'version': version,
+    }
+
+
+async def fetch_token_decimals(https_url: str,
+                               tokens: Iterable[str],
+                               session: Optional[aiohttp.ClientSession] = None) -> Dict[str, int]:
+    """
+    decimals() of tokens in one JSON-RPC batch, tokens whose call fails are left out
+    """
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await fetch_token_decimals(https_url, tokens, session)
+
+    tokens = list(tokens)
+    if not tokens:
+        return {}
+    batch = [
+        {
+            'id': i,
+            'method': 'eth_call',
+            'jsonrpc': '2.0',
+            'params': [{'to': token, 'data': DECIMALS_SELECTOR}, 'latest'],
+        }
+        for i, token in enumerate(tokens)
+    ]
+    async with session.post(url=https_url, headers={'content-type': 'application/json'}, data=json.dumps(batch)) as r:
+        res = await r.json()
+
+    decimals = {}
+    for response in res:
+        result = response.get('result')
+        if result and len(result) >= 66:
+            decimals[tokens[response['id']]] = int(result[2:66], 16)
+    return decimals
+
+
+async def fetch_pool_states(https_url: str,
+                            pool_ids: Iterable[int],
+                            session: Optional[aiohttp.ClientSession] = None,
+                            v3_pool_ids: Iterable[int] = (),
+                            block: str = 'latest') -> Dict[int, List[int]]:
+    """
+    Current state of pools in one JSON-RPC batch, the getReserves() / slot0() calls of the
+    startup multicalls, in the format of decode_touched_pool_logs:
+
+    - V2 pools: [reserve0, reserve1]
+    - V3 pools (v3_pool_ids): [sqrtPriceX96, liquidity, tick]
+
+    Pools whose calls fail are left out. Pools are passed and returned as addresses.ADDRESSES ids.
+    """
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await fetch_pool_states(https_url, pool_ids, session, v3_pool_ids, block)
+
+    v3_pool_ids = set(v3_pool_ids)
+    calls = []  # (pool id, selector), the request id is the index
+    for pool_id in pool_ids:
+        if pool_id in v3_pool_ids:
+            calls.extend([(pool_id, SLOT0_SELECTOR), (pool_id, LIQUIDITY_SELECTOR)])
+        else:
+            calls.append((pool_id, GET_RESERVES_SELECTOR))
+    if not calls:
+        return {}
+    batch = [
+        {
+            'id': i,
+            'method': 'eth_call',
+            'jsonrpc': '2.0',
+            'params': [{'to': ADDRESSES.address(pool_id), 'data': selector}, block],
+        }
+        for i, (pool_id, selector) in enumerate(calls)
+    ]
+    async with session.post(url=https_url, headers={'content-type': 'application/json'}, data=json.dumps(batch)) as r:
+        res = await r.json()
+
+    results: Dict[int, Dict[str, bytes]] = {}
+    for response in res:
+        result = response.get('result')
+        if result and len(result) >= 66:
+            pool_id, selector = calls[response['id']]
+            results.setdefault(pool_id, {})[selector] = bytes.fromhex(result[2:])
+
+    states = {}
+    for pool_id, words in results.items():
+        if pool_id in v3_pool_ids:
+            slot0, liquidity = words.get(SLOT0_SELECTOR), words.get(LIQUIDITY_SELECTOR)
+            if slot0 is None or len(slot0) < 64 or liquidity is None:
+                continue
+            states[pool_id] = [
+                int.from_bytes(slot0[0:32], 'big'),
+                int.from_bytes(liquidity[0:32], 'big'),
+                int.from_bytes(slot0[32:64], 'big', signed=True),
+            ]
+        else:
+            reserves = words[GET_RESERVES_SELECTOR]
+            if len(reserves) < 64:
+                continue
+            states[pool_id] = [int.from_bytes(reserves[0:32], 'big'), int.from_bytes(reserves[32:64], 'big')]
+    return states
+
+
 if __name__ == '__main__':
     import asyncio
     from web3 import Web3